@@ -0,0 +1,130 @@
+"""Performance benchmarks for Mako.
+
+The benchmarks measure the lexer, code generation, template loading,
+rendering and :class:`.TemplateLookup` hot paths, using only the standard
+library so that they can be run offline against any checkout::
+
+    python -m bench
+    python -m bench --filter render --output results.json
+
+Each benchmark is run in a loop long enough to be timed reliably, the
+loop is repeated several times, and the best and mean time per call are
+reported.  With ``--output``, the results are also written as JSON, so
+that they can be compared between revisions.
+
+Benchmarks are plain functions decorated with :func:`.benchmark` within
+the ``bench_*`` modules of this package.  A benchmark function performs
+its setup and returns the callable to be timed; it may additionally
+return a dictionary of extra measurements, which are included in the
+results.
+
+"""
+
+import atexit
+import fnmatch
+import gc
+import json
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import timeit
+
+import mako
+
+_benchmarks = []
+
+
+def benchmark(fn):
+    """Register the given setup function as a benchmark."""
+
+    _benchmarks.append(fn)
+    return fn
+
+
+def tempdir(files=()):
+    """Create a temporary directory, removed at exit, containing the
+    given ``(name, text)`` files."""
+
+    dir_ = tempfile.mkdtemp(prefix="mako_bench_")
+    atexit.register(shutil.rmtree, dir_, True)
+    for name, text in files:
+        with open(os.path.join(dir_, name), "w") as f:
+            f.write(text)
+    return dir_
+
+
+def _load():
+    from bench import bench_lexer  # noqa
+    from bench import bench_lookup  # noqa
+    from bench import bench_render  # noqa
+    from bench import bench_template  # noqa
+
+    return list(_benchmarks)
+
+
+def _name(fn):
+    return "%s.%s" % (fn.__module__.rsplit(".", 1)[-1][6:], fn.__name__)
+
+
+def _time(fn, repeat):
+    setup = fn()
+    if isinstance(setup, tuple):
+        target, extra = setup
+    else:
+        target, extra = setup, {}
+
+    timer = timeit.Timer(target)
+    gc.collect()
+    loops, _ = timer.autorange()
+    times = [t / loops for t in timer.repeat(repeat, loops)]
+    return {
+        "name": _name(fn),
+        "loops": loops,
+        "min": min(times),
+        "mean": statistics.mean(times),
+        "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "extra": extra,
+    }
+
+
+def run(patterns=None, repeat=5, out=print):
+    """Run the benchmarks whose names match any of the given patterns,
+    reporting each result to ``out`` and returning the results."""
+
+    results = []
+    for fn in _load():
+        name = _name(fn)
+        if patterns and not any(
+            fnmatch.fnmatchcase(name, "*%s*" % p) for p in patterns
+        ):
+            continue
+        result = _time(fn, repeat)
+        results.append(result)
+        out(
+            "%-45s %12.3f us  (mean %.3f us +- %.3f)%s"
+            % (
+                name,
+                result["min"] * 1e6,
+                result["mean"] * 1e6,
+                result["stdev"] * 1e6,
+                "".join(
+                    "  %s=%s" % item
+                    for item in sorted(result["extra"].items())
+                ),
+            )
+        )
+    return {
+        "mako": mako.__version__,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "benchmarks": results,
+    }
+
+
+def dump(results, path):
+    """Write the given results to a JSON file."""
+
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
@@ -0,0 +1,35 @@
+import argparse
+
+import bench
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m bench", description="Run the Mako benchmarks."
+    )
+    parser.add_argument(
+        "--filter",
+        "-k",
+        action="append",
+        dest="patterns",
+        help="Only run benchmarks whose name contains the given text; "
+        "may be given more than once.",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="Number of times each timing loop is repeated.",
+    )
+    parser.add_argument(
+        "--output", "-o", help="Write the results as JSON to the given file."
+    )
+    options = parser.parse_args(argv)
+
+    results = bench.run(options.patterns, options.repeat)
+    if options.output:
+        bench.dump(results, options.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+from bench import benchmark
+from mako import codegen
+from mako.lexer import Lexer
+
+
+def large_template(sections=200):
+    """Return a template source exercising most of the lexer's
+    constructs, repeated ``sections`` times."""
+
+    section = """\
+## section NN
+<%def name="item_NN(x, y=5)">
+    <div class="item" id="item-NN">${x | h} and ${y}</div>
+</%def>
+<%
+    values_NN = [i * NN for i in range(10)]
+%>
+% for v in values_NN:
+    % if v % 2:
+        <span>${v}</span> ${item_NN(v)}
+    % else:
+        <b>${v | h, trim}</b>
+    % endif
+% endfor
+<%call expr="item_NN(1)">caller body ${"text"}</%call>
+<%doc>
+    Documentation for section NN.
+</%doc>
+Some plain text with a ${"substitution"} and a \\
+continued line.
+"""
+    return "".join(section.replace("NN", str(n)) for n in range(sections))
+
+
+SOURCE = large_template()
+
+
+@benchmark
+def parse_large():
+    def go():
+        Lexer(SOURCE).parse()
+
+    return go, {"bytes": len(SOURCE)}
+
+
+@benchmark
+def parse_1mb():
+    source = large_template(2200)
+
+    def go():
+        Lexer(source).parse()
+
+    return go, {"bytes": len(source)}
+
+
+@benchmark
+def compile_large():
+    node = Lexer(SOURCE).parse()
+
+    def go():
+        codegen.compile(node, "bench_large", default_filters=["str"])
+
+    return go
@@ -0,0 +1,109 @@
+import operator
+import timeit
+
+from bench import benchmark
+from bench import tempdir
+from mako import util
+from mako.lookup import TemplateLookup
+
+NAMES = ["page_%d.html" % i for i in range(20)]
+
+
+def _lookup(filesystem_checks):
+    dir_ = tempdir([(name, "page ${x}") for name in NAMES])
+    lookup = TemplateLookup(
+        directories=[dir_], filesystem_checks=filesystem_checks
+    )
+    for name in NAMES:
+        lookup.get_template(name)
+    return lookup
+
+
+@benchmark
+def get_template_filesystem_checks():
+    lookup = _lookup(True)
+
+    def go():
+        for name in NAMES:
+            lookup.get_template(name)
+
+    return go
+
+
+@benchmark
+def get_template_no_filesystem_checks():
+    lookup = _lookup(False)
+
+    def go():
+        for name in NAMES:
+            lookup.get_template(name)
+
+    return go
+
+
+class _SortedLRUCache(dict):
+    """The LRUCache of Mako 1.4.1 and earlier, which timestamps each
+    access and sorts all items when overflowing, for comparison with
+    :class:`mako.util.LRUCache`."""
+
+    class _Item:
+        def __init__(self, key, value):
+            self.key = key
+            self.value = value
+            self.timestamp = timeit.default_timer()
+
+    def __init__(self, capacity, threshold=0.5):
+        self.capacity = capacity
+        self.threshold = threshold
+
+    def __getitem__(self, key):
+        item = dict.__getitem__(self, key)
+        item.timestamp = timeit.default_timer()
+        return item.value
+
+    def __setitem__(self, key, value):
+        item = dict.get(self, key)
+        if item is None:
+            item = self._Item(key, value)
+            dict.__setitem__(self, key, item)
+        else:
+            item.value = value
+        self._manage_size()
+
+    def _manage_size(self):
+        while len(self) > self.capacity + self.capacity * self.threshold:
+            bytime = sorted(
+                dict.values(self),
+                key=operator.attrgetter("timestamp"),
+                reverse=True,
+            )
+            for item in bytime[self.capacity :]:
+                try:
+                    del self[item.key]
+                except KeyError:
+                    break
+
+
+def _lru_benchmark(cache):
+    # twice as many keys as the capacity, accessed as TemplateLookup
+    # does, so that both implementations are evicting items
+    keys = list(range(cache.capacity * 2))
+
+    def go():
+        for key in keys:
+            try:
+                cache[key]
+            except KeyError:
+                cache[key] = key
+
+    return go, {"capacity": cache.capacity}
+
+
+@benchmark
+def lru_cache():
+    return _lru_benchmark(util.LRUCache(100, threshold=0))
+
+
+@benchmark
+def lru_cache_sorted():
+    return _lru_benchmark(_SortedLRUCache(100))
@@ -0,0 +1,288 @@
+import sys
+
+from bench import benchmark
+from mako.exceptions import RichTraceback
+from mako.lookup import TemplateLookup
+from mako.runtime import Context
+from mako.template import Template
+
+
+class _CountingBuffer(list):
+    """Output buffer which counts the calls made to its ``write()``."""
+
+    def write(self, text):
+        self.append(text)
+
+
+def _writes(template, **data):
+    buf = _CountingBuffer()
+    template.render_context(Context(buf, **data))
+    return len(buf)
+
+
+def _inheritance_lookup(depth):
+    lookup = TemplateLookup()
+    lookup.put_string(
+        "base",
+        """
+<html>
+<head><%block name="title">base</%block></head>
+<body>${next.body()}</body>
+</html>
+""",
+    )
+    parent = "base"
+    for n in range(depth):
+        lookup.put_string(
+            "level_%d" % n,
+            """
+<%%inherit file="%s"/>
+<%%block name="title">level %d ${parent.title()}</%%block>
+<div class="level-%d">${next.body()}</div>
+""" % (parent, n, n),
+        )
+        parent = "level_%d" % n
+    lookup.put_string(
+        "page",
+        """
+<%%inherit file="%s"/>
+<p>page content ${x}</p>
+""" % parent,
+    )
+    return lookup
+
+
+@benchmark
+def inheritance_chain():
+    template = _inheritance_lookup(5).get_template("page")
+
+    def go():
+        template.render(x=5)
+
+    return go, {"writes": _writes(template, x=5)}
+
+
+def _include_fan_template():
+    lookup = TemplateLookup()
+    lookup.put_string("leaf", "<%page args='n'/><li>leaf ${n}</li>")
+    for level, child in (("mid", "leaf"), ("top", "mid")):
+        lookup.put_string(
+            level,
+            "<%%page args='n=0'/><ul>\n%s</ul>\n"
+            % "".join(
+                "<%%include file='%s' args='n=%d'/>\n" % (child, i)
+                for i in range(8)
+            ),
+        )
+    return lookup.get_template("top")
+
+
+@benchmark
+def include_fan():
+    template = _include_fan_template()
+
+    def go():
+        template.render()
+
+    return go, {"writes": _writes(template)}
+
+
+@benchmark
+def include_fan_large_context():
+    # every include copies the render namespace, so a wide set of
+    # render() arguments is multiplied by the number of includes
+    template = _include_fan_template()
+    data = {"value_%d" % i: i for i in range(200)}
+
+    def go():
+        template.render(**data)
+
+    return go, {"writes": _writes(template, **data)}
+
+
+LOOP_SOURCE = """
+<table>
+% for row in rows:
+    <tr class="${'odd' if loop.odd else 'even'}">
+    % for col in row:
+        <td>${col}</td>
+    % endfor
+    </tr>
+% endfor
+</table>
+"""
+
+NO_LOOP_SOURCE = """
+<table>
+% for i, row in enumerate(rows):
+    <tr class="${'odd' if i % 2 else 'even'}">
+    % for col in row:
+        <td>${col}</td>
+    % endfor
+    </tr>
+% endfor
+</table>
+"""
+
+ROWS = [list(range(10)) for i in range(50)]
+
+
+@benchmark
+def for_loop_enabled():
+    template = Template(LOOP_SOURCE, enable_loop=True)
+
+    def go():
+        template.render(rows=ROWS)
+
+    return go, {"writes": _writes(template, rows=ROWS)}
+
+
+@benchmark
+def for_loop_disabled():
+    template = Template(NO_LOOP_SOURCE, enable_loop=False)
+
+    def go():
+        template.render(rows=ROWS)
+
+    return go, {"writes": _writes(template, rows=ROWS)}
+
+
+DEF_LOOP_SOURCE = """
+<%def name="cell(value)">\
+<td class="${css}" title="${title}">${fmt % (value, len(label))}</td>\
+</%def>
+% for i in range(500):
+${cell(i)}
+% endfor
+"""
+
+DEF_LOOP_DATA = {"css": "c", "title": "t", "fmt": "%d/%d", "label": "abc"}
+
+
+def _def_loop(direct_context_lookups=False, inline=False):
+    source = DEF_LOOP_SOURCE
+    if inline:
+        source = source.replace('"cell(value)"', '"cell(value)" inline="True"')
+    template = Template(source, direct_context_lookups=direct_context_lookups)
+
+    def go():
+        template.render(**DEF_LOOP_DATA)
+
+    return go, {"writes": _writes(template, **DEF_LOOP_DATA)}
+
+
+@benchmark
+def def_loop():
+    return _def_loop()
+
+
+@benchmark
+def def_loop_direct_lookups():
+    return _def_loop(direct_context_lookups=True)
+
+
+@benchmark
+def def_loop_inline():
+    return _def_loop(inline=True)
+
+
+FILTER_VALUES = [
+    "<a href='x?y=%d&z=\"w\"'>text %d</a>" % (i, i) for i in range(50)
+]
+
+
+def _filter_benchmark(filter_):
+    template = Template(
+        "% for v in values:\n${v | " + filter_ + "}\n% endfor\n"
+    )
+
+    def go():
+        template.render(values=FILTER_VALUES)
+
+    return go
+
+
+@benchmark
+def filter_h():
+    return _filter_benchmark("h")
+
+
+@benchmark
+def filter_u():
+    return _filter_benchmark("u")
+
+
+@benchmark
+def filter_x():
+    return _filter_benchmark("x")
+
+
+@benchmark
+def str_expressions():
+    template = Template(
+        "% for i in range(200):\n"
+        "<td class=\"${'odd' if i % 2 else 'even'}\">"
+        "${f'{i:03d}'} ${'%s/%s' % (i, n)}</td>\n"
+        "% endfor\n"
+    )
+
+    def go():
+        template.render(n=200)
+
+    return go
+
+
+@benchmark
+def literal_text():
+    template = Template(
+        "".join(
+            "<p>paragraph %d</p>\n## comment\n${'constant'}\n" % i
+            for i in range(100)
+        )
+    )
+
+    def go():
+        template.render()
+
+    return go, {"writes": _writes(template)}
+
+
+@benchmark
+def format_exceptions():
+    template = Template("${foo.bar}", format_exceptions=True)
+
+    def go():
+        template.render(foo=None)
+
+    return go
+
+
+@benchmark
+def rich_traceback():
+    template = Template(
+        "".join("<p>${x} %d</p>\n" % i for i in range(2000)) + "${foo.bar}"
+    )
+    try:
+        template.render(x=1, foo=None)
+    except AttributeError:
+        error, tback = sys.exc_info()[1:]
+
+    def go():
+        RichTraceback(error, tback)
+
+    return go
+
+
+@benchmark
+def cached_def_memory():
+    template = Template(
+        """<%def name="row(i)" cached="True" cache_key="${i}">"""
+        "<td>${i}</td></%def>\n"
+        "% for i in range(200):\n${row(i % 20)}\n% endfor\n",
+        cache_impl="memory",
+    )
+
+    def go():
+        template.render()
+
+    return go
@@ -0,0 +1,72 @@
+import os
+
+from bench import benchmark
+from bench import tempdir
+from bench.bench_lexer import large_template
+from mako.template import Template
+
+SOURCE = large_template(50)
+
+
+def _template_file():
+    dir_ = tempdir([("large.html", SOURCE)])
+    return os.path.join(dir_, "large.html")
+
+
+@benchmark
+def load_file():
+    filename = _template_file()
+
+    def go():
+        Template(filename=filename)
+
+    return go
+
+
+@benchmark
+def load_file_module_directory():
+    filename = _template_file()
+    module_directory = tempdir()
+
+    # the module is generated on the first load; the timed loads
+    # import the existing module file
+    Template(filename=filename, module_directory=module_directory)
+
+    def go():
+        Template(filename=filename, module_directory=module_directory)
+
+    return go
+
+
+@benchmark
+def load_file_compile_cache():
+    filename = _template_file()
+    compile_cache_dir = tempdir()
+
+    Template(filename=filename, compile_cache_dir=compile_cache_dir)
+
+    def go():
+        Template(filename=filename, compile_cache_dir=compile_cache_dir)
+
+    return go
+
+
+@benchmark
+def load_file_module_bytecode():
+    filename = _template_file()
+    module_directory = tempdir()
+
+    Template(
+        filename=filename,
+        module_directory=module_directory,
+        module_bytecode=True,
+    )
+
+    def go():
+        Template(
+            filename=filename,
+            module_directory=module_directory,
+            module_bytecode=True,
+        )
+
+    return go
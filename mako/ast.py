@@ -92,7 +92,9 @@ class PythonFragment(PythonCode):
     """
 
     def __init__(self, code, **exception_kwargs):
-        m = re.match(r"^(\w+)(?:\s+(.*?))?:\s*(#|$)", code.strip(), re.S)
+        m = re.match(
+            r"^(?:async\s+)?(\w+)(?:\s+(.*?))?:\s*(#|$)", code.strip(), re.S
+        )
         if not m:
             raise exceptions.CompileException(
                 "Fragment '%s' is not a partial control statement" % code,
@@ -4,12 +4,18 @@
 # This module is part of Mako and is released under
 # the MIT License: http://www.opensource.org/licenses/mit-license.php
 
+import hashlib
+import threading
+import time
+import weakref
+
 from mako import util
 
 _cache_plugins = util.PluginLoader("mako.cache")
 
 register_plugin = _cache_plugins.register
 register_plugin("beaker", "mako.ext.beaker_cache", "BeakerCacheImpl")
+register_plugin("memory", "mako.cache", "MemoryCacheImpl")
 
 
 class Cache:
@@ -70,6 +76,8 @@ class Cache:
         self.id = template.module.__name__
         self.starttime = template.module._modified_time
         self._def_regions = {}
+        self._creations = {}
+        self._creations_lock = threading.Lock()
         self.impl = self._load_impl(self.template.cache_impl)
 
     def _load_impl(self, name):
@@ -83,14 +91,110 @@ class Cache:
 
     def _ctx_get_or_create(self, key, creation_function, context, **kw):
         """Retrieve a value from the cache, using the given creation function
-        to generate a new value."""
+        to generate a new value.
+
+        The creation function is called by only one thread at a time for a
+        given key, while the others wait for its value.  If the
+        ``stale_grace`` argument is given, an expired value continues to be
+        returned for that many seconds while one thread creates its
+        replacement.
+
+        """
+
+        key_args = kw.pop("__M_key_args", None)
 
         if not self.template.cache_enabled:
             return creation_function()
 
+        kw, mako_kw = self._get_impl_kw(kw, context)
+        if key_args is not None:
+            key = mako_kw.get("key_generator", generate_key)(key, key_args)
+
+        stale_grace = mako_kw.get("stale_grace")
+        if stale_grace and kw.get("timeout"):
+            return self._get_or_create_stale(
+                key, creation_function, stale_grace, kw
+            )
+
         return self.impl.get_or_create(
-            key, creation_function, **self._get_cache_kw(kw, context)
+            key, lambda: self._create(key, creation_function, kw), **kw
+        )
+
+    def _get_or_create_stale(self, key, creation_function, stale_grace, kw):
+        # the value is stored along with its creation time, and kept by
+        # the CacheImpl for the grace period beyond its timeout
+        timeout = float(kw["timeout"])
+        kw["timeout"] = timeout + float(stale_grace)
+
+        def create():
+            return _CachedValue(creation_function())
+
+        def replace():
+            # the new value is stored before other threads may begin to
+            # create it again
+            entry = create()
+            self.impl.set(key, entry, **kw)
+            return entry
+
+        entry = self.impl.get_or_create(
+            key, lambda: self._create(key, create, kw), **kw
         )
+        if (
+            isinstance(entry, _CachedValue)
+            and time.time() - entry.createdtime > timeout
+        ):
+            # one thread replaces the value, while any others return the
+            # stale value rather than waiting for it
+            new_entry = self._create(key, replace, kw, wait=False)
+            if new_entry is not _NO_VALUE:
+                entry = new_entry
+        return _CachedValue.unwrap(entry)
+
+    def _create(self, key, creation_function, kw, wait=True):
+        """Call the creation function for the given key, or if another
+        thread is already doing so, wait for its value.
+
+        If ``wait`` is ``False``, ``_NO_VALUE`` is returned rather than
+        waiting for another creator.
+
+        """
+
+        creation_key = _creation_key(key, kw)
+        with self._creations_lock:
+            creation = self._creations.get(creation_key)
+            if creation is None:
+                creation = self._creations[creation_key] = _Creation()
+                creator = True
+            else:
+                creator = False
+
+        if not creator:
+            if creation.thread == threading.get_ident():
+                # the value is needed again while it's being created, such
+                # as by another def with the same cache_key
+                return creation_function()
+            if not wait:
+                return _NO_VALUE
+            creation.done.wait()
+            if creation.value is _NO_VALUE:
+                # the creation function raised in the other thread
+                return creation_function()
+            return creation.value
+
+        try:
+            mutex = self.impl.get_mutex(key, **kw)
+            if mutex is None:
+                creation.value = creation_function()
+            elif mutex.acquire(wait):
+                try:
+                    creation.value = creation_function()
+                finally:
+                    mutex.release()
+            return creation.value
+        finally:
+            with self._creations_lock:
+                del self._creations[creation_key]
+            creation.done.set()
 
     def set(self, key, value, **kw):
         r"""Place a value in the cache.
@@ -101,7 +205,7 @@ class Cache:
 
         """
 
-        self.impl.set(key, value, **self._get_cache_kw(kw, None))
+        self.impl.set(key, value, **self._get_impl_kw(kw, None)[0])
 
     put = set
     """A synonym for :meth:`.Cache.set`.
@@ -120,7 +224,9 @@ class Cache:
          values will use that same backend.
 
         """
-        return self.impl.get(key, **self._get_cache_kw(kw, None))
+        return _CachedValue.unwrap(
+            self.impl.get(key, **self._get_impl_kw(kw, None)[0])
+        )
 
     def invalidate(self, key, **kw):
         r"""Invalidate a value in the cache.
@@ -132,7 +238,7 @@ class Cache:
          values will use that same backend.
 
         """
-        self.impl.invalidate(key, **self._get_cache_kw(kw, None))
+        self.impl.invalidate(key, **self._get_impl_kw(kw, None)[0])
 
     def invalidate_body(self):
         """Invalidate the cached content of the "body" method for this
@@ -178,6 +284,105 @@ class Cache:
             tmpl_kw.setdefault("context", context)
         return tmpl_kw
 
+    def _get_impl_kw(self, kw, context):
+        """Return the arguments for the :class:`.CacheImpl`, along with a
+        dictionary of the arguments which are handled here instead."""
+
+        tmpl_kw = self._get_cache_kw(kw, context)
+        mako_kw = {}
+        for arg in ("stale_grace", "key_generator"):
+            if arg in tmpl_kw:
+                if not mako_kw:
+                    tmpl_kw = tmpl_kw.copy()
+                mako_kw[arg] = tmpl_kw.pop(arg)
+        return tmpl_kw, mako_kw
+
+
+def generate_key(name, args):
+    """Generate the key for a call to a cached ``<%def>`` or ``<%block>``
+    which uses ``cache_key="auto"``.
+
+    :param name: the name of the rendering callable, such as
+     ``"render_mydef"``.
+    :param args: a tuple of ``(argument name, value)`` pairs for each
+     argument declared by the def, where the names of variable arguments
+     include their ``*`` or ``**`` prefix.
+
+    The key is formed from the name and the ``repr()`` of each value, so
+    each value's ``repr()`` should represent its contents.  Keys longer
+    than 250 characters are shortened using a hash of the arguments.
+
+    .. versionadded:: 1.4.2
+
+    """
+    key = "%s(%s)" % (
+        name,
+        ", ".join(
+            "%s=%r"
+            % (
+                argname,
+                (sorted(value.items()) if argname.startswith("**") else value),
+            )
+            for argname, value in args
+        ),
+    )
+    if len(key) > 250:
+        key = "%s(%s)" % (
+            name,
+            hashlib.sha1(key.encode("utf-8", "backslashreplace")).hexdigest(),
+        )
+    return key
+
+
+_NO_VALUE = object()
+
+
+def _creation_key(key, kw):
+    """Return the key under which the creation of a value is tracked.
+
+    Values with the same key but created with different arguments, such
+    as in another region, are separate values.  Arguments which aren't
+    plain values, such as the context or a cache manager, are left out.
+
+    """
+
+    return (key,) + tuple(
+        sorted(
+            (name, value)
+            for name, value in kw.items()
+            if isinstance(value, (str, int, float, type(None)))
+        )
+    )
+
+
+class _Creation:
+    """A value being created by one thread, which other threads may wait
+    for."""
+
+    __slots__ = ("done", "value", "thread")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = _NO_VALUE
+        self.thread = threading.get_ident()
+
+
+class _CachedValue:
+    """A cached value stored along with its creation time, for values
+    which may be returned after they've expired."""
+
+    __slots__ = ("value", "createdtime")
+
+    def __init__(self, value):
+        self.value = value
+        self.createdtime = time.time()
+
+    @classmethod
+    def unwrap(cls, value):
+        if isinstance(value, cls):
+            return value.value
+        return value
+
 
 class CacheImpl:
     """Provide a cache implementation for use by :class:`.Cache`."""
@@ -190,6 +395,28 @@ class CacheImpl:
     :meth:`get_or_create <.CacheImpl.get_or_create>` as the name ``'context'``.
     """
 
+    def get_mutex(self, key, **kw):
+        r"""Return a mutex to be held while the value for the given key is
+        created.
+
+        :class:`.Cache` allows only one thread within the current process
+        to create a value at a time, while other threads wait for that
+        value.  A cache which is shared among processes may return a lock
+        shared among them, so that they create the value one at a time as
+        well.  The mutex must provide the ``acquire()`` and ``release()``
+        methods of ``threading.Lock``, where ``acquire(False)`` returns
+        ``False`` rather than waiting if the mutex is held elsewhere.
+
+        By default ``None`` is returned, in which case no mutex is held.
+
+        :param key: the value's key.
+        :param \**kw: cache configuration arguments.
+
+        .. versionadded:: 1.4.2
+
+        """
+        return None
+
     def get_or_create(self, key, creation_function, **kw):
         r"""Retrieve a value from the cache, using the given creation function
         to generate a new value.
@@ -235,3 +462,105 @@ class CacheImpl:
 
         """
         raise NotImplementedError()
+
+
+class _MemoryRegion:
+    """The values stored by :class:`.MemoryCacheImpl` for one region of one
+    template, along with a mutex for each key being created."""
+
+    def __init__(self, size):
+        self.values = util.LRUCache(size, threshold=0)
+        self._mutex = threading.Lock()
+        self._key_mutexes = weakref.WeakValueDictionary()
+
+    def key_mutex(self, key):
+        with self._mutex:
+            mutex = self._key_mutexes.get(key)
+            if mutex is None:
+                mutex = self._key_mutexes[key] = threading.Lock()
+            return mutex
+
+
+class MemoryCacheImpl(CacheImpl):
+    """A :class:`.CacheImpl` which stores values in a dictionary within
+    the current process.
+
+    Values are stored separately for each template, and are discarded
+    along with the :class:`.Template` object, or once the template is
+    recompiled.  The following cache arguments are accepted:
+
+    * ``timeout`` - the number of seconds after which a value expires.
+    * ``size`` - the number of values which are kept for the template,
+      beyond which the least recently used values are discarded.  Defaults
+      to 1000.
+    * ``region`` - the name of a separate set of values to use.  Each
+      region keeps its own ``size`` values.
+    * ``regions`` - a dictionary of region names to dictionaries of
+      default arguments for each region, such as
+      ``{"short_term": {"timeout": 60}}``.
+
+    :meth:`.get_or_create` calls the creation function only once for a key,
+    while any other threads requesting that key wait for its value.
+
+    .. versionadded:: 1.4.2
+
+    """
+
+    default_size = 1000
+
+    def __init__(self, cache):
+        super().__init__(cache)
+        self._regions = {}
+        self._regions_mutex = threading.Lock()
+
+    def _get_region(self, kw):
+        name = kw.get("region")
+        if name is not None and name in kw.get("regions", ()):
+            kw = dict(kw["regions"][name], **kw)
+        try:
+            region = self._regions[name]
+        except KeyError:
+            with self._regions_mutex:
+                region = self._regions.get(name)
+                if region is None:
+                    region = self._regions[name] = _MemoryRegion(
+                        int(kw.get("size", self.default_size))
+                    )
+        return region, kw.get("timeout")
+
+    def _get_value(self, region, key, timeout):
+        try:
+            value, createdtime = region.values[key]
+        except KeyError:
+            return None, False
+        if createdtime < self.cache.starttime or (
+            timeout and time.time() - createdtime > float(timeout)
+        ):
+            return None, False
+        return value, True
+
+    def get_or_create(self, key, creation_function, **kw):
+        region, timeout = self._get_region(kw)
+        value, found = self._get_value(region, key, timeout)
+        if found:
+            return value
+        with region.key_mutex(key):
+            value, found = self._get_value(region, key, timeout)
+            if not found:
+                value = creation_function()
+                region.values[key] = (value, time.time())
+        return value
+
+    def set(self, key, value, **kw):
+        region, timeout = self._get_region(kw)
+        region.values[key] = (value, time.time())
+
+    put = set
+
+    def get(self, key, **kw):
+        region, timeout = self._get_region(kw)
+        return self._get_value(region, key, timeout)[0]
+
+    def invalidate(self, key, **kw):
+        region, timeout = self._get_region(kw)
+        region.values.pop(key, None)
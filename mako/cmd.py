@@ -4,11 +4,17 @@
 # This module is part of Mako and is released under
 # the MIT License: http://www.opensource.org/licenses/mit-license.php
 from argparse import ArgumentParser
+import importlib
+import os
 from os.path import dirname
 from os.path import isfile
 import sys
+import time
 
 from mako import exceptions
+from mako.lookup import _load_uri
+from mako.lookup import _load_uri_in_worker
+from mako.lookup import _process_pool
 from mako.lookup import TemplateLookup
 from mako.template import Template
 
@@ -95,5 +101,152 @@ def cmdline(argv=None):
             sys.stdout.write(rendered)
 
 
+def _import_lookup(path):
+    modulename, _, attrs = path.partition(":")
+    if not attrs:
+        raise SystemExit(
+            "error: --lookup must be given as 'package.module:attribute'"
+        )
+    try:
+        obj = importlib.import_module(modulename)
+        for token in attrs.split("."):
+            obj = getattr(obj, token)
+    except (ImportError, AttributeError) as err:
+        raise SystemExit("error: can't import %s: %s" % (path, err))
+    if not isinstance(obj, TemplateLookup):
+        raise SystemExit("error: %s is not a TemplateLookup" % path)
+    return obj
+
+
+def compile_cmdline(argv=None):
+    """Compile all templates within the directories of a
+    :class:`.TemplateLookup` into their Python module files ahead of time.
+
+    Modules are generated the same way as they would be on first use
+    of :meth:`.TemplateLookup.get_template`, so that the
+    ``modulename_callable`` and ``module_writer`` of the lookup are
+    honored, and a module which is already up to date is not generated
+    again.
+
+    """
+
+    parser = ArgumentParser(
+        description="Compile the templates of a TemplateLookup into "
+        "Python module files ahead of time."
+    )
+    parser.add_argument(
+        "--lookup",
+        default=None,
+        help="TemplateLookup to compile templates for, given as "
+        "'package.module:attribute'.  Using the application's own lookup "
+        "ensures templates are compiled with the same options they will "
+        "be loaded with.  Where worker processes can't be forked, the "
+        "lookup must be picklable when --workers is greater than 1.",
+    )
+    parser.add_argument(
+        "--template-dir",
+        default=[],
+        action="append",
+        help="Directory containing templates (multiple directories may "
+        "be provided).  Used when --lookup is not given.",
+    )
+    parser.add_argument(
+        "--module-dir",
+        default=None,
+        help="Directory in which to write generated modules.  Used when "
+        "--lookup is not given.",
+    )
+    parser.add_argument(
+        "--compile-cache-dir",
+        default=None,
+        help="Directory of a compile cache in which to store generated "
+        "modules.  Used when --lookup is not given.",
+    )
+    parser.add_argument(
+        "--module-bytecode",
+        action="store_true",
+        help="Also write the compiled code of each module alongside it.  "
+        "Used when --lookup is not given.",
+    )
+    parser.add_argument(
+        "--pattern",
+        default=[],
+        action="append",
+        help="Only compile templates whose URI matches this glob "
+        "pattern, e.g. '*.html' (can be used multiple times)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes to compile with; defaults to "
+        "the number of CPUs.  A value of 1 compiles in this process.",
+    )
+
+    options = parser.parse_args(argv)
+
+    if options.lookup:
+        lookup = _import_lookup(options.lookup)
+    elif options.template_dir:
+        lookup = TemplateLookup(
+            options.template_dir,
+            module_directory=options.module_dir,
+            compile_cache_dir=options.compile_cache_dir,
+            module_bytecode=options.module_bytecode,
+        )
+    else:
+        raise SystemExit(
+            "error: one of --lookup or --template-dir is required"
+        )
+
+    if (
+        lookup.module_directory is None
+        and lookup.modulename_callable is None
+        and lookup.compile_cache_dir is None
+    ):
+        raise SystemExit(
+            "error: the lookup has no module_directory, "
+            "modulename_callable or compile_cache_dir to write modules to"
+        )
+
+    uris = lookup._find_uris(options.pattern)
+    workers = options.workers or os.cpu_count() or 1
+
+    start = time.perf_counter()
+    failed = skipped = 0
+    if workers > 1 and len(uris) > 1:
+        try:
+            executor = _process_pool(lookup, workers)
+        except exceptions.RuntimeException as err:
+            raise SystemExit("error: %s; use --workers 1" % err)
+        results = executor.map(_load_uri_in_worker, uris)
+    else:
+        executor = None
+        results = (_load_uri(lookup, uri) for uri in uris)
+
+    try:
+        for uri, elapsed, error, undecodable in results:
+            if undecodable:
+                # files found alongside the templates which aren't
+                # text, such as images, are passed over
+                skipped += 1
+                sys.stdout.write("%s skipped: %s\n" % (uri, error))
+            elif error is not None:
+                failed += 1
+                sys.stderr.write("%s: %s\n" % (uri, error))
+            else:
+                sys.stdout.write("%s %.3fs\n" % (uri, elapsed))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    sys.stdout.write(
+        "compiled %d templates (%d failed, %d skipped) in %.3fs\n"
+        % (len(uris) - skipped, failed, skipped, time.perf_counter() - start)
+    )
+    if failed:
+        sys.exit(1)
+
+
 if __name__ == "__main__":
     cmdline()
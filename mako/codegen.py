@@ -7,14 +7,21 @@
 """provides functionality for rendering a parsetree constructing into module
 source code."""
 
+import _ast
+import ast as pyast
+import copy
+import io
 import json
 import re
 import time
+import tokenize
+import warnings
 
 from mako import ast
 from mako import exceptions
 from mako import filters
 from mako import parsetree
+from mako import pyparser
 from mako import util
 from mako.pygen import PythonPrinter
 
@@ -40,10 +47,14 @@ def compile(  # noqa
     strict_undefined=False,
     enable_loop=True,
     reserved_names=frozenset(),
+    enable_async=False,
+    direct_context_lookups=False,
 ):
     """Generate module source code given a parsetree node,
     uri, and optional source filename"""
 
+    _inline_defs(node)
+
     buf = util.FastEncodingBuffer()
 
     printer = PythonPrinter(buf)
@@ -61,6 +72,8 @@ def compile(  # noqa
             strict_undefined,
             enable_loop,
             reserved_names,
+            enable_async,
+            direct_context_lookups,
         ),
         node,
     )
@@ -81,6 +94,8 @@ class _CompileContext:
         strict_undefined,
         enable_loop,
         reserved_names,
+        enable_async,
+        direct_context_lookups,
     ):
         self.uri = uri
         self.filename = filename
@@ -93,6 +108,8 @@ class _CompileContext:
         self.strict_undefined = strict_undefined
         self.enable_loop = enable_loop
         self.reserved_names = reserved_names
+        self.enable_async = enable_async
+        self.direct_context_lookups = direct_context_lookups
 
 
 class _GenerateRenderMethod:
@@ -171,6 +188,27 @@ class _GenerateRenderMethod:
     def identifiers(self):
         return self.identifier_stack[-1]
 
+    @property
+    def def_keyword(self):
+        """the keyword which begins the definition of a rendering
+        function."""
+
+        if self.compiler.enable_async:
+            return "async def"
+        else:
+            return "def"
+
+    def await_call(self, text):
+        """return the given expression, awaiting its result if it's a call
+        and the template is compiled with enable_async, so that the
+        output of a call to a def is written before the expression is
+        used."""
+
+        if self.compiler.enable_async and _is_call(text):
+            return "(await runtime._auto_await(%s))" % text
+        else:
+            return text
+
     def write_toplevel(self):
         """Traverse a template structure for module-level directives and
         generate the start of module-level code.
@@ -228,9 +266,13 @@ class _GenerateRenderMethod:
         self.printer.writeline("STOP_RENDERING = runtime.STOP_RENDERING")
         self.printer.writeline("__M_dict_builtin = dict")
         self.printer.writeline("__M_locals_builtin = locals")
+        if self.compiler.direct_context_lookups:
+            self.printer.writeline("__M_builtins = runtime.builtins.__dict__")
         self.printer.writeline("_magic_number = %r" % MAGIC_NUMBER)
         self.printer.writeline("_modified_time = %r" % time.time())
         self.printer.writeline("_enable_loop = %r" % self.compiler.enable_loop)
+        if self.compiler.enable_async:
+            self.printer.writeline("_enable_async = True")
         self.printer.writeline(
             "_template_filename = %r" % self.compiler.filename
         )
@@ -296,7 +338,7 @@ class _GenerateRenderMethod:
 
         self.printer.start_source(node.lineno)
         self.printer.writelines(
-            "def %s(%s):" % (name, ",".join(args)),
+            "%s %s(%s):" % (self.def_keyword, name, ",".join(args)),
             # push new frame, assign current frame to __M_caller
             "__M_caller = context.caller_stack._push_frame()",
             "try:",
@@ -326,8 +368,7 @@ class _GenerateRenderMethod:
 
         self.write_variable_declares(self.identifiers, toplevel=True)
 
-        for n in self.node.nodes:
-            n.accept_visitor(self)
+        self.write_nodes(self.node.nodes)
 
         self.write_def_finish(self.node, buffered, filtered, cached)
         self.printer.writeline(None)
@@ -519,6 +560,12 @@ class _GenerateRenderMethod:
         if has_loop:
             self.printer.writeline("loop = __M_loop = runtime.LoopStack()")
 
+        if self.compiler.direct_context_lookups and any(
+            ident not in comp_idents and ident not in self.compiler.namespaces
+            for ident in to_write
+        ):
+            self.printer.writeline("__M_data = context._data")
+
         for ident in to_write:
             if ident in comp_idents:
                 comp = comp_idents[ident]
@@ -545,7 +592,8 @@ class _GenerateRenderMethod:
                             % (ident, ident),
                             "if %s is UNDEFINED:" % ident,
                             "try:",
-                            "%s = context[%r]" % (ident, ident),
+                            "%s = %s"
+                            % (ident, self._context_lookup(ident, True)),
                             "except KeyError:",
                             "raise NameError(\"'%s' is not defined\")" % ident,
                             None,
@@ -553,26 +601,52 @@ class _GenerateRenderMethod:
                         )
                     else:
                         self.printer.writeline(
-                            "%s = _import_ns.get"
-                            "(%r, context.get(%r, UNDEFINED))"
-                            % (ident, ident, ident)
+                            "%s = _import_ns.get(%r, %s)"
+                            % (ident, ident, self._context_lookup(ident))
                         )
                 else:
                     if self.compiler.strict_undefined:
                         self.printer.writelines(
                             "try:",
-                            "%s = context[%r]" % (ident, ident),
+                            "%s = %s"
+                            % (ident, self._context_lookup(ident, True)),
                             "except KeyError:",
                             "raise NameError(\"'%s' is not defined\")" % ident,
                             None,
                         )
                     else:
                         self.printer.writeline(
-                            "%s = context.get(%r, UNDEFINED)" % (ident, ident)
+                            "%s = %s" % (ident, self._context_lookup(ident))
                         )
 
         self.printer.writeline("__M_writer = context.writer()")
 
+    def _context_lookup(self, ident, strict=False):
+        """return an expression which looks up the given name within
+        the Context, falling back to builtins.
+
+        With ``direct_context_lookups``, the expression consults the
+        ``__M_data`` local established by write_variable_declares()
+        instead of calling a method on the Context.
+
+        """
+        if not self.compiler.direct_context_lookups:
+            if strict:
+                return "context[%r]" % ident
+            else:
+                return "context.get(%r, UNDEFINED)" % ident
+        elif strict:
+            return "__M_data[%r] if %r in __M_data else __M_builtins[%r]" % (
+                ident,
+                ident,
+                ident,
+            )
+        else:
+            return (
+                "__M_data[%r] if %r in __M_data "
+                "else __M_builtins.get(%r, UNDEFINED)" % (ident, ident, ident)
+            )
+
     def write_def_decl(self, node, identifiers):
         """write a locally-available callable referencing a top-level def"""
         funcname = node.funcname
@@ -603,7 +677,8 @@ class _GenerateRenderMethod:
                 "@runtime._decorate_inline(context, %s)" % decorator
             )
         self.printer.writeline(
-            "def %s(%s):" % (node.funcname, ",".join(namedecls))
+            "%s %s(%s):"
+            % (self.def_keyword, node.funcname, ",".join(namedecls))
         )
         filtered = len(node.filter_args.args) > 0
         buffered = eval(node.attributes.get("buffered", "False"))
@@ -621,8 +696,7 @@ class _GenerateRenderMethod:
         self.write_variable_declares(identifiers)
 
         self.identifier_stack.append(identifiers)
-        for n in node.nodes:
-            n.accept_visitor(self)
+        self.write_nodes(node.nodes)
         self.identifier_stack.pop()
 
         self.write_def_finish(node, buffered, filtered, cached)
@@ -702,6 +776,13 @@ class _GenerateRenderMethod:
         """write a post-function decorator to replace a rendering
         callable with a cached version of itself."""
 
+        if self.compiler.enable_async:
+            raise exceptions.CompileException(
+                "Caching is not supported for templates compiled with "
+                "enable_async",
+                **node_or_pagetag.exception_kwargs,
+            )
+
         self.printer.writeline("__M_%s = %s" % (name, name))
         cachekey = node_or_pagetag.parsed_attributes.get(
             "cache_key", repr(name)
@@ -719,8 +800,23 @@ class _GenerateRenderMethod:
             for pa in node_or_pagetag.parsed_attributes
             if pa.startswith("cache_") and pa != "cache_key"
         )
-        if "timeout" in cache_args:
-            cache_args["timeout"] = int(eval(cache_args["timeout"]))
+        for arg in ("timeout", "stale_grace"):
+            if arg in cache_args:
+                cache_args[arg] = int(eval(cache_args[arg]))
+
+        if node_or_pagetag.attributes.get("cache_key") == "auto":
+            # the key is generated from the name along with the arguments
+            # of each call.  pageargs holds all of the template's keyword
+            # arguments, so it isn't included
+            cachekey = repr(name)
+            key_args = [
+                a.split("=")[0]
+                for a in args
+                if a not in ("context", "**pageargs")
+            ]
+            cache_args["__M_key_args"] = "(%s)" % "".join(
+                "(%r, %s), " % (a, a.lstrip("*")) for a in key_args
+            )
 
         self.printer.writeline("def %s(%s):" % (name, ",".join(args)))
 
@@ -789,10 +885,18 @@ class _GenerateRenderMethod:
                     args = self.compiler.pagetag.filter_args.args + args
                 if self.compiler.default_filters and "n" not in args:
                     args = self.compiler.default_filters + args
-        for e in args:
+        for i, e in enumerate(args):
             # if filter given as a function, get just the identifier portion
             if e == "n":
                 continue
+            elif (
+                i == 0
+                and is_expression
+                and locate_encode(e) == "str"
+                and _is_str_expression(target)
+            ):
+                # the expression always produces a str already
+                continue
             m = re.match(r"(.+?)(\(.*\))", e)
             if m:
                 ident, fargs = m.group(1, 2)
@@ -804,6 +908,64 @@ class _GenerateRenderMethod:
             target = "%s(%s)" % (e, target)
         return target
 
+    def write_nodes(self, nodes):
+        """visit the given sequence of sibling nodes.
+
+        consecutive literal content, which includes text, the value of
+        constant expressions that aren't otherwise filtered, and comments
+        in between, is written with a single call to the writer."""
+
+        literal = []
+        for n in nodes:
+            content = self.literal_content(n)
+            if content is not None:
+                if not literal:
+                    self.printer.start_source(n.lineno)
+                literal.append(content)
+            elif not isinstance(n, parsetree.Comment):
+                if literal:
+                    self.printer.writeline("__M_writer(%r)" % "".join(literal))
+                    literal = []
+                n.accept_visitor(self)
+        if literal:
+            self.printer.writeline("__M_writer(%r)" % "".join(literal))
+
+    def literal_content(self, node):
+        """return the output of the given node if it's known at compile
+        time, else None."""
+
+        if isinstance(node, parsetree.Text):
+            return node.content
+        elif (
+            isinstance(node, parsetree.Expression)
+            and not node.code.undeclared_identifiers
+            and set(self.expression_filters(node)) <= {"str"}
+        ):
+            # an expression which produces a warning, such as for an
+            # invalid escape sequence, is left to be compiled as is so
+            # that the warning is reported against the template
+            with warnings.catch_warnings(record=True) as recorded:
+                warnings.simplefilter("always")
+                try:
+                    value = pyast.literal_eval(node.text.strip())
+                except (ValueError, TypeError, SyntaxError, MemoryError):
+                    return None
+            if isinstance(value, str) and not recorded:
+                return value
+        return None
+
+    def expression_filters(self, node):
+        """return the names of the filters applied to the given
+        expression, as determined by create_filter_callable()."""
+
+        args = node.escapes_code.args
+        if "n" not in args:
+            if self.compiler.pagetag:
+                args = self.compiler.pagetag.filter_args.args + args
+            if self.compiler.default_filters and "n" not in args:
+                args = self.compiler.default_filters + args
+        return [e for e in args if e != "n"]
+
     def visitExpression(self, node):
         self.printer.start_source(node.lineno)
         if (
@@ -815,11 +977,13 @@ class _GenerateRenderMethod:
             or len(self.compiler.default_filters)
         ):
             s = self.create_filter_callable(
-                node.escapes_code.args, "%s" % node.text, True
+                node.escapes_code.args, self.await_call(node.text), True
             )
             self.printer.writeline("__M_writer(%s)" % s)
         else:
-            self.printer.writeline("__M_writer(%s)" % node.text)
+            self.printer.writeline(
+                "__M_writer(%s)" % self.await_call(node.text)
+            )
 
     def visitControlLine(self, node):
         if node.isend:
@@ -830,8 +994,15 @@ class _GenerateRenderMethod:
                 self.printer.writeline(None)
         else:
             self.printer.start_source(node.lineno)
+            is_async = re.match(r"async\s", node.text) is not None
+            if is_async and not self.compiler.enable_async:
+                raise exceptions.CompileException(
+                    "'%s' requires the template to be compiled with "
+                    "enable_async" % node.text,
+                    **node.exception_kwargs,
+                )
             if self.compiler.enable_loop and node.keyword == "for":
-                text = mangle_mako_loop(node, self.printer)
+                text = mangle_mako_loop(node, self.printer, is_async)
             else:
                 text = node.text
             self.printer.writeline(text)
@@ -876,8 +1047,7 @@ class _GenerateRenderMethod:
             self.printer.writelines(
                 "__M_writer = context._push_writer()", "try:"
             )
-        for n in node.nodes:
-            n.accept_visitor(self)
+        self.write_nodes(node.nodes)
         if filtered:
             self.printer.writelines(
                 "finally:",
@@ -889,13 +1059,22 @@ class _GenerateRenderMethod:
                 None,
             )
 
+    def visitFlushTag(self, node):
+        self.printer.start_source(node.lineno)
+        self.printer.writeline("context._flush()")
+        self.write_nodes(node.nodes)
+
     def visitCode(self, node):
         if not node.ismodule:
             self.printer.write_indented_block(
                 node.text, starting_lineno=node.lineno
             )
 
-            if not self.in_def and len(self.identifiers.locally_assigned) > 0:
+            if (
+                not self.in_def
+                and not node.inlined
+                and len(self.identifiers.locally_assigned) > 0
+            ):
                 # if we are the "template" def, fudge locally
                 # declared/modified variables into the "__M_locals" dictionary,
                 # which is used for def calls within the same template,
@@ -913,15 +1092,19 @@ class _GenerateRenderMethod:
     def visitIncludeTag(self, node):
         self.printer.start_source(node.lineno)
         args = node.attributes.get("args")
+        if self.compiler.enable_async:
+            include = "await runtime._include_file_async"
+        else:
+            include = "runtime._include_file"
         if args:
             self.printer.writeline(
-                "runtime._include_file(context, %s, _template_uri, %s)"
-                % (node.parsed_attributes["file"], args)
+                "%s(context, %s, _template_uri, %s)"
+                % (include, node.parsed_attributes["file"], args)
             )
         else:
             self.printer.writeline(
-                "runtime._include_file(context, %s, _template_uri)"
-                % (node.parsed_attributes["file"])
+                "%s(context, %s, _template_uri)"
+                % (include, node.parsed_attributes["file"])
             )
 
     def visitNamespaceTag(self, node):
@@ -931,8 +1114,12 @@ class _GenerateRenderMethod:
         pass
 
     def visitBlockTag(self, node):
+        if self.compiler.enable_async:
+            call = "await "
+        else:
+            call = ""
         if node.is_anonymous:
-            self.printer.writeline("%s()" % node.funcname)
+            self.printer.writeline("%s%s()" % (call, node.funcname))
         else:
             nameargs = node.get_argument_expressions(as_call=True)
             nameargs += ["**pageargs"]
@@ -941,7 +1128,8 @@ class _GenerateRenderMethod:
                 "not hasattr(context._data['parent'], '%s'):" % node.funcname
             )
             self.printer.writeline(
-                "context['self'].%s(%s)" % (node.funcname, ",".join(nameargs))
+                "%scontext['self'].%s(%s)"
+                % (call, node.funcname, ",".join(nameargs))
             )
             self.printer.writeline("\n")
 
@@ -986,7 +1174,9 @@ class _GenerateRenderMethod:
         self.identifier_stack.pop()
 
         bodyargs = node.body_decl.get_argument_expressions()
-        self.printer.writeline("def body(%s):" % ",".join(bodyargs))
+        self.printer.writeline(
+            "%s body(%s):" % (self.def_keyword, ",".join(bodyargs))
+        )
 
         # TODO: figure out best way to specify
         # buffering/nonbuffering (at call time would be better)
@@ -996,8 +1186,7 @@ class _GenerateRenderMethod:
         self.write_variable_declares(body_identifiers)
         self.identifier_stack.append(body_identifiers)
 
-        for n in node.nodes:
-            n.accept_visitor(self)
+        self.write_nodes(node.nodes)
         self.identifier_stack.pop()
 
         self.write_def_finish(node, buffered, False, False, callstack=False)
@@ -1013,7 +1202,9 @@ class _GenerateRenderMethod:
         self.printer.start_source(node.lineno)
         self.printer.writelines(
             "__M_writer(%s)"
-            % self.create_filter_callable([], node.expression, True),
+            % self.create_filter_callable(
+                [], self.await_call(node.expression), True
+            ),
             "finally:",
             "context.caller_stack.nextcaller = None",
             None,
@@ -1141,9 +1332,10 @@ class _Identifiers:
     def visitCode(self, node):
         if not node.ismodule:
             self.check_declared(node)
-            self.locally_assigned = self.locally_assigned.union(
-                node.declared_identifiers()
-            )
+            if not node.inlined:
+                self.locally_assigned = self.locally_assigned.union(
+                    node.declared_identifiers()
+                )
 
     def visitNamespaceTag(self, node):
         # only traverse into the sub-elements of a
@@ -1268,13 +1460,94 @@ _FOR_LOOP = re.compile(
 )
 
 
-def mangle_mako_loop(node, printer):
+def _is_call(text):
+    """return True if the given Python expression is a function call."""
+
+    stmt = pyparser.parse(text.strip(), "exec").body[0]
+    return isinstance(stmt, _ast.Expr) and isinstance(stmt.value, _ast.Call)
+
+
+# methods of str which return a str
+_STR_METHODS = frozenset(
+    [
+        "capitalize",
+        "casefold",
+        "center",
+        "expandtabs",
+        "format",
+        "format_map",
+        "join",
+        "ljust",
+        "lower",
+        "lstrip",
+        "removeprefix",
+        "removesuffix",
+        "replace",
+        "rjust",
+        "rstrip",
+        "strip",
+        "swapcase",
+        "title",
+        "upper",
+        "zfill",
+    ]
+)
+
+
+def _is_str_expression(text):
+    """return True if the given Python expression always produces a str,
+    and not a subclass of str, such that str() doesn't need to be applied
+    to its value."""
+
+    try:
+        expr = pyparser.parse(text.strip(), "eval")
+    except exceptions.SyntaxException:
+        return False
+    return _is_str_node(expr.body)
+
+
+def _is_str_node(node):
+    if isinstance(node, _ast.Constant):
+        return type(node.value) is str
+    elif isinstance(node, _ast.JoinedStr):
+        return True
+    elif isinstance(node, _ast.IfExp):
+        return _is_str_node(node.body) and _is_str_node(node.orelse)
+    elif isinstance(node, _ast.BinOp):
+        if isinstance(node.op, _ast.Add):
+            return _is_str_node(node.left) and _is_str_node(node.right)
+        elif isinstance(node.op, _ast.Mod):
+            # the right side may not be a subclass of str, which could
+            # take over the operation with __rmod__()
+            return _is_str_node(node.left) and (
+                _is_str_node(node.right)
+                or isinstance(node.right, (_ast.Tuple, _ast.Dict))
+                or (
+                    isinstance(node.right, _ast.Constant)
+                    and type(node.right.value) in (int, float)
+                )
+            )
+    elif isinstance(node, _ast.Call):
+        return (
+            isinstance(node.func, _ast.Attribute)
+            and node.func.attr in _STR_METHODS
+            and _is_str_node(node.func.value)
+        )
+    return False
+
+
+def mangle_mako_loop(node, printer, is_async=False):
     """converts a for loop into a context manager wrapped around a for loop
     when access to the `loop` variable has been detected in the for loop body
     """
     loop_variable = LoopVariable()
     node.accept_visitor(loop_variable)
-    if loop_variable.detected:
+    if loop_variable.detected and is_async:
+        raise exceptions.CompileException(
+            "The loop context is not available within 'async for'",
+            **node.exception_kwargs,
+        )
+    elif loop_variable.detected:
         node.nodes[-1].has_loop_context = True
         match = _FOR_LOOP.match(node.text)
         if match:
@@ -1313,3 +1586,343 @@ class LoopVariable:
 
     def visitExpression(self, node):
         self._loop_reference_detected(node)
+
+
+def _inline_defs(node):
+    """Expand calls to the top-level defs of the given template which are
+    declared with ``inline="True"`` into the bodies of their callers.
+
+    Calls are expanded within the template body and within top-level defs
+    and named blocks; the inline defs themselves are also generated as
+    ordinary defs, which remain in use for any call that isn't expanded.
+
+    """
+
+    inline_defs = {
+        n.funcname: _InlineDef(n)
+        for n in node.nodes
+        if isinstance(n, parsetree.DefTag)
+        and eval(n.attributes.get("inline", "False"))
+    }
+    if not inline_defs:
+        return
+
+    for scope in [node] + node.nodes:
+        if scope is not node and (
+            not isinstance(scope, (parsetree.DefTag, parsetree.BlockTag))
+            or scope.is_anonymous
+            or scope.funcname in inline_defs
+        ):
+            continue
+
+        expanded = {}
+        scope.nodes = _expand_inline_calls(
+            scope.nodes, inline_defs, _bound_names(scope), (), expanded
+        )
+        if expanded:
+            # control lines keep a list of the nodes they contain, which
+            # is consulted when generating them
+            for n in scope.nodes:
+                if isinstance(n, parsetree.ControlLine):
+                    n.nodes = [
+                        c
+                        for child in n.nodes
+                        for c in expanded.get(child, [child])
+                    ]
+
+
+def _bound_names(scope):
+    """Return the names which are local to the Python function generated
+    for the given template or def, including those of its closures."""
+
+    if isinstance(scope, parsetree.TemplateNode):
+        names = set()
+    else:
+        names = set(scope.declared_identifiers())
+    names.add("pageargs")
+
+    stack = list(scope.nodes)
+    while stack:
+        n = stack.pop()
+        if isinstance(n, (parsetree.DefTag, parsetree.BlockTag)):
+            if n.is_root() and not n.is_anonymous:
+                continue
+            elif not n.is_anonymous:
+                names.add(n.funcname)
+        if hasattr(n, "declared_identifiers"):
+            names.update(n.declared_identifiers())
+        if isinstance(n, parsetree.Tag):
+            stack.extend(n.nodes)
+    return names
+
+
+def _expand_inline_calls(nodes, inline_defs, bound, stack, expanded):
+    """Return the given nodes with each call to an inline def that can be
+    expanded replaced by the nodes of the def's body.
+
+    ``expanded`` receives the nodes that were replaced, mapped to their
+    replacements.
+
+    """
+
+    result = []
+    for n in nodes:
+        replacement = None
+        if isinstance(n, parsetree.Expression) and not n.escapes:
+            try:
+                call = pyast.parse(n.text.strip(), mode="eval").body
+            except SyntaxError:
+                call = None
+            if (
+                isinstance(call, pyast.Call)
+                and isinstance(call.func, pyast.Name)
+                and call.func.id in inline_defs
+                and call.func.id not in stack
+                and call.func.id not in bound
+            ):
+                inline_def = inline_defs[call.func.id]
+                if not inline_def.undeclared.intersection(bound):
+                    replacement = inline_def.expand(n, call)
+        if replacement is None:
+            result.append(n)
+        else:
+            replacement = _expand_inline_calls(
+                replacement,
+                inline_defs,
+                bound,
+                stack + (call.func.id,),
+                expanded,
+            )
+            expanded[n] = replacement
+            result.extend(replacement)
+    return result
+
+
+class _InlineDef:
+    """A def declared with ``inline="True"``, prepared for expansion.
+
+    The def's arguments, and the names it assigns, are renamed within the
+    expanded body so that they remain local to each expansion.
+
+    """
+
+    _disallowed = {
+        "return",
+        "yield",
+        "global",
+        "nonlocal",
+        "import",
+        "def",
+        "class",
+        ":=",
+    }
+
+    _fstring_start = getattr(tokenize, "FSTRING_START", None)
+    _fstring_end = getattr(tokenize, "FSTRING_END", None)
+    _fstring_message = (
+        "can't refer to its arguments or local variables within an f-string"
+    )
+
+    def __init__(self, node):
+        self.node = node
+        self.name = node.funcname
+        decl = node.function_decl
+
+        if (
+            eval(node.attributes.get("buffered", "False"))
+            or eval(node.attributes.get("cached", "False"))
+            or node.filter_args.args
+            or node.decorator
+        ):
+            self._raise(
+                "can't be buffered, cached, filtered or decorated as well"
+            )
+        if decl.varargs or decl.kwargs or decl.kwargnames:
+            self._raise("may only declare positional arguments")
+
+        self.argnames = decl.argnames
+        self.defaults = dict(
+            zip(
+                decl.argnames[len(decl.argnames) - len(decl.defaults) :],
+                decl.defaults,
+            )
+        )
+
+        local_names = set(decl.argnames)
+        self.undeclared = set()
+        for n in node.nodes:
+            if isinstance(n, (parsetree.Text, parsetree.Comment)):
+                continue
+            elif not isinstance(
+                n,
+                (parsetree.Expression, parsetree.ControlLine, parsetree.Code),
+            ) or (isinstance(n, parsetree.Code) and n.ismodule):
+                self._raise(
+                    "may only contain text, expressions, control lines "
+                    "and Python blocks"
+                )
+            local_names.update(n.declared_identifiers())
+            self.undeclared.update(n.undeclared_identifiers())
+        self.undeclared.difference_update(local_names)
+        if "caller" in self.undeclared:
+            self._raise("can't refer to 'caller'")
+
+        self.renames = {
+            name: "__M_inline_%s_%s" % (self.name, name)
+            for name in local_names
+        }
+
+        # the renamed body; copies of these nodes are made for each
+        # expansion, as control lines are modified during generation
+        renamed = {}
+        for n in node.nodes:
+            kw = n.exception_kwargs
+            if isinstance(n, parsetree.Expression):
+                renamed[n] = parsetree.Expression(
+                    self._rename(n.text, n),
+                    self._rename(n.escapes, n),
+                    **kw,
+                )
+            elif isinstance(n, parsetree.ControlLine):
+                renamed[n] = parsetree.ControlLine(
+                    n.keyword,
+                    n.isend,
+                    n.text if n.isend else self._rename(n.text, n),
+                    **kw,
+                )
+            elif isinstance(n, parsetree.Code):
+                renamed[n] = parsetree.Code(
+                    self._rename(n.text, n), False, **kw
+                )
+                renamed[n].inlined = True
+            else:
+                renamed[n] = n
+        for n in node.nodes:
+            if isinstance(n, parsetree.ControlLine):
+                renamed[n].nodes = [renamed[c] for c in n.nodes]
+        self.body = [renamed[n] for n in node.nodes]
+
+    def _raise(self, message, node=None):
+        raise exceptions.CompileException(
+            "Inline def '%s' %s" % (self.name, message),
+            **(node or self.node).exception_kwargs,
+        )
+
+    def _rename(self, text, node):
+        """Return the given Python source with the local names of the def
+        replaced by their renamed forms."""
+
+        try:
+            tokens = [
+                t
+                for t in tokenize.generate_tokens(io.StringIO(text).readline)
+                if t.type
+                not in (
+                    tokenize.NL,
+                    tokenize.NEWLINE,
+                    tokenize.COMMENT,
+                    tokenize.INDENT,
+                    tokenize.DEDENT,
+                )
+            ]
+        except (tokenize.TokenError, SyntaxError):
+            self._raise("couldn't be parsed for expansion", node)
+
+        edits = []
+        depth = fstring_depth = 0
+        for i, tok in enumerate(tokens):
+            if tok.type in (tokenize.NAME, tokenize.OP) and (
+                tok.string in self._disallowed
+            ):
+                self._raise("can't use '%s'" % tok.string, node)
+            elif tok.type == self._fstring_start:
+                fstring_depth += 1
+            elif tok.type == self._fstring_end:
+                fstring_depth -= 1
+            elif tok.type == tokenize.OP:
+                if tok.string in ("(", "[", "{"):
+                    depth += 1
+                elif tok.string in (")", "]", "}"):
+                    depth -= 1
+            elif tok.type == tokenize.STRING:
+                # f-strings are single tokens prior to Python 3.12
+                prefix = re.match(r"\w*", tok.string).group(0).lower()
+                if "f" in prefix and any(
+                    re.search(r"\b%s\b" % name, tok.string)
+                    for name in self.renames
+                ):
+                    self._raise(self._fstring_message, node)
+            elif tok.type == tokenize.NAME and tok.string in self.renames:
+                if fstring_depth:
+                    self._raise(self._fstring_message, node)
+                before = tokens[i - 1].string if i else None
+                after = tokens[i + 1].string if i + 1 < len(tokens) else None
+                if before == "." or (
+                    depth and after == "=" and before in ("(", ",")
+                ):
+                    # an attribute or keyword argument name
+                    continue
+                edits.append(tok)
+
+        lines = text.splitlines(True)
+        for tok in reversed(edits):
+            row, col = tok.start
+            line = lines[row - 1]
+            lines[row - 1] = (
+                line[:col] + self.renames[tok.string] + line[tok.end[1] :]
+            )
+        return "".join(lines)
+
+    def _bind(self, node, call):
+        """Return the assignments of the given call's arguments to the
+        renamed arguments of the def, or None if the call's arguments
+        can't be bound at compile time."""
+
+        if len(call.args) > len(self.argnames) or any(
+            isinstance(arg, pyast.Starred) for arg in call.args
+        ):
+            return None
+
+        text = node.text.strip()
+        values = {}
+        for name, arg in zip(self.argnames, call.args):
+            values[name] = "(%s)" % pyast.get_source_segment(text, arg)
+        for kw in call.keywords:
+            if kw.arg not in self.argnames or kw.arg in values:
+                return None
+            values[kw.arg] = "(%s)" % pyast.get_source_segment(text, kw.value)
+        for name in self.argnames:
+            if name not in values:
+                default = self.defaults.get(name)
+                if not isinstance(default, pyast.Constant):
+                    return None
+                values[name] = repr(default.value)
+        return values
+
+    def expand(self, node, call):
+        """Return the nodes which replace the given call expression, or
+        None if it can't be expanded."""
+
+        values = self._bind(node, call)
+        if values is None:
+            return None
+
+        copies = {n: copy.copy(n) for n in self.body}
+        for n, c in copies.items():
+            if isinstance(n, parsetree.ControlLine):
+                c.nodes = [copies[child] for child in n.nodes]
+        nodes = [copies[n] for n in self.body]
+
+        if values:
+            args = parsetree.Code(
+                "%s = %s"
+                % (
+                    ", ".join(self.renames[name] for name in values),
+                    ", ".join(values.values()),
+                ),
+                False,
+                **node.exception_kwargs,
+            )
+            args.inlined = True
+            nodes.insert(0, args)
+        return nodes
@@ -47,10 +47,15 @@ def inspect_getargspec(func):
     return ArgSpec(args, varargs, varkw, func.__defaults__)
 
 
-def load_module(module_id, path):
+def load_module(module_id, path, code=None):
     spec = util.spec_from_file_location(module_id, path)
     module = util.module_from_spec(spec)
-    spec.loader.exec_module(module)
+    if code is not None:
+        # the code object is compiled from the module file already;
+        # execute it the same way the loader would
+        exec(code, module.__dict__)
+    else:
+        spec.loader.exec_module(module)
     return module
 
 
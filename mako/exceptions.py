@@ -149,7 +149,9 @@ class RichTraceback:
         import mako.template
 
         mods = {}
-        rawrecords = traceback.extract_tb(trcback)
+        # extract_tb() would also locate the column positions of each
+        # line, searching the whole of a template's render function to do so
+        rawrecords = traceback.StackSummary.extract(traceback.walk_tb(trcback))
         new_trcback = []
         for filename, lineno, function, line in rawrecords:
             if not line:
@@ -159,7 +161,6 @@ class RichTraceback:
             except KeyError:
                 try:
                     info = mako.template._get_module_info(filename)
-                    module_source = info.code
                     template_source = info.source
                     template_filename = (
                         info.template_filename or info.template_uri or filename
@@ -180,17 +181,8 @@ class RichTraceback:
                     )
                     continue
 
-                template_ln = 1
-
-                mtm = mako.template.ModuleInfo
-                source_map = mtm.get_module_source_metadata(
-                    module_source, full_line_map=True
-                )
-                line_map = source_map["full_line_map"]
-
-                template_lines = [
-                    line_ for line_ in template_source.split("\n")
-                ]
+                line_map = info.full_line_map
+                template_lines = info.source_lines
                 mods[filename] = (line_map, template_lines, template_filename)
 
             template_ln = line_map[lineno - 1]
@@ -241,7 +233,19 @@ def text_error_template(lookup=None):
     numbers and code for that of the originating source template, as
     applicable.
 
+    The template is compiled on first use, and the same :class:`.Template`
+    is returned by subsequent calls.
+
+    .. versionchanged:: 1.4.2 The template is compiled only once.
+
     """
+    template = _error_templates.get("text")
+    if template is None:
+        template = _error_templates["text"] = _text_error_template()
+    return template
+
+
+def _text_error_template():
     import mako.template
 
     return mako.template.Template(r"""
@@ -261,16 +265,26 @@ ${tback.errorname}: ${tback.message}
 """)
 
 
+# templates returned by text_error_template() and html_error_template().
+# the HTML template imports the highlighting functions when it's compiled,
+# so it's discarded whenever they're installed
+_error_templates = {}
+
+
 def _install_pygments():
     global syntax_highlight, pygments_html_formatter
     from mako.ext.pygmentplugin import syntax_highlight  # noqa
     from mako.ext.pygmentplugin import pygments_html_formatter  # noqa
 
+    _error_templates.clear()
+
 
 def _install_fallback():
     global syntax_highlight, pygments_html_formatter
     from mako.filters import html_escape
 
+    _error_templates.clear()
+
     pygments_html_formatter = None
 
     def syntax_highlight(filename="", language=None):
@@ -299,7 +313,19 @@ def html_error_template():
     returned. With the ``css`` option disabled, the default stylesheet
     won't be included.
 
+    The template is compiled on first use, and the same :class:`.Template`
+    is returned by subsequent calls.
+
+    .. versionchanged:: 1.4.2 The template is compiled only once.
+
     """
+    template = _error_templates.get("html")
+    if template is None:
+        template = _error_templates["html"] = _html_error_template()
+    return template
+
+
+def _html_error_template():
     import mako.template
 
     return mako.template.Template(
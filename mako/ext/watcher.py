@@ -0,0 +1,404 @@
+# ext/watcher.py
+# Copyright 2006-2026 the Mako authors and contributors <see AUTHORS file>
+#
+# This module is part of Mako and is released under
+# the MIT License: http://www.opensource.org/licenses/mit-license.php
+
+"""Invalidate the templates of a :class:`.TemplateLookup` as their source
+files change.
+
+A :class:`.TemplateWatcher` is an alternative to the
+``filesystem_checks`` option of :class:`.TemplateLookup`.  Rather than
+checking the modified time of a template file each time the template is
+requested, a background thread waits for files within the lookup's
+directories to change, and removes only the affected templates from the
+lookup, optionally compiling them again straight away.  The lookup itself
+is then configured with ``filesystem_checks=False``, so that
+:meth:`.TemplateLookup.get_template` never consults the filesystem for a
+template that is already loaded::
+
+    from mako.ext.watcher import TemplateWatcher
+    from mako.lookup import TemplateLookup
+
+    lookup = TemplateLookup(
+        directories=["/path/to/templates"],
+        module_directory="/path/to/modules",
+        filesystem_checks=False,
+    )
+    watcher = TemplateWatcher(lookup)
+    watcher.start()
+
+On Linux, changes are received from the kernel using inotify.  On other
+platforms, or if inotify can't be used, the directories are instead
+scanned for changes every ``interval`` seconds.
+
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import posixpath
+import select
+import struct
+import sys
+import threading
+import warnings
+
+from mako import exceptions
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+# IN_MODIFY isn't watched, as a file is only reloaded once it has been
+# completely written and closed
+_WATCH_MASK = (
+    IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+)
+
+# struct inotify_event: int wd; uint32 mask; uint32 cookie; uint32 len;
+# followed by "len" bytes of null-padded file name
+_EVENT_HEADER = struct.Struct("iIII")
+
+MODIFIED = "modified"
+CREATED = "created"
+DELETED = "deleted"
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(
+            ctypes.util.find_library("c") or "libc.so.6", use_errno=True
+        )
+        libc.inotify_init1
+        libc.inotify_add_watch
+        libc.inotify_rm_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+has_inotify = _libc is not None
+
+
+def _normpath(path):
+    return posixpath.normpath(path.replace(os.path.sep, posixpath.sep))
+
+
+def _find_change(changed, filename):
+    """Return the change to the given file, or to any directory containing
+    it, such as a directory which has been moved into place."""
+
+    path = filename
+    while True:
+        kind = changed.get(path)
+        if kind is not None:
+            return kind
+        parent = posixpath.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+class _InotifyBackend:
+    """Receive changes to a set of directory trees using inotify."""
+
+    def __init__(self, directories):
+        self._fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._directories = directories
+        self._watches = {}
+        for dir_ in directories:
+            self._add_tree(dir_)
+
+    def _add_tree(self, path):
+        for dirpath, dirnames, filenames in os.walk(path):
+            self._add_watch(dirpath)
+
+    def _add_watch(self, path):
+        wd = _libc.inotify_add_watch(self._fd, os.fsencode(path), _WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            # the directory was removed before it could be watched
+            if err in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise OSError(err, os.strerror(err), path)
+        self._watches[wd] = path
+
+    def _remove_tree(self, path):
+        # a directory which has been moved keeps its watch under the old
+        # path, so it's removed rather than left to report the wrong paths
+        prefix = os.path.join(path, "")
+        for wd, watched in list(self._watches.items()):
+            if watched == path or watched.startswith(prefix):
+                _libc.inotify_rm_watch(self._fd, wd)
+                del self._watches[wd]
+
+    def read(self, timeout):
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return []
+
+        changes = []
+        pos = 0
+        while pos + _EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, pos)
+            pos += _EVENT_HEADER.size
+            name = data[pos : pos + length].rstrip(b"\0")
+            pos += length
+
+            if mask & IN_Q_OVERFLOW:
+                # events were lost; watch everything again, and report
+                # each of the directories as having been replaced
+                self._rewatch()
+                changes.extend((dir_, CREATED) for dir_ in self._directories)
+                continue
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            directory = self._watches.get(wd)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                if mask & IN_ISDIR:
+                    self._remove_tree(path)
+                    self._add_tree(path)
+                changes.append((path, CREATED))
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                if mask & IN_ISDIR:
+                    self._remove_tree(path)
+                changes.append((path, DELETED))
+            elif not mask & IN_ISDIR:
+                changes.append((path, MODIFIED))
+        return changes
+
+    def _rewatch(self):
+        for wd in self._watches:
+            _libc.inotify_rm_watch(self._fd, wd)
+        self._watches.clear()
+        for dir_ in self._directories:
+            self._add_tree(dir_)
+
+    def close(self):
+        os.close(self._fd)
+
+
+class _PollingBackend:
+    """Detect changes to a set of directory trees by scanning them
+    periodically."""
+
+    def __init__(self, directories, stopped):
+        self.directories = directories
+        self._stopped = stopped
+        self._mtimes = self._scan()
+
+    def _scan(self):
+        mtimes = {}
+        for dir_ in self.directories:
+            for dirpath, dirnames, filenames in os.walk(dir_):
+                for fname in filenames:
+                    path = os.path.join(dirpath, fname)
+                    try:
+                        mtimes[path] = os.stat(path).st_mtime_ns
+                    except OSError:
+                        pass
+        return mtimes
+
+    def read(self, timeout):
+        if timeout and self._stopped.wait(timeout):
+            return []
+
+        previous, self._mtimes = self._mtimes, self._scan()
+        changes = [
+            (path, DELETED) for path in previous if path not in self._mtimes
+        ]
+        for path, mtime in self._mtimes.items():
+            if path not in previous:
+                changes.append((path, CREATED))
+            elif previous[path] != mtime:
+                changes.append((path, MODIFIED))
+        return changes
+
+    def close(self):
+        pass
+
+
+class TemplateWatcher:
+    """Watch the directories of a :class:`.TemplateLookup`, removing
+    templates from the lookup when their files change.
+
+    :param lookup: the :class:`.TemplateLookup` to watch.  It would
+     normally be configured with ``filesystem_checks=False``.
+
+    :param interval: the longest time in seconds the watching thread
+     waits before checking if it has been stopped; when polling, the
+     interval at which the directories are scanned.
+
+    :param recompile: if ``True``, the default, a template which has been
+     modified is loaded into the lookup again by the watching thread, so
+     that the next request for it does not need to wait for it to
+     compile.
+
+    :param use_inotify: whether to use inotify to receive changes.  The
+     default of ``None`` uses inotify where it is available, and polling
+     otherwise.
+
+    A change to a directory, such as a new directory moved into place
+    over an old one, removes every template within it.  If the kernel's
+    queue of inotify events overflows, every template is removed.
+
+    If changes can't be read, such as when the limit on the number of
+    inotify watches has been reached, a :class:`RuntimeWarning` is
+    emitted, every template is removed, and the watcher continues by
+    polling the directories.
+
+    When a file is created or removed, the URI cache of the lookup is
+    additionally cleared, so that URI resolution, including the results
+    cached by :func:`mako.ext.autohandler.autohandler` for a lookup
+    without ``filesystem_checks``, reflects the new set of files.
+
+    .. versionadded:: 1.4.2
+
+    """
+
+    def __init__(self, lookup, interval=1.0, recompile=True, use_inotify=None):
+        self.lookup = lookup
+        self.interval = interval
+        self.recompile = recompile
+        if use_inotify is None:
+            use_inotify = has_inotify
+        elif use_inotify and not has_inotify:
+            raise exceptions.RuntimeException(
+                "inotify is not available on this platform"
+            )
+        self.use_inotify = use_inotify
+        self._stopped = threading.Event()
+        self._thread = None
+        self._backend = None
+
+    def start(self):
+        """Begin watching for changes in a background thread."""
+
+        if self._thread is not None:
+            raise exceptions.RuntimeException("Watcher is already started")
+
+        self._stopped.clear()
+        if self.use_inotify:
+            self._backend = _InotifyBackend(self.lookup.directories)
+        else:
+            self._backend = _PollingBackend(
+                self.lookup.directories, self._stopped
+            )
+        self._thread = threading.Thread(
+            target=self._run, name="mako-template-watcher", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching for changes, waiting for the background thread
+        to finish."""
+
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+        self._backend.close()
+        self._backend = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                changes = self._backend.read(self.interval)
+                if changes and not self._stopped.is_set():
+                    self._process_changes(changes)
+            except Exception as err:
+                self._recover(err)
+
+    def _recover(self, err):
+        """Continue watching after reading or processing changes has
+        failed, such as when the limit on the number of inotify watches
+        is reached as a directory is created."""
+
+        if isinstance(self._backend, _PollingBackend):
+            action = "retrying"
+        else:
+            action = "falling back to polling"
+        warnings.warn(
+            "TemplateWatcher failed to read changes, %s: %s: %s"
+            % (action, type(err).__name__, err),
+            RuntimeWarning,
+        )
+
+        if isinstance(self._backend, _PollingBackend):
+            # don't retry a failing scan without pause
+            self._stopped.wait(self.interval)
+        else:
+            try:
+                self._backend.close()
+            except OSError:
+                pass
+            self._backend = _PollingBackend(
+                self.lookup.directories, self._stopped
+            )
+
+        # changes may have been missed, so every template is removed,
+        # as when inotify's queue overflows
+        self.lookup._collection.clear()
+        self.lookup._uri_cache.clear()
+
+    def _process_changes(self, changes):
+        lookup = self.lookup
+        collection = lookup._collection
+
+        changed = {}
+        for path, kind in changes:
+            changed[_normpath(path)] = kind
+
+        reload = []
+        # items() is used rather than indexing the collection, which would
+        # mark each template as recently used
+        for uri, template in list(collection.items()):
+            if template.filename is None:
+                continue
+            kind = _find_change(changed, _normpath(template.filename))
+            if kind is None:
+                continue
+            if collection.pop(uri, None) is not None and kind != DELETED:
+                reload.append(uri)
+
+        if any(kind != MODIFIED for kind in changed.values()):
+            lookup._uri_cache.clear()
+
+        if self.recompile:
+            for uri in reload:
+                try:
+                    lookup.get_template(uri)
+                except Exception:
+                    # the error is raised again when the template is
+                    # next requested
+                    pass
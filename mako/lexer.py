@@ -6,6 +6,7 @@
 
 """provides the Lexer class for parsing template strings into parse trees."""
 
+import bisect
 import codecs
 import re
 
@@ -15,6 +16,46 @@ from mako.pygen import adjust_whitespace
 
 _regexp_cache = {}
 
+_newline_re = re.compile(r"\n")
+
+# classifies the text at the current position by the first of the
+# Lexer.match_*() methods which is able to match there, in the order in
+# which Lexer.parse() tries them.  each alternative is a prefix that the
+# corresponding method requires, so the methods ahead of it can be
+# skipped without changing the outcome.
+_token_re = re.compile(
+    r"""
+    (?P<end>\Z)
+    |(?P<expression>\$\{)
+    |(?P<control_line>(?<=^)[\t ]*(?:%(?!%)|\#\#))
+    |(?P<comment><%doc>)
+    |(?P<tag_start><%[\w\.\:])
+    |(?P<tag_end></%)
+    |(?P<python_block><%)
+    |(?P<percent>(?<=^)\s*%%)
+    |(?P<text>)
+    """,
+    re.M | re.X,
+)
+
+_token_kinds = (
+    "expression",
+    "control_line",
+    "comment",
+    "tag_start",
+    "tag_end",
+    "python_block",
+    "percent",
+    "text",
+)
+_token_index = {kind: index for index, kind in enumerate(_token_kinds)}
+
+_until_comment_re = re.compile(r"#.*\n")
+_until_string_re = re.compile(
+    r"(\"\"\"|\'\'\'|\"|\')[^\\]*?(\\.[^\\]*?)*\1", re.S
+)
+_until_regexp_cache = {}
+
 
 class Lexer:
     def __init__(
@@ -23,10 +64,10 @@ class Lexer:
         self.text = text
         self.filename = filename
         self.template = parsetree.TemplateNode(self.filename)
-        self.matched_lineno = 1
-        self.matched_charpos = 0
-        self.lineno = 1
         self.match_position = 0
+        self.matched_position = 0
+        self._newlines = None
+        self._newlines_text = None
         self.tag = []
         self.control_line = []
         self.ternary_stack = []
@@ -39,12 +80,49 @@ class Lexer:
         else:
             self.preprocessor = preprocessor
 
+    def position(self, charpos):
+        """return the line number and column of the given offset into the
+        text.
+
+        the offsets of each newline are indexed on first use, so that the
+        position is found by bisection rather than by counting newlines
+        from the start of the text.
+
+        """
+        if self._newlines_text is not self.text:
+            self._newlines = [
+                m.start() for m in _newline_re.finditer(self.text)
+            ]
+            self._newlines_text = self.text
+
+        index = bisect.bisect_left(self._newlines, charpos)
+        if index:
+            return index + 1, charpos - self._newlines[index - 1]
+        else:
+            return 1, charpos + 1
+
+    @property
+    def lineno(self):
+        """the line number of the current text position."""
+        return self.position(self.match_position)[0]
+
+    @property
+    def matched_lineno(self):
+        """the line number at which the last match began."""
+        return self.position(self.matched_position)[0]
+
+    @property
+    def matched_charpos(self):
+        """the column at which the last match began."""
+        return self.position(self.matched_position)[1]
+
     @property
     def exception_kwargs(self):
+        lineno, pos = self.position(self.matched_position)
         return {
             "source": self.text,
-            "lineno": self.matched_lineno,
-            "pos": self.matched_charpos,
+            "lineno": lineno,
+            "pos": pos,
             "filename": self.filename,
         }
 
@@ -63,42 +141,40 @@ class Lexer:
         """match the given regular expression object to the current text
         position.
 
-        if a match occurs, update the current text and line position.
+        if a match occurs, update the current text position; the line
+        and column are derived from it only when needed.
 
         """
 
-        mp = self.match_position
-
         match = reg.match(self.text, self.match_position)
         if match:
             start, end = match.span()
+            self.matched_position = self.match_position
             self.match_position = end + 1 if end == start else end
-            self.matched_lineno = self.lineno
-            cp = mp - 1
-            if cp >= 0 and cp < self.textlength:
-                cp = self.text[: cp + 1].rfind("\n")
-            self.matched_charpos = mp - cp
-            self.lineno += self.text[mp : self.match_position].count("\n")
         return match
 
     def parse_until_text(self, watch_nesting, *text):
         startpos = self.match_position
-        startlineno = self.matched_lineno
-        startcharpos = self.matched_charpos
-        text_re = r"|".join(text)
+        startmatched = self.matched_position
+        try:
+            until_re, scan_re = _until_regexp_cache[text]
+        except KeyError:
+            text_re = r"|".join(text)
+            until_re, scan_re = _until_regexp_cache[text] = (
+                re.compile(r"(%s)" % text_re),
+                re.compile(r"(.*?)(?=\"|\'|#|%s)" % text_re, re.S),
+            )
         brace_level = 0
         paren_level = 0
         bracket_level = 0
         while True:
-            match = self.match(r"#.*\n")
+            match = self.match_reg(_until_comment_re)
             if match:
                 continue
-            match = self.match(
-                r"(\"\"\"|\'\'\'|\"|\')[^\\]*?(\\.[^\\]*?)*\1", re.S
-            )
+            match = self.match_reg(_until_string_re)
             if match:
                 continue
-            match = self.match(r"(%s)" % text_re)
+            match = self.match_reg(until_re)
             if match and not (
                 watch_nesting
                 and (brace_level > 0 or paren_level > 0 or bracket_level > 0)
@@ -110,7 +186,7 @@ class Lexer:
                     match.group(1),
                 )
             elif not match:
-                match = self.match(r"(.*?)(?=\"|\'|#|%s)" % text_re, re.S)
+                match = self.match_reg(scan_re)
             if match:
                 brace_level += match.group(1).count("{")
                 brace_level -= match.group(1).count("}")
@@ -122,20 +198,19 @@ class Lexer:
             # the scan consumes the remaining text looking for the
             # closing token, so report the position the construct began
             # at, rather than the position the scan gave up at
+            lineno, pos = self.position(startmatched)
             raise exceptions.SyntaxException(
                 "Expected: %s; unterminated tag or expression beginning"
                 % ",".join(text),
-                **{
-                    **self.exception_kwargs,
-                    "lineno": startlineno,
-                    "pos": startcharpos,
-                },
+                **{**self.exception_kwargs, "lineno": lineno, "pos": pos},
             )
 
     def append_node(self, nodecls, *args, **kwargs):
         kwargs.setdefault("source", self.text)
-        kwargs.setdefault("lineno", self.matched_lineno)
-        kwargs.setdefault("pos", self.matched_charpos)
+        if "lineno" not in kwargs:
+            kwargs["lineno"], kwargs["pos"] = self.position(
+                self.matched_position
+            )
         kwargs["filename"] = self.filename
         node = nodecls(*args, **kwargs)
         if len(self.tag):
@@ -240,33 +315,27 @@ class Lexer:
 
         self.textlength = len(self.text)
 
+        matchers = [getattr(self, "match_" + kind) for kind in _token_kinds]
+
         while True:
             if self.match_position > self.textlength:
                 break
 
-            if self.match_end():
-                break
-            if self.match_expression():
-                continue
-            if self.match_control_line():
-                continue
-            if self.match_comment():
-                continue
-            if self.match_tag_start():
-                continue
-            if self.match_tag_end():
-                continue
-            if self.match_python_block():
-                continue
-            if self.match_percent():
-                continue
-            if self.match_text():
-                continue
-
-            if self.match_position > self.textlength:
+            # a single match determines the first of the match_*()
+            # methods which can succeed at the current position; if it
+            # doesn't, the remaining ones are tried in order
+            kind = _token_re.match(self.text, self.match_position).lastgroup
+            if kind == "end":
+                self.match_end()
                 break
-            # TODO: no coverage here
-            raise exceptions.MakoException("assertion failed")
+            for matcher in matchers[_token_index[kind] :]:
+                if matcher():
+                    break
+            else:
+                if self.match_position > self.textlength:
+                    break
+                # TODO: no coverage here
+                raise exceptions.MakoException("assertion failed")
 
         if len(self.tag):
             raise exceptions.SyntaxException(
@@ -407,7 +476,7 @@ class Lexer:
     def match_python_block(self):
         match = self.match(r"<%(!)?")
         if match:
-            line, pos = self.matched_lineno, self.matched_charpos
+            line, pos = self.position(self.matched_position)
             text, end = self.parse_until_text(False, r"%>")
             # the trailing newline helps
             # compiler.parse() not complain about indentation
@@ -428,7 +497,7 @@ class Lexer:
         if not match:
             return False
 
-        line, pos = self.matched_lineno, self.matched_charpos
+        line, pos = self.position(self.matched_position)
         text, end = self.parse_until_text(True, r"\|", r"}")
         if end == "|":
             escapes, end = self.parse_until_text(True, r"}")
@@ -465,6 +534,13 @@ class Lexer:
             isend, keyword = m2.group(1, 2)
             isend = isend is not None
 
+            # "% async for" and "% async with" are closed by "% endfor"
+            # and "% endwith"
+            if keyword == "async" and not isend:
+                m3 = re.match(r"(for|with)\b", m2.group(3))
+                if m3:
+                    keyword = m3.group(1)
+
             if isend:
                 if not len(self.control_line):
                     raise exceptions.SyntaxException(
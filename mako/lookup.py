@@ -4,16 +4,36 @@
 # This module is part of Mako and is released under
 # the MIT License: http://www.opensource.org/licenses/mit-license.php
 
+import collections
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+import fnmatch
+import multiprocessing
 import os
+import pickle
 import posixpath
 import re
 import stat
 import threading
+import time
 
+from mako import compat
 from mako import exceptions
 from mako import util
 from mako.template import Template
 
+PreloadResult = collections.namedtuple(
+    "PreloadResult", ["times", "errors", "elapsed"]
+)
+PreloadResult.__doc__ = """The outcome of :meth:`.TemplateLookup.preload`.
+
+``times`` is a dictionary of the URIs that were loaded, each with the
+number of seconds it took to load; ``errors`` is a dictionary of the URIs
+that failed to load, each with a string describing the exception raised;
+``elapsed`` is the number of seconds taken altogether.
+
+"""
+
 
 class TemplateCollection:
     """Represent a collection of :class:`.Template` objects,
@@ -114,13 +134,16 @@ class TemplateLookup(TemplateCollection):
      searched for a particular template URI. The URI is appended
      to each directory and the filesystem checked.
 
-    :param collection_size: Approximate size of the collection used
+    :param collection_size: Size of the collection used
      to store templates. If left at its default of ``-1``, the size
      is unbounded, and a plain Python dictionary is used to
      relate URI strings to :class:`.Template` instances.
      Otherwise, a least-recently-used cache object is used which
-     will maintain the size of the collection approximately to
-     the number given.
+     will discard the least recently used templates beyond the
+     number given.
+
+     .. versionchanged:: 1.4.2 the size of the collection is maintained
+        exactly, rather than approximately.
 
     :param filesystem_checks: When at its default value of ``True``,
      each call to :meth:`.TemplateLookup.get_template()` will
@@ -131,6 +154,18 @@ class TemplateLookup(TemplateCollection):
      been updated. Set this to ``False`` for a very minor
      performance increase.
 
+    :param check_interval: When ``filesystem_checks`` is enabled, the
+     number of seconds for which the outcome of checking a template file
+     is reused.  Within this interval, :meth:`.TemplateLookup.get_template`
+     returns the existing :class:`.Template` for a file that was found to
+     be current without checking the filesystem again, which includes the
+     lookups made for ``<%include>``, ``<%inherit>`` and ``<%namespace>``
+     tags.  Changes to a template are then picked up within
+     ``check_interval`` seconds.  Defaults to ``0``, meaning the file is
+     checked on every call.
+
+     .. versionadded:: 1.4.2
+
     :param modulename_callable: A callable which, when present,
      is passed the path of the source file as well as the
      requested URI, and then returns the full path of the
@@ -147,11 +182,23 @@ class TemplateLookup(TemplateCollection):
 
     """
 
+    lock_wait_time = 0.0
+    """Total time, in seconds, that threads have spent waiting for
+    another thread to finish loading the same template.
+
+    Templates are loaded under a lock which is specific to their URI, so
+    that concurrent requests for one URI wait on a single compilation,
+    while templates for different URIs load concurrently.  This counter
+    includes only the time spent waiting on such a lock.
+
+    """
+
     def __init__(
         self,
         directories=None,
         module_directory=None,
         filesystem_checks=True,
+        check_interval=0,
         collection_size=-1,
         format_exceptions=False,
         error_handler=None,
@@ -175,13 +222,20 @@ class TemplateLookup(TemplateCollection):
         preprocessor=None,
         lexer_cls=None,
         include_error_handler=None,
+        stream_chunk_size=None,
+        enable_async=False,
+        compile_cache_dir=None,
+        module_bytecode=False,
+        direct_context_lookups=False,
     ):
         self.directories = [
             posixpath.normpath(d) for d in util.to_list(directories, ())
         ]
         self.module_directory = module_directory
+        self.compile_cache_dir = compile_cache_dir
         self.modulename_callable = modulename_callable
         self.filesystem_checks = filesystem_checks
+        self.check_interval = check_interval
         self.collection_size = collection_size
 
         if cache_args is None:
@@ -214,15 +268,52 @@ class TemplateLookup(TemplateCollection):
             "enable_loop": enable_loop,
             "preprocessor": preprocessor,
             "lexer_cls": lexer_cls,
+            "stream_chunk_size": stream_chunk_size,
+            "enable_async": enable_async,
+            "compile_cache_dir": compile_cache_dir,
+            "module_bytecode": module_bytecode,
+            "direct_context_lookups": direct_context_lookups,
         }
 
-        if collection_size == -1:
+        self._init_collection()
+
+    def _init_collection(self):
+        if self.collection_size == -1:
             self._collection = {}
             self._uri_cache = {}
         else:
-            self._collection = util.LRUCache(collection_size)
-            self._uri_cache = util.LRUCache(collection_size)
+            self._collection = util.LRUCache(self.collection_size, threshold=0)
+            self._uri_cache = util.LRUCache(self.collection_size, threshold=0)
+
+        # guards _uri_locks.  each entry is a [lock, refcount] pair,
+        # removed once no thread is loading that uri
         self._mutex = threading.Lock()
+        self._uri_locks = {}
+        self.lock_wait_time = 0.0
+
+        # filename -> time at which the file was last found to be current,
+        # used by check_interval
+        self._checked = {}
+
+    def __getstate__(self):
+        # loaded templates and locks are local to a process; a
+        # lookup that is unpickled, such as within a worker process,
+        # starts out with an empty collection
+        state = self.__dict__.copy()
+        for key in (
+            "_collection",
+            "_uri_cache",
+            "_mutex",
+            "_uri_locks",
+            "lock_wait_time",
+            "_checked",
+        ):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_collection()
 
     def get_template(self, uri):
         """Return a :class:`.Template` object corresponding to the given
@@ -252,6 +343,75 @@ class TemplateLookup(TemplateCollection):
                     "Can't locate template for uri %r" % uri
                 ) from e
 
+    def preload(self, patterns=None, workers=1, processes=False):
+        """Load all of the templates within :attr:`.directories` ahead of
+        time, returning a :class:`.PreloadResult`.
+
+        Each template is loaded using :meth:`.get_template`, so that it's
+        present within the collection afterwards.  This may be used to
+        warm up the lookup within a process that later forks worker
+        processes, which then share the loaded templates rather than
+        each loading them on first use.
+
+        :param patterns: A list of ``fnmatch``-style patterns, such as
+         ``["*.html"]``; if given, only templates with a URI matching one
+         of the patterns are loaded.
+
+        :param workers: The number of templates to load concurrently.
+         Defaults to ``1``, loading each template in turn.
+
+        :param processes: When ``True``, templates are first compiled
+         within a pool of ``workers`` processes, rather than threads, and
+         then loaded from their module files within this process.  This
+         requires generated modules to be written to the filesystem, by
+         way of ``module_directory``, ``modulename_callable`` or
+         ``compile_cache_dir``.  Where processes can't be forked, the
+         lookup is pickled to be sent to each process, so that its
+         options can't refer to lambdas or other unpicklable objects.
+
+        .. versionadded:: 1.4.2
+
+        """
+
+        uris = self._find_uris(patterns)
+        start = time.perf_counter()
+
+        if processes:
+            if (
+                self.module_directory is None
+                and self.modulename_callable is None
+                and self.compile_cache_dir is None
+            ):
+                raise exceptions.RuntimeException(
+                    "preload() with processes=True requires a "
+                    "module_directory, modulename_callable or "
+                    "compile_cache_dir"
+                )
+            with _process_pool(self, workers) as executor:
+                compiled = list(executor.map(_load_uri_in_worker, uris))
+            results = []
+            for result in compiled:
+                uri, t, error, undecodable = result
+                results.append(
+                    _load_uri(self, uri) if error is None else result
+                )
+        elif workers > 1:
+            with ThreadPoolExecutor(workers) as executor:
+                results = list(
+                    executor.map(lambda uri: _load_uri(self, uri), uris)
+                )
+        else:
+            results = [_load_uri(self, uri) for uri in uris]
+
+        times = {}
+        errors = {}
+        for uri, t, error, undecodable in results:
+            if error is None:
+                times[uri] = t
+            else:
+                errors[uri] = error
+        return PreloadResult(times, errors, time.perf_counter() - start)
+
     def adjust_uri(self, uri, relativeto):
         """Adjust the given ``uri`` based on the given relative URI."""
 
@@ -293,8 +453,64 @@ class TemplateLookup(TemplateCollection):
         else:
             return None
 
+    def _find_uris(self, patterns=None):
+        """Return the URIs of all files located within
+        :attr:`.directories`, in the form accepted by
+        :meth:`.get_template`.
+
+        If ``patterns`` is given, only URIs which match one of the
+        given ``fnmatch``-style patterns, such as ``"*.html"``, are
+        returned.  A URI present in more than one directory is returned
+        once, as it would be resolved from the first directory.
+
+        """
+
+        generated = {
+            os.path.abspath(d)
+            for d in (self.module_directory, self.compile_cache_dir)
+            if d is not None
+        }
+
+        uris = []
+        seen = set()
+        for dir_ in self.directories:
+            for dirpath, dirnames, filenames in os.walk(dir_):
+                # don't descend into generated modules that are
+                # placed among the templates
+                dirnames[:] = sorted(
+                    d
+                    for d in dirnames
+                    if os.path.abspath(os.path.join(dirpath, d))
+                    not in generated
+                )
+                for fname in sorted(filenames):
+                    path = os.path.relpath(os.path.join(dirpath, fname), dir_)
+                    uri = "/" + path.replace(os.path.sep, posixpath.sep)
+                    if uri in seen:
+                        continue
+                    if patterns and not any(
+                        fnmatch.fnmatchcase(uri, pattern)
+                        for pattern in patterns
+                    ):
+                        continue
+                    seen.add(uri)
+                    uris.append(uri)
+        return uris
+
     def _load(self, filename, uri):
-        self._mutex.acquire()
+        with self._mutex:
+            entry = self._uri_locks.get(uri)
+            if entry is None:
+                entry = self._uri_locks[uri] = [threading.Lock(), 0]
+            entry[1] += 1
+        lock = entry[0]
+
+        if not lock.acquire(blocking=False):
+            start = time.perf_counter()
+            lock.acquire()
+            waited = time.perf_counter() - start
+            with self._mutex:
+                self.lock_wait_time += waited
         try:
             try:
                 # try returning from collection one
@@ -322,15 +538,27 @@ class TemplateLookup(TemplateCollection):
                 self._collection.pop(uri, None)
                 raise
         finally:
-            self._mutex.release()
+            lock.release()
+            with self._mutex:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._uri_locks[uri]
 
     def _check(self, uri, template):
         if template.filename is None:
             return template
 
+        if self.check_interval:
+            now = time.monotonic()
+            checked = self._checked.get(template.filename)
+            if checked is not None and now - checked < self.check_interval:
+                return template
+
         try:
             template_stat = os.stat(template.filename)
             if template.module._modified_time >= template_stat[stat.ST_MTIME]:
+                if self.check_interval:
+                    self._checked[template.filename] = now
                 return template
             self._collection.pop(uri, None)
             return self._load(template.filename, uri)
@@ -357,3 +585,65 @@ class TemplateLookup(TemplateCollection):
 
         """
         self._collection[uri] = template
+
+
+def _load_uri(lookup, uri):
+    start = time.perf_counter()
+    undecodable = False
+    try:
+        lookup.get_template(uri)
+    except Exception as err:
+        # exceptions are reported as strings, as not every exception
+        # can be sent back from a worker process
+        error = "%s: %s" % (compat.exception_name(err), err)
+        # the lexer raises CompileException for a file which can't be
+        # decoded, such as an image placed among the templates
+        undecodable = isinstance(err, UnicodeDecodeError) or isinstance(
+            err.__context__, UnicodeDecodeError
+        )
+    else:
+        error = None
+    return uri, time.perf_counter() - start, error, undecodable
+
+
+_worker_lookup = None
+
+
+def _init_worker(lookup):
+    global _worker_lookup
+    _worker_lookup = lookup
+
+
+def _load_uri_in_worker(uri):
+    return _load_uri(_worker_lookup, uri)
+
+
+def _process_pool(lookup, workers):
+    """Return a ProcessPoolExecutor whose worker processes load
+    templates from the given lookup, using :func:`._load_uri_in_worker`.
+
+    Where processes can be forked, the workers inherit the lookup, which
+    may then refer to lambdas and closures.  Otherwise the lookup has to
+    be pickled to be sent to each worker, and a
+    :class:`.RuntimeException` is raised if that isn't possible.
+
+    """
+
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = None
+        try:
+            pickle.dumps(lookup)
+        except Exception as err:
+            raise exceptions.RuntimeException(
+                "the TemplateLookup can't be sent to worker processes, "
+                "as it can't be pickled: %s: %s"
+                % (compat.exception_name(err), err)
+            ) from err
+    return ProcessPoolExecutor(
+        workers,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(lookup,),
+    )
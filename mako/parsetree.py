@@ -148,6 +148,10 @@ class Code(Node):
 
     """
 
+    # set for code generated by the expansion of an inline def; the names
+    # it assigns are local to that expansion
+    inlined = False
+
     def __init__(self, text, ismodule, **kwargs):
         super().__init__(**kwargs)
         self.text = text
@@ -441,11 +445,18 @@ class TextTag(Tag):
         ).union(self.expression_undeclared_identifiers)
 
 
+class FlushTag(Tag):
+    __keyword__ = "flush"
+
+    def __init__(self, keyword, attributes, **kwargs):
+        super().__init__(keyword, attributes, (), (), (), **kwargs)
+
+
 class DefTag(Tag):
     __keyword__ = "def"
 
     def __init__(self, keyword, attributes, **kwargs):
-        expressions = ["buffered", "cached"] + [
+        expressions = ["buffered", "cached", "inline"] + [
             c for c in attributes if c.startswith("cache_")
         ]
 
@@ -112,6 +112,8 @@ class FindIdentifiers(_ast_util.NodeVisitor):
         self._add_declared(node.name)
         self._visit_function(node, False)
 
+    visit_AsyncFunctionDef = visit_FunctionDef
+
     def visit_ListComp(self, node):
         if self.in_function:
             for comp in node.generators:
@@ -169,6 +171,8 @@ class FindIdentifiers(_ast_util.NodeVisitor):
         for statement in node.orelse:
             self.visit(statement)
 
+    visit_AsyncFor = visit_For
+
     def visit_Name(self, node):
         if isinstance(node.ctx, _ast.Store):
             # this is eqiuvalent to visit_AssName in
@@ -8,8 +8,12 @@
 Namespace, and various helper functions."""
 
 import builtins
+import contextvars
 import functools
+import inspect
+import queue
 import sys
+import threading
 
 from mako import compat
 from mako import exceptions
@@ -131,6 +135,14 @@ class Context:
 
         return self._buffer_stack.pop()
 
+    def _flush(self):
+        """flush the output written to this Context so far, if the output
+        is being streamed."""
+
+        flush = getattr(self._buffer_stack[0], "flush", None)
+        if flush is not None:
+            flush()
+
     def get(self, key, default=None):
         """Return a value from this :class:`.Context`."""
 
@@ -730,12 +742,40 @@ def capture(context, callable_, *args, **kwargs):
         )
     context._push_buffer()
     try:
-        callable_(*args, **kwargs)
+        result = callable_(*args, **kwargs)
+    except BaseException:
+        context._pop_buffer()
+        raise
+    buf = context._pop_buffer()
+    if inspect.isawaitable(result):
+        # the def writes its output once awaited, so the buffer is pushed
+        # again then; a result which is never awaited leaves the
+        # context's buffers as they were
+        return _capture_async(context, result)
+    return buf.getvalue()
+
+
+async def _capture_async(context, awaitable):
+    """complete capture() of a def of a template compiled with
+    enable_async."""
+
+    context._push_buffer()
+    try:
+        await awaitable
     finally:
         buf = context._pop_buffer()
     return buf.getvalue()
 
 
+async def _auto_await(value):
+    """await the given value if it's awaitable, such as the result of
+    calling a def within a template compiled with enable_async."""
+
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
 def _decorate_toplevel(fn):
     def decorate_render(render_fn):
         def go(context, *args, **kw):
@@ -786,6 +826,26 @@ def _include_file(context, uri, calling_uri, **kwargs):
         callable_(ctx, **kwargs)
 
 
+async def _include_file_async(context, uri, calling_uri, **kwargs):
+    """locate the template from the given uri and include it in
+    the current output of a template compiled with enable_async."""
+
+    template = _lookup_template(context, uri, calling_uri)
+    callable_, ctx = _populate_self_namespace(
+        context._clean_inheritance_tokens(), template
+    )
+    kwargs = _kwargs_for_include(callable_, context._data, **kwargs)
+    if template.include_error_handler:
+        try:
+            await _auto_await(callable_(ctx, **kwargs))
+        except Exception:
+            result = template.include_error_handler(ctx, compat.exception_as())
+            if not result:
+                raise
+    else:
+        await _auto_await(callable_(ctx, **kwargs))
+
+
 def _inherit_from(context, uri, calling_uri):
     """called by the _inherit method in template modules to set
     up the inheritance chain at the start of a template's
@@ -806,13 +866,16 @@ def _inherit_from(context, uri, calling_uri):
         populate_self=False,
     )
     context._data["parent"] = lclcontext._data["local"] = ih.inherits
-    callable_ = getattr(template.module, "_mako_inherit", None)
+    # probe the module dict directly; a failed module attribute lookup
+    # has to build an AttributeError message, which is comparatively slow
+    module_dict = template.module.__dict__
+    callable_ = module_dict.get("_mako_inherit")
     if callable_ is not None:
         ret = callable_(template, lclcontext)
         if ret:
             return ret
 
-    gen_ns = getattr(template.module, "_mako_generate_namespaces", None)
+    gen_ns = module_dict.get("_mako_generate_namespaces")
     if gen_ns is not None:
         gen_ns(context)
     return (template.callable_, lclcontext)
@@ -843,8 +906,9 @@ def _populate_self_namespace(context, template, self_ns=None):
             populate_self=False,
         )
     context._data["self"] = context._data["local"] = self_ns
-    if hasattr(template.module, "_mako_inherit"):
-        ret = template.module._mako_inherit(template, context)
+    inherit = template.module.__dict__.get("_mako_inherit")
+    if inherit is not None:
+        ret = inherit(template, context)
         if ret:
             return ret
     return (template.callable_, context)
@@ -874,26 +938,161 @@ def _render(template, callable_, args, data, as_unicode=False):
     return context._pop_buffer().getvalue()
 
 
-def _kwargs_for_callable(callable_, data):
+async def _render_async(template, callable_, args, data, as_unicode=False):
+    """create a Context and return the string output of the given
+    template and template callable, awaiting its rendering."""
+
+    if as_unicode:
+        buf = util.FastEncodingBuffer()
+    else:
+        buf = util.FastEncodingBuffer(
+            encoding=template.output_encoding, errors=template.encoding_errors
+        )
+    context = Context(buf, **data)
+    context._outputting_as_unicode = as_unicode
+    context._set_with_template(template)
+
+    await _render_context_async(
+        template,
+        callable_,
+        context,
+        *args,
+        **_kwargs_for_callable(callable_, data),
+    )
+    return context._pop_buffer().getvalue()
+
+
+class _StreamClosed(BaseException):
+    """raised within a template whose streamed output is no longer
+    being consumed."""
+
+
+def _render_stream(template, callable_, args, data, emit, as_unicode=False):
+    """create a Context and pass the output of the given template and
+    template callable to the given callable in chunks."""
+
+    if as_unicode:
+        stream = util.FlushingBuffer(emit, template.stream_chunk_size)
+    else:
+        stream = util.FlushingBuffer(
+            emit,
+            template.stream_chunk_size,
+            encoding=template.output_encoding,
+            errors=template.encoding_errors,
+        )
+    context = Context(stream, **data)
+    context._outputting_as_unicode = as_unicode
+    context._set_with_template(template)
+
+    _render_context(
+        template,
+        callable_,
+        context,
+        *args,
+        **_kwargs_for_callable(callable_, data),
+    )
+
+    buf = context._pop_buffer()
+    if buf is not stream:
+        # the buffer was replaced by that of the error template, which
+        # is encoded with the error template's own output_encoding.
+        # pass its output on in place of whatever wasn't yet flushed,
+        # in the same form as the rest of the stream
+        value = buf.getvalue()
+        if isinstance(value, bytes):
+            value = value.decode(buf.encoding, buf.errors)
+        stream.truncate()
+        stream.write(value)
+    stream.flush(final=True)
+
+
+def _render_iter(template, callable_, args, data, as_unicode=False):
+    """render the given template and template callable in a separate
+    thread, yielding its output in chunks."""
+
+    chunks = queue.Queue(maxsize=2)
+    closed = threading.Event()
+
+    def emit(chunk):
+        if closed.is_set():
+            raise _StreamClosed()
+        if chunk:
+            chunks.put((chunk, None))
+
+    def run():
+        try:
+            _render_stream(template, callable_, args, data, emit, as_unicode)
+        except _StreamClosed:
+            pass
+        except BaseException as err:
+            chunks.put((None, err))
+            return
+        chunks.put((None, None))
+
+    thread = threading.Thread(
+        target=contextvars.copy_context().run, args=(run,), daemon=True
+    )
+    thread.start()
+    try:
+        while True:
+            chunk, error = chunks.get()
+            if chunk is None:
+                if error is not None:
+                    raise error
+                return
+            yield chunk
+    finally:
+        # the thread stops at its next write once closed is set; as it
+        # checks closed before each write, at most one more chunk and the
+        # final marker can be put after the queue is drained
+        closed.set()
+        while True:
+            try:
+                chunks.get_nowait()
+            except queue.Empty:
+                break
+
+
+def _callable_args(callable_):
+    """Return whether the given render callable accepts ``**kwargs``,
+    along with the names of its arguments other than ``context``.
+
+    The result is stored on the callable, so that its signature is
+    inspected once, rather than for each render and ``<%include>``.
+
+    """
+    try:
+        return callable_._mako_args
+    except AttributeError:
+        pass
+
     argspec = compat.inspect_getargspec(callable_)
+    namedargs = []
+    for arg in argspec[0] + [v for v in argspec[1:3] if v is not None]:
+        if arg != "context" and arg not in namedargs:
+            namedargs.append(arg)
+    args = (bool(argspec[2]), tuple(namedargs))
+
+    try:
+        callable_._mako_args = args
+    except AttributeError:
+        pass
+    return args
+
+
+def _kwargs_for_callable(callable_, data):
+    has_kwargs, namedargs = _callable_args(callable_)
     # for normal pages, **pageargs is usually present
-    if argspec[2]:
+    if has_kwargs:
         return data
 
     # for rendering defs from the top level, figure out the args
-    namedargs = argspec[0] + [v for v in argspec[1:3] if v is not None]
-    kwargs = {}
-    for arg in namedargs:
-        if arg != "context" and arg in data and arg not in kwargs:
-            kwargs[arg] = data[arg]
-    return kwargs
+    return {arg: data[arg] for arg in namedargs if arg in data}
 
 
 def _kwargs_for_include(callable_, data, **kwargs):
-    argspec = compat.inspect_getargspec(callable_)
-    namedargs = argspec[0] + [v for v in argspec[1:3] if v is not None]
-    for arg in namedargs:
-        if arg != "context" and arg in data and arg not in kwargs:
+    for arg in _callable_args(callable_)[1]:
+        if arg in data and arg not in kwargs:
             kwargs[arg] = data[arg]
     return kwargs
 
@@ -901,6 +1100,12 @@ def _kwargs_for_include(callable_, data, **kwargs):
 def _render_context(tmpl, callable_, context, *args, **kwargs):
     import mako.template as template
 
+    if tmpl.enable_async:
+        raise exceptions.RuntimeException(
+            "Template %r was compiled with enable_async=True; "
+            "use render_async() to render it" % tmpl.uri
+        )
+
     # create polymorphic 'self' namespace for this
     # template with possibly updated context
     if not isinstance(tmpl, template.DefTemplate):
@@ -913,6 +1118,39 @@ def _render_context(tmpl, callable_, context, *args, **kwargs):
         _exec_template(callable_, context, args=args, kwargs=kwargs)
 
 
+async def _render_context_async(tmpl, callable_, context, *args, **kwargs):
+    import mako.template as template
+
+    if not isinstance(tmpl, template.DefTemplate):
+        inherit, lclcontext = _populate_self_namespace(context, tmpl)
+        await _exec_template_async(
+            inherit, lclcontext, args=args, kwargs=kwargs
+        )
+    else:
+        inherit, lclcontext = _populate_self_namespace(context, tmpl.parent)
+        await _exec_template_async(
+            callable_, context, args=args, kwargs=kwargs
+        )
+
+
+async def _exec_template_async(callable_, context, args=None, kwargs=None):
+    """execute a rendering callable which may be a coroutine function,
+    as for _exec_template()."""
+
+    template = context._with_template
+    if template is not None and (
+        template.format_exceptions or template.error_handler
+    ):
+        # unlike _exec_template(), exceptions not derived from Exception,
+        # in particular asyncio.CancelledError, are always propagated
+        try:
+            await _auto_await(callable_(context, *args, **kwargs))
+        except Exception:
+            _render_error(template, context, compat.exception_as())
+    else:
+        await _auto_await(callable_(context, *args, **kwargs))
+
+
 def _exec_template(callable_, context, args=None, kwargs=None):
     """execute a rendering callable given the callable, a
     Context, and optional explicit arguments
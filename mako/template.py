@@ -8,13 +8,17 @@
 template strings, as well as template runtime operations."""
 
 import contextlib
+import hashlib
 from importlib import abc
 from importlib import machinery
+from importlib import util as importlib_util
 import json
+import marshal
 import os
 import re
 import shutil
 import stat
+import sys
 import tempfile
 import types
 import warnings
@@ -84,9 +88,41 @@ class Template:
         Use the ``'url'`` argument in the ``cache_args`` dictionary.
         See :ref:`caching_toplevel`.
 
+    :param compile_cache_dir: Filesystem location of a cache of generated
+     Python module files, which may be shared among processes and hosts.
+     When given, a template loaded from a file is looked up within the
+     cache by a hash of its source, its ``uri`` and the options that
+     affect code generation, and is compiled and stored there only if
+     not already present.  Its filename isn't part of the key, so that
+     identical templates at different paths share a module.  This takes
+     the place of ``module_directory`` for such templates, and doesn't
+     depend on the modification times of files.  See
+     :ref:`usage_compile_cache`.
+
+     .. versionadded:: 1.4.2
+
     :param default_filters: List of string filter names that will
      be applied to all expressions.  See :ref:`filtering_default_filters`.
 
+    :param direct_context_lookups: When ``True``, the names which a
+     template or def references without declaring them are looked up
+     directly within the namespace of the :class:`.Context` and then
+     within Python builtins, rather than by calling
+     :meth:`.Context.get` for each name upon every call.  This reduces
+     the overhead of calling a def, in particular one that's called many
+     times within a loop.  A :class:`.Context` subclass which overrides
+     ``get()`` or ``__getitem__()`` isn't consulted for these names.
+
+     .. versionadded:: 1.4.2
+
+    :param enable_async: When ``True``, the template is compiled into
+     coroutine functions, which are rendered using
+     :meth:`.Template.render_async`, allowing ``await`` within expressions
+     and Python blocks, as well as ``% async for`` and ``% async with``
+     control lines.  See :ref:`usage_async`.
+
+     .. versionadded:: 1.4.2
+
     :param enable_loop: When ``True``, enable the ``loop`` context variable.
      This can be set to ``False`` to support templates that may
      be making usage of the name "``loop``".   Individual templates can
@@ -149,6 +185,20 @@ class Template:
     :param module_directory: Filesystem location where generated
      Python module files will be placed.
 
+    :param module_bytecode: When ``True``, the compiled code of each
+     generated Python module file is marshalled to a file alongside it,
+     named after the module file and the running Python implementation
+     (e.g. ``index.html.py.cpython-312.mkc``), and is loaded from there
+     afterwards rather than compiling the module file each time it's
+     loaded.  The stored code is used only if it was compiled by the same
+     versions of Python and Mako from the module file's current content.
+     Applies to templates loaded from a ``module_directory``,
+     ``module_filename`` or ``compile_cache_dir``; if the code can't be
+     written, such as to a read-only directory, the module file is compiled
+     as usual.
+
+     .. versionadded:: 1.4.2
+
     :param module_filename: Overrides the filename of the generated
      Python module file. For advanced usage only.
 
@@ -210,6 +260,13 @@ class Template:
 
      .. versionadded:: 0.3.6
 
+    :param stream_chunk_size: The number of characters of output which
+     are collected before they're passed on when the template is
+     streamed using :meth:`.Template.generate` or
+     :meth:`.Template.render_to`.  Defaults to 8192.
+
+     .. versionadded:: 1.4.2
+
     :param uri: string URI or other identifier for this template.
      If not provided, the ``uri`` is generated from the filesystem
      path, or from the in-memory identity of a non-file-based
@@ -222,6 +279,8 @@ class Template:
 
     lexer_cls = Lexer
 
+    stream_chunk_size = 8192
+
     def __init__(
         self,
         text=None,
@@ -251,6 +310,11 @@ class Template:
         preprocessor=None,
         lexer_cls=None,
         include_error_handler=None,
+        stream_chunk_size=None,
+        enable_async=False,
+        compile_cache_dir=None,
+        module_bytecode=False,
+        direct_context_lookups=False,
     ):
         if uri:
             self.module_id = re.sub(r"\W", "_", uri)
@@ -277,8 +341,12 @@ class Template:
         self.output_encoding = output_encoding
         self.encoding_errors = encoding_errors
         self.enable_loop = enable_loop
+        self.enable_async = enable_async
         self.strict_undefined = strict_undefined
+        self.direct_context_lookups = direct_context_lookups
         self.module_writer = module_writer
+        self.compile_cache_dir = compile_cache_dir
+        self.module_bytecode = module_bytecode
 
         if default_filters is None:
             self.default_filters = ["str"]
@@ -293,6 +361,9 @@ class Template:
         if lexer_cls is not None:
             self.lexer_cls = lexer_cls
 
+        if stream_chunk_size is not None:
+            self.stream_chunk_size = stream_chunk_size
+
         # if plain text, compile code in memory only
         if text is not None:
             code, module = _compile_text(self, text, filename)
@@ -365,7 +436,10 @@ class Template:
             self.cache_args["url"] = cache_url
 
     def _compile_from_file(self, path, filename):
-        if path is not None:
+        if self.compile_cache_dir is not None:
+            module, path = self._compile_from_cache(filename)
+            ModuleInfo(module, path, self, filename, None, None, None)
+        elif path is not None:
             util.verify_directory(os.path.dirname(path))
             filemtime = os.stat(filename)[stat.ST_MTIME]
             with _translate_module_warnings(
@@ -380,14 +454,14 @@ class Template:
                         _compile_module_file(
                             self, data, filename, path, self.module_writer
                         )
-                module = compat.load_module(self.module_id, path)
+                module = self._load_module(path)
                 if module._magic_number != codegen.MAGIC_NUMBER:
                     data = util.read_file(filename)
                     with _drop_expression_warnings():
                         _compile_module_file(
                             self, data, filename, path, self.module_writer
                         )
-                    module = compat.load_module(self.module_id, path)
+                    module = self._load_module(path)
 
             ModuleInfo(module, path, self, filename, None, None, None)
         else:
@@ -400,6 +474,59 @@ class Template:
             ModuleInfo(module, None, self, filename, code, None, None)
         return module
 
+    def _compile_from_cache(self, filename):
+        # the modification time is taken before the file is read, so that
+        # a change made as it's read is still seen by filesystem_checks
+        filemtime = os.stat(filename)[stat.ST_MTIME]
+        data = util.read_file(filename)
+
+        key = _compile_cache_key(self, data)
+        path = os.path.join(
+            os.path.abspath(self.compile_cache_dir), key[0:2], key + ".py"
+        )
+        with _translate_module_warnings(
+            lambda: util.read_python_file(path), path, filename
+        ):
+            if not os.path.exists(path):
+                util.verify_directory(os.path.dirname(path))
+                with _drop_expression_warnings():
+                    _compile_module_file(
+                        self, data, filename, path, self.module_writer
+                    )
+            module = self._load_module(path)
+
+        # the module may have been generated from an identical file that
+        # was modified earlier than this one
+        module._modified_time = max(module._modified_time, filemtime)
+        return module, path
+
+    def _load_module(self, path):
+        if not self.module_bytecode or sys.implementation.cache_tag is None:
+            return compat.load_module(self.module_id, path)
+
+        source = util.read_file(path)
+        header = _bytecode_header(source)
+        bytecode_path = "%s.%s.mkc" % (path, sys.implementation.cache_tag)
+
+        code = None
+        try:
+            with open(bytecode_path, "rb") as f:
+                data = f.read()
+        except OSError:
+            pass
+        else:
+            if data.startswith(header):
+                try:
+                    code = marshal.loads(data[len(header) :])
+                except (EOFError, ValueError, TypeError):
+                    pass
+
+        if code is None:
+            code = compile(source, path, "exec", dont_inherit=True)
+            _write_bytecode(bytecode_path, header + marshal.dumps(code))
+
+        return compat.load_module(self.module_id, path, code)
+
     @property
     def source(self):
         """Return the template source code for this :class:`.Template`."""
@@ -449,6 +576,101 @@ class Template:
             self, self.callable_, args, data, as_unicode=True
         )
 
+    async def render_async(self, *args, **data):
+        """Render the output of this template as a string, awaiting the
+        rendering of a template compiled with
+        :paramref:`.Template.enable_async`.
+
+        Arguments are accepted and the result is returned as for
+        :meth:`.Template.render`.
+
+        .. versionadded:: 1.4.2
+
+        """
+        return await runtime._render_async(self, self.callable_, args, data)
+
+    async def render_unicode_async(self, *args, **data):
+        """Render the output of this template as a unicode object,
+        awaiting the rendering of a template compiled with
+        :paramref:`.Template.enable_async`.
+
+        .. versionadded:: 1.4.2
+
+        """
+        return await runtime._render_async(
+            self, self.callable_, args, data, as_unicode=True
+        )
+
+    def render_to(self, fileobj, /, *args, **data):
+        """Render the output of this template into the given file-like
+        object, or callable, as it's produced.
+
+        Output is written in blocks of at least
+        :paramref:`.Template.stream_chunk_size` characters, as well as at
+        each ``<%flush/>`` tag, by calling the ``write()`` method of
+        ``fileobj``, or ``fileobj`` itself if it has no such method, such
+        as the ``sendall()`` method of a socket.  If the template specifies
+        an output encoding, each block is encoded incrementally and
+        written as ``bytes``, else it's written as a string.  The output
+        is not otherwise retained, so that a large document doesn't need
+        to be held in memory as a whole.
+
+        Other arguments are accepted as for :meth:`.Template.render`.
+
+        .. versionadded:: 1.4.2
+
+        """
+        runtime._render_stream(
+            self,
+            self.callable_,
+            args,
+            data,
+            getattr(fileobj, "write", fileobj),
+        )
+
+    def generate(self, *args, **data):
+        """Render the output of this template, returning an iterator
+        which yields the output in chunks as it's produced.
+
+        Arguments are accepted as for :meth:`.Template.render`, and each
+        chunk is encoded in the same way as the result of that method.
+        Output is passed on once
+        :paramref:`.Template.stream_chunk_size` characters have been
+        collected, or when the template reaches a ``<%flush/>`` tag.
+        Output produced within a buffered or filtered ``<%def>``, or
+        by ``capture()``, is passed on once it's written to the page.
+
+        The template is rendered in a separate thread, with a copy of the
+        current :mod:`contextvars` context, which waits while the chunks
+        yielded are not being consumed.  Closing the iterator stops the
+        rendering at the template's next write.
+
+        .. warning:: As the template is rendered in another thread, state
+           which is local to the calling thread, such as that held in
+           ``threading.local`` objects, isn't available to the template.
+           This includes many thread-scoped database sessions and request
+           objects.  :meth:`.Template.render_to` produces output in chunks
+           within the calling thread; see :ref:`usage_streaming`.
+
+        .. versionadded:: 1.4.2
+
+        """
+        return runtime._render_iter(self, self.callable_, args, data)
+
+    def generate_unicode(self, *args, **data):
+        """Render the output of this template as an iterator of unicode
+        chunks.
+
+        The template is rendered in a separate thread, as for
+        :meth:`.Template.generate`.
+
+        .. versionadded:: 1.4.2
+
+        """
+        return runtime._render_iter(
+            self, self.callable_, args, data, as_unicode=True
+        )
+
     def render_context(self, context, *args, **kwargs):
         """Render this :class:`.Template` with the given context.
 
@@ -527,6 +749,7 @@ class ModuleTemplate(Template):
         self.output_encoding = output_encoding
         self.encoding_errors = encoding_errors
         self.enable_loop = module._enable_loop
+        self.enable_async = getattr(module, "_enable_async", False)
 
         self.module = module
         self.filename = template_filename
@@ -569,6 +792,8 @@ class DefTemplate(Template):
         self.error_handler = parent.error_handler
         self.include_error_handler = parent.include_error_handler
         self.enable_loop = parent.enable_loop
+        self.enable_async = parent.enable_async
+        self.stream_chunk_size = parent.stream_chunk_size
         self.lookup = parent.lookup
 
     def get_def(self, name):
@@ -631,7 +856,26 @@ class ModuleInfo:
         else:
             return util.read_python_file(self.module_filename)
 
-    @property
+    @util.memoized_property
+    def full_line_map(self):
+        """The template line number for each line of the module source,
+        indexed from zero.
+
+        The map is read from the module's metadata once and kept, so that
+        tracebacks through the module are translated without parsing the
+        module source each time.
+
+        """
+        return self.get_module_source_metadata(self.code, full_line_map=True)[
+            "full_line_map"
+        ]
+
+    @util.memoized_property
+    def source_lines(self):
+        """The lines of the template source, as split on newlines."""
+        return self.source.split("\n")
+
+    @util.memoized_property
     def source(self):
         if self.template_source is None:
             data = util.read_file(self.template_filename)
@@ -669,10 +913,62 @@ def _compile(template, text, filename, generate_magic_comment):
         strict_undefined=template.strict_undefined,
         enable_loop=template.enable_loop,
         reserved_names=template.reserved_names,
+        enable_async=template.enable_async,
+        direct_context_lookups=template.direct_context_lookups,
     )
     return source, lexer
 
 
+def _compile_cache_key(template, data):
+    """Return the key of a template's generated module within the
+    ``compile_cache_dir``.
+
+    The key is a hash of the template source along with everything else
+    that the generated module depends upon.  A preprocessor or lexer class
+    is included by name only, so a change to its behavior requires the
+    cache to be cleared.
+
+    The template's filename isn't included, so that identical templates
+    located at different paths share a module.  The filename recorded in
+    the module is then that of the first such template, however the
+    :class:`.ModuleInfo` of each template refers to its own file.
+
+    """
+
+    def _name(obj):
+        return "%s.%s" % (
+            getattr(obj, "__module__", None),
+            getattr(obj, "__qualname__", type(obj).__qualname__),
+        )
+
+    preprocessor = template.preprocessor
+    if preprocessor is None:
+        preprocessor = []
+    elif not hasattr(preprocessor, "__iter__"):
+        preprocessor = [preprocessor]
+
+    options = (
+        codegen.MAGIC_NUMBER,
+        template.uri,
+        template.input_encoding,
+        template.default_filters,
+        template.buffer_filters,
+        template.imports,
+        template.future_imports,
+        template.strict_undefined,
+        template.enable_loop,
+        template.enable_async,
+        template.direct_context_lookups,
+        [_name(p) for p in preprocessor],
+        _name(template.lexer_cls),
+    )
+
+    hash_ = hashlib.sha256(repr(options).encode("utf-8"))
+    hash_.update(b"\0")
+    hash_.update(data)
+    return hash_.hexdigest()
+
+
 class _ModuleSourceLoader(abc.Loader):
     """Provide the generated source of an in-memory template module.
 
@@ -849,6 +1145,36 @@ def _compile_module_file(template, text, filename, outputpath, module_writer):
         shutil.move(name, outputpath)
 
 
+def _bytecode_header(source):
+    """Return the header identifying the marshalled code of a module file
+    with the given source, for the running versions of Python and Mako."""
+
+    return b"".join(
+        [
+            b"MAKO",
+            importlib_util.MAGIC_NUMBER,
+            codegen.MAGIC_NUMBER.to_bytes(4, "little"),
+            hashlib.sha256(source).digest(),
+        ]
+    )
+
+
+def _write_bytecode(path, data):
+    try:
+        dest, name = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(dest, "wb") as f:
+                f.write(data)
+            shutil.move(name, path)
+        except BaseException:
+            os.unlink(name)
+            raise
+    except OSError:
+        # not writable, such as within a read-only image; the module
+        # file is then compiled each time it's loaded
+        pass
+
+
 def _get_module_info_from_callable(callable_):
     return _get_module_info(callable_.__globals__["__name__"])
 
@@ -6,10 +6,9 @@
 from ast import parse
 import codecs
 import collections
-import operator
 import os
 import re
-import timeit
+import threading
 
 from .compat import importlib_metadata_get
 
@@ -158,65 +157,133 @@ class FastEncodingBuffer:
             return self.delim.join(self.data)
 
 
-class LRUCache(dict):
-    """A dictionary-like object that stores a limited number of items,
-    discarding lesser used items periodically.
+class FlushingBuffer(FastEncodingBuffer):
+    """a FastEncodingBuffer which passes its contents on to a callable
+    whenever at least ``chunk_size`` characters have been written, or
+    when flush() is called.
 
-    this is a rewrite of LRUCache from Myghty to use a periodic timestamp-based
-    paradigm so that synchronization is not really needed.  the size management
-    is inexact.
-    """
+    when an encoding is given, each chunk is encoded using an incremental
+    encoder, so that stateful encodings produce the same output as
+    encoding the whole value at once."""
+
+    def __init__(self, emit, chunk_size, encoding=None, errors="strict"):
+        super().__init__(encoding, errors)
+        self.emit = emit
+        self.chunk_size = chunk_size
+        self.size = 0
+        self.write = self._write
+        if encoding:
+            self.encoder = codecs.getincrementalencoder(encoding)(errors)
+        else:
+            self.encoder = None
+
+    def truncate(self):
+        self.data = collections.deque()
+        self.size = 0
+
+    def _write(self, text):
+        self.data.append(text)
+        self.size += len(text)
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def flush(self, final=False):
+        value = self.delim.join(self.data)
+        self.data.clear()
+        self.size = 0
+        if self.encoder is not None:
+            value = self.encoder.encode(value, final)
+        if value:
+            self.emit(value)
+
+
+class LRUCache(collections.OrderedDict):
+    """A dictionary-like object that stores a limited number of items,
+    discarding the least recently used items once it grows beyond its
+    capacity.
 
-    class _Item:
-        def __init__(self, key, value):
-            self.key = key
-            self.value = value
-            self.timestamp = timeit.default_timer()
+    Items are kept in order of use, so that both access and eviction are
+    O(1).  The cache is allowed to grow to ``capacity * (1 + threshold)``
+    items before it's trimmed back down to ``capacity``; a ``threshold`` of
+    zero keeps the size exact.  The cache may be shared among threads;
+    changes to it are synchronized, while lookups are not.
 
-        def __repr__(self):
-            return repr(self.value)
+    The number of cache hits, misses and evicted items are counted in
+    :attr:`.hits`, :attr:`.misses` and :attr:`.evictions`.
+    """
 
     def __init__(self, capacity, threshold=0.5):
+        super().__init__()
         self.capacity = capacity
         self.threshold = threshold
+        self.hits = self.misses = self.evictions = 0
+        self._mutex = threading.Lock()
 
     def __getitem__(self, key):
-        item = dict.__getitem__(self, key)
-        item.timestamp = timeit.default_timer()
-        return item.value
+        # reads aren't synchronized, as each operation on the dictionary
+        # is atomic by itself; only the hit and miss counts may then be
+        # inexact
+        try:
+            value = collections.OrderedDict.__getitem__(self, key)
+        except KeyError:
+            self.misses += 1
+            raise
+        try:
+            self.move_to_end(key)
+        except KeyError:
+            # evicted by another thread in the meantime
+            pass
+        self.hits += 1
+        return value
 
-    def values(self):
-        return [i.value for i in dict.values(self)]
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
 
     def setdefault(self, key, value):
-        if key in self:
-            return self[key]
-        self[key] = value
-        return value
+        with self._mutex:
+            if collections.OrderedDict.__contains__(self, key):
+                self.move_to_end(key)
+                self.hits += 1
+                return collections.OrderedDict.__getitem__(self, key)
+            self.misses += 1
+            self._set(key, value)
+            return value
 
     def __setitem__(self, key, value):
-        item = dict.get(self, key)
-        if item is None:
-            item = self._Item(key, value)
-            dict.__setitem__(self, key, item)
-        else:
-            item.value = value
-        self._manage_size()
-
-    def _manage_size(self):
-        while len(self) > self.capacity + self.capacity * self.threshold:
-            bytime = sorted(
-                dict.values(self),
-                key=operator.attrgetter("timestamp"),
-                reverse=True,
-            )
-            for item in bytime[self.capacity :]:
-                try:
-                    del self[item.key]
-                except KeyError:
-                    # if we couldn't find a key, most likely some other thread
-                    # broke in on us. loop around and try again
-                    break
+        with self._mutex:
+            self._set(key, value)
+
+    def _set(self, key, value):
+        collections.OrderedDict.__setitem__(self, key, value)
+        self.move_to_end(key)
+        if len(self) > self.capacity + self.capacity * self.threshold:
+            while len(self) > self.capacity:
+                self.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, *default):
+        with self._mutex:
+            return collections.OrderedDict.pop(self, key, *default)
+
+    def __delitem__(self, key):
+        with self._mutex:
+            collections.OrderedDict.__delitem__(self, key)
+
+    def clear(self):
+        with self._mutex:
+            collections.OrderedDict.clear(self)
+
+    def __reduce__(self):
+        return (
+            self.__class__,
+            (self.capacity, self.threshold),
+            None,
+            None,
+            iter(list(self.items())),
+        )
 
 
 # Regexp to match python magic encoding line
@@ -65,12 +65,21 @@ def lint(session: nox.Session) -> None:
         "./mako/",
         "./test/",
         "./examples/",
+        "./bench/",
         "setup.py",
         "noxfile.py",
     )
     session.run("black", "--check", ".")
 
 
+@nox.session(name="bench")
+def bench(session: nox.Session) -> None:
+    """Run the performance benchmarks."""
+
+    session.install(".")
+    session.run("python", "-m", "bench", *session.posargs)
+
+
 @nox.session(name="pep484")
 def mypy_check(session: nox.Session) -> None:
     """Run mypy type checking - not yet implemented."""
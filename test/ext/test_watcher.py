@@ -0,0 +1,303 @@
+import errno
+import os
+import tempfile
+import time
+import types
+from unittest import mock
+
+import pytest
+
+from mako.ext import watcher
+from mako.ext.autohandler import autohandler
+from mako.ext.watcher import TemplateWatcher
+from mako.lookup import TemplateLookup
+from mako.testing.assertions import eq_
+
+requires_inotify = pytest.mark.skipif(
+    not watcher.has_inotify, reason="inotify not available"
+)
+
+
+def _write(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+
+
+def _touch_future(path):
+    future = time.time() + 10
+    os.utime(path, (future, future))
+
+
+class TemplateWatcherTest:
+    @pytest.fixture
+    def lookup(self):
+        with tempfile.TemporaryDirectory() as dir_:
+            _write(os.path.join(dir_, "index.html"), "index")
+            _write(os.path.join(dir_, "other.html"), "other")
+            yield TemplateLookup(directories=[dir_], filesystem_checks=False)
+
+    def _path(self, lookup, name):
+        return os.path.join(lookup.directories[0], name)
+
+    def test_modified_evicts_and_recompiles(self, lookup):
+        index = lookup.get_template("/index.html")
+        other = lookup.get_template("/other.html")
+
+        _write(self._path(lookup, "index.html"), "new index")
+        w = TemplateWatcher(lookup, use_inotify=False)
+        w._process_changes(
+            [(self._path(lookup, "index.html"), watcher.MODIFIED)]
+        )
+
+        reloaded = lookup._collection["/index.html"]
+        assert reloaded is not index
+        eq_(reloaded.render(), "new index")
+        assert lookup.get_template("/other.html") is other
+
+    def test_no_recompile(self, lookup):
+        lookup.get_template("/index.html")
+
+        w = TemplateWatcher(lookup, recompile=False, use_inotify=False)
+        w._process_changes(
+            [(self._path(lookup, "index.html"), watcher.MODIFIED)]
+        )
+        assert "/index.html" not in lookup._collection
+
+    def test_deleted_evicts(self, lookup):
+        lookup.get_template("/index.html")
+
+        os.remove(self._path(lookup, "index.html"))
+        w = TemplateWatcher(lookup, use_inotify=False)
+        w._process_changes(
+            [(self._path(lookup, "index.html"), watcher.DELETED)]
+        )
+        assert "/index.html" not in lookup._collection
+
+    def test_created_clears_uri_cache(self, lookup):
+        dir_ = lookup.directories[0]
+        os.mkdir(os.path.join(dir_, "sub"))
+        _write(os.path.join(dir_, "sub", "page.html"), "page")
+        template = lookup.get_template("/sub/page.html")
+
+        context = types.SimpleNamespace(lookup=lookup)
+        eq_(autohandler(template, context), None)
+        assert lookup._uri_cache
+
+        _write(os.path.join(dir_, "autohandler"), "auto")
+        w = TemplateWatcher(lookup, use_inotify=False)
+        w._process_changes(
+            [(os.path.join(dir_, "autohandler"), watcher.CREATED)]
+        )
+        eq_(lookup._uri_cache, {})
+        eq_(autohandler(template, context), "/autohandler")
+
+    def test_directory_change_evicts_contents(self, lookup):
+        dir_ = lookup.directories[0]
+        os.mkdir(os.path.join(dir_, "sub"))
+        _write(os.path.join(dir_, "sub", "page.html"), "page")
+        page = lookup.get_template("/sub/page.html")
+        index = lookup.get_template("/index.html")
+
+        # a new "sub" directory moved into place
+        _write(os.path.join(dir_, "sub", "page.html"), "new page")
+        w = TemplateWatcher(lookup, use_inotify=False)
+        w._process_changes([(os.path.join(dir_, "sub"), watcher.CREATED)])
+
+        reloaded = lookup._collection["/sub/page.html"]
+        assert reloaded is not page
+        eq_(reloaded.render(), "new page")
+        assert lookup._collection["/index.html"] is index
+
+        w._process_changes([(os.path.join(dir_, "sub"), watcher.DELETED)])
+        assert "/sub/page.html" not in lookup._collection
+        assert lookup._collection["/index.html"] is index
+
+    def test_collection_order_unchanged(self):
+        with tempfile.TemporaryDirectory() as dir_:
+            for name in ("a.html", "b.html", "c.html"):
+                _write(os.path.join(dir_, name), name)
+            lookup = TemplateLookup(
+                directories=[dir_], filesystem_checks=False, collection_size=10
+            )
+            for name in ("a.html", "b.html", "c.html"):
+                lookup.get_template("/" + name)
+            hits = lookup._collection.hits
+
+            w = TemplateWatcher(lookup, use_inotify=False)
+            w._process_changes(
+                [(os.path.join(dir_, "other.html"), watcher.MODIFIED)]
+            )
+            eq_(list(lookup._collection), ["/a.html", "/b.html", "/c.html"])
+            eq_(lookup._collection.hits, hits)
+
+    @requires_inotify
+    def test_inotify_directory_moved(self, lookup):
+        dir_ = lookup.directories[0]
+        os.mkdir(os.path.join(dir_, "sub"))
+        _write(os.path.join(dir_, "sub", "page.html"), "page")
+        backend = watcher._InotifyBackend(lookup.directories)
+        try:
+            os.rename(os.path.join(dir_, "sub"), os.path.join(dir_, "old"))
+            os.mkdir(os.path.join(dir_, "new"))
+            _write(os.path.join(dir_, "new", "page.html"), "new page")
+            os.rename(os.path.join(dir_, "new"), os.path.join(dir_, "sub"))
+            changes = backend.read(1)
+            assert (os.path.join(dir_, "sub"), watcher.CREATED) in changes
+
+            # the watch of the moved directory is replaced, so that changes
+            # within it aren't reported under its previous path
+            _write(os.path.join(dir_, "old", "page.html"), "old page")
+            _write(os.path.join(dir_, "sub", "page.html"), "newer page")
+            eq_(
+                sorted(set(backend.read(1))),
+                [
+                    (os.path.join(dir_, "old", "page.html"), watcher.MODIFIED),
+                    (os.path.join(dir_, "sub", "page.html"), watcher.MODIFIED),
+                ],
+            )
+        finally:
+            backend.close()
+
+    @requires_inotify
+    def test_inotify_overflow(self, lookup):
+        backend = watcher._InotifyBackend(lookup.directories)
+        try:
+            overflow = watcher._EVENT_HEADER.pack(
+                -1, watcher.IN_Q_OVERFLOW, 0, 0
+            )
+            with (
+                mock.patch.object(
+                    watcher.select, "select", return_value=([1], [], [])
+                ),
+                mock.patch.object(watcher.os, "read", return_value=overflow),
+            ):
+                changes = backend.read(0)
+            eq_(changes, [(lookup.directories[0], watcher.CREATED)])
+            eq_(list(backend._watches.values()), lookup.directories)
+        finally:
+            backend.close()
+
+        index = lookup.get_template("/index.html")
+        w = TemplateWatcher(lookup, recompile=False, use_inotify=False)
+        w._process_changes(changes)
+        assert "/index.html" not in lookup._collection
+        assert index.filename
+
+    def test_polling_backend(self, lookup):
+        dir_ = lookup.directories[0]
+        backend = watcher._PollingBackend(lookup.directories, None)
+        eq_(backend.read(0), [])
+
+        _touch_future(os.path.join(dir_, "index.html"))
+        os.remove(os.path.join(dir_, "other.html"))
+        _write(os.path.join(dir_, "new.html"), "new")
+
+        eq_(
+            sorted(backend.read(0)),
+            [
+                (os.path.join(dir_, "index.html"), watcher.MODIFIED),
+                (os.path.join(dir_, "new.html"), watcher.CREATED),
+                (os.path.join(dir_, "other.html"), watcher.DELETED),
+            ],
+        )
+        eq_(backend.read(0), [])
+
+    @pytest.mark.parametrize(
+        "use_inotify",
+        [
+            pytest.param(True, marks=requires_inotify),
+            False,
+        ],
+    )
+    def test_watch_thread(self, lookup, use_inotify):
+        lookup.get_template("/index.html")
+
+        w = TemplateWatcher(lookup, interval=0.05, use_inotify=use_inotify)
+        w.start()
+        try:
+            _write(self._path(lookup, "index.html"), "new index")
+            _touch_future(self._path(lookup, "index.html"))
+
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline:
+                template = lookup._collection.get("/index.html")
+                if template is not None and template.render() == "new index":
+                    break
+                time.sleep(0.02)
+            else:
+                assert False, "template was not reloaded"
+        finally:
+            w.stop()
+        assert w._thread is None
+
+    def test_backend_failure_falls_back_to_polling(self, lookup):
+        class FailingBackend:
+            closed = False
+
+            def __init__(self, directories):
+                pass
+
+            def read(self, timeout):
+                raise OSError(errno.ENOSPC, "No space left on device")
+
+            def close(self):
+                self.closed = True
+
+        lookup.get_template("/index.html")
+
+        w = TemplateWatcher(lookup, interval=0.05, use_inotify=False)
+        w.use_inotify = True
+        with (
+            mock.patch.object(watcher, "_InotifyBackend", FailingBackend),
+            pytest.warns(
+                RuntimeWarning,
+                match="falling back to polling: OSError: .*No space left",
+            ),
+        ):
+            w.start()
+            failing = w._backend
+            deadline = time.monotonic() + 5
+            while not isinstance(w._backend, watcher._PollingBackend):
+                assert time.monotonic() < deadline, "backend not replaced"
+                time.sleep(0.02)
+        try:
+            assert failing.closed
+            assert w._thread.is_alive()
+
+            # the watcher continues to pick up changes
+            lookup.get_template("/index.html")
+            _write(self._path(lookup, "index.html"), "new index")
+            _touch_future(self._path(lookup, "index.html"))
+
+            deadline = time.monotonic() + 5
+            while time.monotonic() < deadline:
+                template = lookup._collection.get("/index.html")
+                if template is not None and template.render() == "new index":
+                    break
+                time.sleep(0.02)
+            else:
+                assert False, "template was not reloaded"
+        finally:
+            w.stop()
+
+    def test_process_failure_clears_collection(self, lookup):
+        lookup.get_template("/index.html")
+        lookup.get_template("/other.html")
+
+        w = TemplateWatcher(lookup, interval=0.05, use_inotify=False)
+        with (
+            mock.patch.object(
+                w, "_process_changes", side_effect=ValueError("bad change")
+            ),
+            pytest.warns(RuntimeWarning, match="retrying: ValueError"),
+        ):
+            w.start()
+            try:
+                _touch_future(self._path(lookup, "other.html"))
+                deadline = time.monotonic() + 5
+                while len(lookup._collection):
+                    assert time.monotonic() < deadline, "not cleared"
+                    time.sleep(0.02)
+                assert w._thread.is_alive()
+            finally:
+                w.stop()
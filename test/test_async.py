@@ -0,0 +1,205 @@
+import asyncio
+import gc
+import warnings
+
+from mako import exceptions
+from mako import lookup
+from mako.template import Template
+from mako.testing.assertions import assert_raises_message
+from mako.testing.assertions import eq_
+from mako.testing.helpers import result_lines
+
+
+async def fetch(value):
+    await asyncio.sleep(0)
+    return value
+
+
+async def arange(n):
+    for i in range(n):
+        await asyncio.sleep(0)
+        yield i
+
+
+def render(template, **kw):
+    return asyncio.run(template.render_async(**kw))
+
+
+class AsyncTest:
+    def test_await_expressions(self):
+        t = Template(
+            """
+<% x = await fetch(5) %>
+x: ${x}
+y: ${await fetch("y")}
+""",
+            enable_async=True,
+        )
+        eq_(result_lines(render(t, fetch=fetch)), ["x: 5", "y: y"])
+
+    def test_defs(self):
+        t = Template(
+            """
+<%def name="a(x)">a: ${await fetch(x)}</%def>
+<%def name="b()" buffered="True">b: ${a(1)}</%def>
+<%def name="c()" filter="trim">   c: ${a(2)}   </%def>
+${a(0)}
+${(await b()).upper()}
+${c()}
+${capture(a, 3) | h}
+<%block>block: ${a(4)}</%block>
+""",
+            enable_async=True,
+        )
+        eq_(
+            result_lines(render(t, fetch=fetch)),
+            ["a: 0", "B: A: 1", "c: a: 2", "a: 3", "block: a: 4"],
+        )
+
+    def test_capture_not_awaited(self):
+        t = Template(
+            """
+<%def name="a(x)">a: ${x}</%def>
+before
+<% s = capture(a, 3) %>
+after
+${await capture(a, 4)}
+""",
+            enable_async=True,
+        )
+        with warnings.catch_warnings():
+            # "coroutine ... was never awaited"
+            warnings.simplefilter("ignore", RuntimeWarning)
+            eq_(result_lines(render(t)), ["before", "after", "a: 4"])
+            gc.collect()
+
+    def test_call_tag(self):
+        t = Template(
+            """
+<%def name="wrap(x)">[${caller.body(y=await fetch(x))}]</%def>
+<%self:wrap x="${1}" args="y">y: ${y}</%self:wrap>
+<%call expr="wrap(2)" args="y">y: ${y}</%call>
+""",
+            enable_async=True,
+        )
+        eq_(result_lines(render(t, fetch=fetch)), ["[y: 1]", "[y: 2]"])
+
+    def test_async_control_lines(self):
+        t = Template(
+            """
+% async for i in arange(3):
+    % if i:
+${i}
+    % else:
+zero
+    % endif
+% endfor
+""",
+            enable_async=True,
+        )
+        eq_(result_lines(render(t, arange=arange)), ["zero", "1", "2"])
+
+    def test_async_for_loop_context(self):
+        assert_raises_message(
+            exceptions.CompileException,
+            "The loop context is not available within 'async for'",
+            Template,
+            "% async for i in arange(3):\n${loop.index}\n% endfor\n",
+            enable_async=True,
+        )
+
+    def test_async_for_requires_enable_async(self):
+        assert_raises_message(
+            exceptions.CompileException,
+            "requires the template to be compiled with enable_async",
+            Template,
+            "% async for i in arange(3):\n${i}\n% endfor\n",
+        )
+
+    def test_cache_not_supported(self):
+        assert_raises_message(
+            exceptions.CompileException,
+            "Caching is not supported for templates compiled with "
+            "enable_async",
+            Template,
+            """<%def name="a()" cached="True">a</%def>""",
+            enable_async=True,
+        )
+
+    def test_render_raises(self):
+        t = Template("hi", enable_async=True)
+        assert_raises_message(
+            exceptions.RuntimeException,
+            "compiled with enable_async=True; use render_async()",
+            t.render,
+        )
+
+    def test_render_async_sync_template(self):
+        t = Template("<%def name='a()'>a</%def>hi ${a()}")
+        eq_(render(t), "hi a")
+
+    def test_def_template(self):
+        t = Template(
+            """<%def name="a(x)">a: ${await fetch(x)}</%def>""",
+            enable_async=True,
+        )
+        eq_(
+            asyncio.run(t.get_def("a").render_async(x=5, fetch=fetch)),
+            "a: 5",
+        )
+
+    def test_output_encoding(self):
+        t = Template(
+            "${await fetch('héllo')}",
+            enable_async=True,
+            output_encoding="utf-8",
+        )
+        eq_(render(t, fetch=fetch), "héllo".encode("utf-8"))
+        eq_(asyncio.run(t.render_unicode_async(fetch=fetch)), "héllo")
+
+    def test_error_handler(self):
+        def handle(context, error):
+            context.write("error: %s" % error)
+            return True
+
+        t = Template(
+            "${await fetch(1) / 0}",
+            enable_async=True,
+            error_handler=handle,
+        )
+        eq_(render(t, fetch=fetch), "error: division by zero")
+
+    def test_inheritance_and_include(self):
+        tl = lookup.TemplateLookup(enable_async=True)
+        tl.put_string(
+            "base",
+            """
+<%namespace name="util" file="util"/>
+header: ${util.greet(await fetch("base"))}
+<%block name="title">base title</%block>
+${next.body()}
+<%include file="footer" args="x=1"/>
+""",
+        )
+        tl.put_string(
+            "util",
+            """<%def name="greet(name)">hi ${await fetch(name)}</%def>""",
+        )
+        tl.put_string("footer", "<%page args='x'/>footer ${x}")
+        tl.put_string(
+            "main",
+            """
+<%inherit file="base"/>
+<%block name="title">main title ${await fetch(1)}</%block>
+body ${self.title()}
+""",
+        )
+        eq_(
+            result_lines(render(tl.get_template("main"), fetch=fetch)),
+            [
+                "header: hi base",
+                "main title 1",
+                "body main title 1",
+                "footer 1",
+            ],
+        )
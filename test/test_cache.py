@@ -1,10 +1,15 @@
+import gc
+import threading
 import time
+from unittest import mock
+import weakref
 
 from mako import lookup
 from mako.cache import CacheImpl
 from mako.cache import register_plugin
 from mako.lookup import TemplateLookup
 from mako.template import Template
+from mako.testing.assertions import assert_raises
 from mako.testing.assertions import eq_
 from mako.testing.config import config
 from mako.testing.exclusions import requires_beaker
@@ -537,6 +542,91 @@ class CacheTest:
         t.render()
         eq_(m.kwargs, {"region": "myregion", "timeout": 50, "foo": "foob"})
 
+    def test_auto_key(self):
+        t = Template("""
+            <%!
+                callcount = [0]
+            %>
+            <%def name="foo(x, y=5, **kw)" cached="True" cache_key="auto">
+                foo: ${x} ${y} ${kw}
+                <%
+                    callcount[0] += 1
+                %>
+            </%def>
+            ${foo(1)}
+            ${foo(1, y=5)}
+            ${foo(2, a=3, b=4)}
+            ${foo(2, b=4, a=3)}
+            callcount: ${callcount}
+        """)
+        m = self._install_mock_cache(t)
+        eq_(
+            result_lines(t.render()),
+            [
+                "foo: 1 5 {}",
+                "foo: 1 5 {}",
+                "foo: 2 5 {'a': 3, 'b': 4}",
+                "foo: 2 5 {'a': 3, 'b': 4}",
+                "callcount: [2]",
+            ],
+        )
+        eq_(m.key, "render_foo(x=2, y=5, **kw=[('a', 3), ('b', 4)])")
+        eq_(m.kwargs, {})
+
+    def test_auto_key_nested_def(self):
+        t = Template("""
+            <%def name="foo()">
+                <%def name="bar(x)" cached="True" cache_key="auto">
+                    bar: ${x}
+                </%def>
+                ${bar(1)}
+            </%def>
+            ${foo()}
+        """)
+        m = self._install_mock_cache(t)
+        eq_(result_lines(t.render()), ["bar: 1"])
+        eq_(m.key, "bar(x=1)")
+
+    def test_auto_key_hashed(self):
+        t = Template("""
+            <%def name="foo(x)" cached="True" cache_key="auto">
+                ${len(x)}
+            </%def>
+            ${foo("a" * 300)}
+        """)
+        m = self._install_mock_cache(t)
+        eq_(result_lines(t.render()), ["300"])
+        eq_(len(m.key), len("render_foo()") + 40)
+
+    def test_auto_key_generator(self):
+        t = Template("""
+            <%def name="foo(x)" cached="True" cache_key="auto"
+                cache_key_generator="${keygen}">
+                foo: ${x}
+            </%def>
+            ${foo(1)}
+        """)
+        m = self._install_mock_cache(t)
+
+        def keygen(name, args):
+            return "%s-%s" % (name, "-".join(str(v) for k, v in args))
+
+        eq_(result_lines(t.render(keygen=keygen)), ["foo: 1"])
+        eq_(m.key, "render_foo-1")
+        eq_(m.kwargs, {})
+
+        t = Template("""
+            <%def name="foo(x)" cached="True" cache_key="auto">
+                foo: ${x}
+            </%def>
+            ${foo(1)}
+        """)
+        t.cache_args["key_generator"] = keygen
+        m = self._install_mock_cache(t)
+        eq_(result_lines(t.render()), ["foo: 1"])
+        eq_(m.key, "render_foo-1")
+        eq_(m.kwargs, {})
+
     def test_pass_context(self):
         t = Template("""
             <%page cached="True"/>
@@ -608,6 +698,238 @@ class BeakerCacheTest(RealBackendMixin, CacheTest):
             }
         )
 
+    def test_set(self):
+        t = Template("", cache_args={"manager": self._regions()})
+        t.cache.set("key", "value", type="memory")
+        eq_(t.cache.get("key", type="memory"), "value")
+
+
+class MemoryCacheTest(RealBackendMixin, CacheTest):
+    real_backend = "memory"
+
+    def _install_mock_cache(self, template, implname=None):
+        template.cache_args["regions"] = {
+            "short": {"timeout": 1},
+            "long": {"timeout": 60},
+        }
+        return super()._install_mock_cache(template, implname)
+
+    def test_size(self):
+        t = Template("", cache_impl="memory")
+        for i in range(5):
+            t.cache.set(i, i, size=4)
+        eq_([t.cache.get(i, size=4) for i in range(5)], [None, 1, 2, 3, 4])
+
+    def test_values_released_with_template(self):
+        class Value:
+            pass
+
+        t = Template("", cache_impl="memory")
+        value = Value()
+        t.cache.set("key", value)
+        ref = weakref.ref(value)
+        del t, value
+        gc.collect()
+        eq_(ref(), None)
+
+    def test_recompiled_template(self):
+        t = Template("", cache_impl="memory")
+        t.cache.set("key", "value")
+        eq_(t.cache.get("key"), "value")
+
+        t.cache.starttime = time.time() + 1
+        eq_(t.cache.get("key"), None)
+        eq_(t.cache.get_or_create("key", lambda: "new value"), "new value")
+
+    def test_created_once(self):
+        t = Template("", cache_impl="memory")
+        created = []
+        barrier = threading.Barrier(5)
+
+        def create():
+            created.append(True)
+            time.sleep(0.1)
+            return "value"
+
+        def go():
+            barrier.wait()
+            results.append(t.cache.get_or_create("key", create))
+
+        results = []
+        threads = [threading.Thread(target=go) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        eq_(results, ["value"] * 5)
+        eq_(len(created), 1)
+
+
+class CreationTest:
+    def _render_concurrently(self, template, count=5, **data):
+        barrier = threading.Barrier(count)
+        results = []
+
+        def go():
+            barrier.wait()
+            results.append(template.render(**data).strip())
+
+        threads = [threading.Thread(target=go) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_created_once(self):
+        t = Template("""
+            <%def name="foo()" cached="True">${get()}</%def>
+            ${foo()}
+        """)
+        t.cache_impl = "mock"
+        t.cache.impl.set_backend(t.cache, "simple")
+        calls = []
+
+        def get():
+            calls.append(True)
+            time.sleep(0.1)
+            return "foo"
+
+        eq_(self._render_concurrently(t, get=get), ["foo"] * 5)
+        eq_(len(calls), 1)
+
+    def test_creation_error(self):
+        t = Template("""
+            <%def name="foo()" cached="True">${get()}</%def>
+            ${foo()}
+        """)
+        t.cache_impl = "mock"
+        t.cache.impl.set_backend(t.cache, "simple")
+
+        def fail():
+            raise RuntimeError("creation failed")
+
+        assert_raises(RuntimeError, t.render, get=fail)
+        eq_(t.render(get=lambda: "foo").strip(), "foo")
+
+    def test_same_key_nested(self):
+        t = Template("""
+            <%def name="foo()" cached="True" cache_key="x">foo ${bar()}</%def>
+            <%def name="bar()" cached="True" cache_key="x">bar</%def>
+            ${foo()}
+        """)
+        t.cache_impl = "mock"
+        t.cache.impl.set_backend(t.cache, "simple")
+        eq_(t.render().strip(), "foo bar")
+
+    def test_stale_grace(self):
+        t = Template(
+            """
+            <%def name="foo()" cached="True" cache_timeout="1"
+                cache_stale_grace="60">${get()}</%def>
+            ${foo()}
+        """,
+            cache_impl="memory",
+        )
+        eq_(t.render(get=lambda: "one").strip(), "one")
+        time.sleep(1.2)
+
+        started = threading.Event()
+        proceed = threading.Event()
+
+        def slow():
+            started.set()
+            proceed.wait(5)
+            return "two"
+
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(t.render(get=slow).strip())
+        )
+        thread.start()
+        started.wait(5)
+
+        # the expired value is returned while it's being replaced
+        eq_(t.render(get=lambda: "three").strip(), "one")
+        proceed.set()
+        thread.join()
+        eq_(results, ["two"])
+        eq_(t.render(get=lambda: "three").strip(), "two")
+
+    def test_stale_grace_stored_while_creating(self):
+        t = Template("", cache_impl="memory")
+        kw = {"timeout": 1, "stale_grace": 60}
+        eq_(t.cache.get_or_create("key", lambda: "one", **kw), "one")
+        time.sleep(1.2)
+
+        # other threads continue to see the creation in progress until
+        # the new value has been stored
+        in_progress = []
+        set_ = t.cache.impl.set
+
+        def set_value(*arg, **kw):
+            in_progress.append(bool(t.cache._creations))
+            set_(*arg, **kw)
+
+        with mock.patch.object(t.cache.impl, "set", side_effect=set_value):
+            eq_(t.cache.get_or_create("key", lambda: "two", **kw), "two")
+        eq_(in_progress, [True])
+        eq_(t.cache._creations, {})
+
+    def test_same_key_other_region(self):
+        t = Template(
+            """
+            <%def name="a()" cached="True" cache_key="x"
+                cache_region="one">a: ${get()}</%def>
+            <%def name="b()" cached="True" cache_key="x"
+                cache_region="two">b: ${get()}</%def>
+            ${a() if which == "a" else b()}
+        """,
+            cache_impl="memory",
+        )
+        started = threading.Event()
+        proceed = threading.Event()
+
+        def slow():
+            started.set()
+            proceed.wait(5)
+            return "slow"
+
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(
+                t.render(which="a", get=slow).strip()
+            )
+        )
+        thread.start()
+        started.wait(5)
+        try:
+            eq_(t.render(which="b", get=lambda: "fast").strip(), "b: fast")
+        finally:
+            proceed.set()
+            thread.join()
+        eq_(results, ["a: slow"])
+
+    def test_stale_grace_expired(self):
+        t = Template("", cache_impl="memory")
+        kw = {"timeout": 1, "stale_grace": 0.1}
+        eq_(t.cache.get_or_create("key", lambda: "one", **kw), "one")
+        eq_(t.cache.get("key", **kw), "one")
+        time.sleep(1.2)
+        eq_(t.cache.get("key", **kw), None)
+        eq_(t.cache.get_or_create("key", lambda: "two", **kw), "two")
+
+    def test_get_mutex(self):
+        t = Template("", cache_impl="memory")
+        mutex = mock.Mock(wraps=threading.Lock())
+        with mock.patch.object(
+            t.cache.impl, "get_mutex", return_value=mutex
+        ) as get_mutex:
+            eq_(t.cache.get_or_create("key", lambda: "value", x=5), "value")
+            eq_(t.cache.get_or_create("key", lambda: "other"), "value")
+        eq_(get_mutex.mock_calls, [mock.call("key", x=5)])
+        eq_(mutex.mock_calls, [mock.call.acquire(True), mock.call.release()])
+
 
 @requires_dogpile_cache
 class DogpileCacheTest(RealBackendMixin, CacheTest):
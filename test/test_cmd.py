@@ -1,8 +1,15 @@
 from contextlib import contextmanager
+import multiprocessing
 import os
+import sys
+import tempfile
 from unittest import mock
 
+import pytest
+
 from mako.cmd import cmdline
+from mako.cmd import compile_cmdline
+from mako.lookup import TemplateLookup
 from mako.testing.assertions import eq_
 from mako.testing.assertions import expect_raises
 from mako.testing.assertions import expect_raises_message
@@ -95,3 +102,255 @@ class CmdTest(TemplateTest):
             SystemExit, "error: can't find fake.lalala"
         ):
             cmdline(["--var", "x=5", "fake.lalala"])
+
+
+class CompileCmdTest:
+    @contextmanager
+    def _template_dir_fixture(self):
+        with tempfile.TemporaryDirectory() as base:
+            tmpl_dir = os.path.join(base, "templates")
+            os.makedirs(os.path.join(tmpl_dir, "subdir"))
+            for name, text in [
+                ("index.html", "hello ${x}"),
+                ("subdir/page.html", "<%include file='/index.html'/>"),
+                ("notes.txt", "not a template ${"),
+            ]:
+                with open(os.path.join(tmpl_dir, name), "w") as f:
+                    f.write(text)
+            yield tmpl_dir, os.path.join(base, "modules")
+
+    def _run(self, argv):
+        with (
+            mock.patch("sys.stdout") as stdout,
+            mock.patch("sys.stderr") as stderr,
+        ):
+            try:
+                compile_cmdline(argv)
+            except SystemExit as err:
+                code = err.code
+            else:
+                code = 0
+        return (
+            code,
+            "".join(c[1][0] for c in stdout.write.mock_calls),
+            "".join(c[1][0] for c in stderr.write.mock_calls),
+        )
+
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_compile_tree(self, workers):
+        with self._template_dir_fixture() as (tmpl_dir, module_dir):
+            code, out, err = self._run(
+                [
+                    "--template-dir",
+                    tmpl_dir,
+                    "--module-dir",
+                    module_dir,
+                    "--pattern",
+                    "*.html",
+                    "--workers",
+                    str(workers),
+                ]
+            )
+            eq_(code, 0)
+            eq_(err, "")
+            assert "/index.html " in out
+            assert "/subdir/page.html " in out
+            assert "compiled 2 templates (0 failed, 0 skipped)" in out
+
+            for name in ("index.html.py", "subdir/page.html.py"):
+                assert os.path.exists(os.path.join(module_dir, name))
+            assert not os.path.exists(os.path.join(module_dir, "notes.txt.py"))
+
+    def test_compile_cache_dir(self):
+        with self._template_dir_fixture() as (tmpl_dir, cache_dir):
+            code, out, err = self._run(
+                [
+                    "--template-dir",
+                    tmpl_dir,
+                    "--compile-cache-dir",
+                    cache_dir,
+                    "--pattern",
+                    "*.html",
+                    "--workers",
+                    "1",
+                ]
+            )
+            eq_(code, 0)
+            assert "compiled 2 templates (0 failed, 0 skipped)" in out
+
+            eq_(
+                len(
+                    [
+                        name
+                        for dirpath, dirnames, filenames in os.walk(cache_dir)
+                        for name in filenames
+                        if name.endswith(".py")
+                    ]
+                ),
+                2,
+            )
+
+            # the modules are loaded from the cache without compiling
+            written = []
+            lookup = TemplateLookup(
+                [tmpl_dir],
+                compile_cache_dir=cache_dir,
+                module_writer=lambda source, path: written.append(path),
+            )
+            eq_(lookup.get_template("/index.html").render(x=5), "hello 5")
+            eq_(written, [])
+
+    def test_compile_errors_reported(self):
+        with self._template_dir_fixture() as (tmpl_dir, module_dir):
+            code, out, err = self._run(
+                [
+                    "--template-dir",
+                    tmpl_dir,
+                    "--module-dir",
+                    module_dir,
+                    "--workers",
+                    "1",
+                ]
+            )
+            eq_(code, 1)
+            assert "/notes.txt: SyntaxException: Expected:" in err
+            assert "compiled 3 templates (1 failed, 0 skipped)" in out
+
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_compile_undecodable_skipped(self, workers):
+        with self._template_dir_fixture() as (tmpl_dir, module_dir):
+            os.remove(os.path.join(tmpl_dir, "notes.txt"))
+            with open(os.path.join(tmpl_dir, "logo.png"), "wb") as f:
+                f.write(b"\x89PNG\r\n\x1a\n\xff\xfe\x00")
+
+            code, out, err = self._run(
+                [
+                    "--template-dir",
+                    tmpl_dir,
+                    "--module-dir",
+                    module_dir,
+                    "--workers",
+                    str(workers),
+                ]
+            )
+            eq_(code, 0)
+            eq_(err, "")
+            assert "/logo.png skipped: CompileException: Unicode decode" in out
+            assert "compiled 2 templates (0 failed, 1 skipped)" in out
+            assert not os.path.exists(os.path.join(module_dir, "logo.png.py"))
+
+    def test_compile_modulename_callable(self):
+        with self._template_dir_fixture() as (tmpl_dir, module_dir):
+            written = []
+
+            def module_writer(source, outputpath):
+                written.append(outputpath)
+                with open(outputpath, "wb") as f:
+                    f.write(source)
+
+            lookup = TemplateLookup(
+                [tmpl_dir],
+                modulename_callable=lambda filename, uri: os.path.join(
+                    module_dir, uri.strip("/").replace("/", "_") + ".py"
+                ),
+                module_writer=module_writer,
+            )
+            with mock.patch.object(
+                sys.modules[__name__], "compile_lookup", lookup, create=True
+            ):
+                code, out, err = self._run(
+                    [
+                        "--lookup",
+                        "%s:compile_lookup" % __name__,
+                        "--pattern",
+                        "*.html",
+                        "--workers",
+                        "1",
+                    ]
+                )
+            eq_(code, 0)
+            eq_(
+                sorted(written),
+                [
+                    os.path.join(module_dir, "index.html.py"),
+                    os.path.join(module_dir, "subdir_page.html.py"),
+                ],
+            )
+
+    @pytest.mark.skipif(
+        "fork" not in multiprocessing.get_all_start_methods(),
+        reason="requires forked worker processes",
+    )
+    def test_compile_lookup_forked_workers(self):
+        with self._template_dir_fixture() as (tmpl_dir, module_dir):
+            # the lambda can't be pickled, so the lookup is only usable
+            # by workers which inherit it
+            lookup = TemplateLookup(
+                [tmpl_dir],
+                modulename_callable=lambda filename, uri: os.path.join(
+                    module_dir, uri.strip("/").replace("/", "_") + ".py"
+                ),
+            )
+            with mock.patch.object(
+                sys.modules[__name__], "compile_lookup", lookup, create=True
+            ):
+                code, out, err = self._run(
+                    [
+                        "--lookup",
+                        "%s:compile_lookup" % __name__,
+                        "--pattern",
+                        "*.html",
+                        "--workers",
+                        "2",
+                    ]
+                )
+            eq_(code, 0)
+            eq_(
+                sorted(os.listdir(module_dir)),
+                ["index.html.py", "subdir_page.html.py"],
+            )
+
+    def test_compile_lookup_unpicklable(self):
+        with self._template_dir_fixture() as (tmpl_dir, module_dir):
+            lookup = TemplateLookup(
+                [tmpl_dir],
+                modulename_callable=lambda filename, uri: os.path.join(
+                    module_dir, uri.strip("/").replace("/", "_") + ".py"
+                ),
+            )
+            with (
+                mock.patch.object(
+                    sys.modules[__name__],
+                    "compile_lookup",
+                    lookup,
+                    create=True,
+                ),
+                mock.patch(
+                    "multiprocessing.get_all_start_methods",
+                    return_value=["spawn", "forkserver"],
+                ),
+            ):
+                code, out, err = self._run(
+                    [
+                        "--lookup",
+                        "%s:compile_lookup" % __name__,
+                        "--workers",
+                        "2",
+                    ]
+                )
+            assert code.startswith(
+                "error: the TemplateLookup can't be sent to worker processes"
+            )
+            assert code.endswith("; use --workers 1")
+            assert not os.path.exists(module_dir)
+
+    def test_compile_requires_module_dir(self):
+        with self._template_dir_fixture() as (tmpl_dir, module_dir):
+            with expect_raises_message(
+                SystemExit, "the lookup has no module_directory"
+            ):
+                compile_cmdline(["--template-dir", tmpl_dir])
+
+    def test_compile_lookup_not_a_lookup(self):
+        with expect_raises_message(SystemExit, "is not a TemplateLookup"):
+            compile_cmdline(["--lookup", "os:path"])
@@ -1,6 +1,10 @@
+import pytest
+
+from mako import exceptions
 from mako import lookup
 from mako.template import Template
 from mako.testing.assertions import assert_raises
+from mako.testing.assertions import assert_raises_message
 from mako.testing.assertions import eq_
 from mako.testing.fixtures import TemplateTest
 from mako.testing.helpers import flatten_result
@@ -700,6 +704,183 @@ class NestedDefTest(TemplateTest):
         eq_(flatten_result(t.render(x=5)), "b. c. x is 10. a: x is 5 x is 5")
 
 
+class InlineDefTest(TemplateTest):
+    def _assert_inline(self, source, name, expanded=True, **data):
+        """render the given template with and without its defs declared
+        inline, asserting that the output is the same, and whether or not
+        the calls made from the template body are expanded."""
+
+        t = Template(source)
+        reference = Template(source.replace(' inline="True"', ""))
+        eq_(t.render(**data), reference.render(**data))
+
+        # an expanded call assigns the renamed arguments of the def
+        # within render_body()
+        body = t.code.split("def render_%s(" % name)[0]
+        eq_("__M_inline_%s_" % name in body, expanded)
+        return result_lines(t.render(**data))
+
+    def test_expand(self):
+        eq_(
+            self._assert_inline(
+                """
+            <%def name="link(url, label='home')" inline="True">
+                <% size = len(url) %>
+                % for i in range(2):
+                    <a href="${url}" class="${css}">${label | h} ${i}</a>
+                % endfor
+                ${size}
+            </%def>
+            % for url in urls:
+                ${link(url)}
+                ${link(url + "/", label="<b>")}
+            % endfor
+        """,
+                "link",
+                urls=["a", "bc"],
+                css="c",
+            ),
+            [
+                '<a href="a" class="c">home 0</a>',
+                '<a href="a" class="c">home 1</a>',
+                "1",
+                '<a href="a/" class="c">&lt;b&gt; 0</a>',
+                '<a href="a/" class="c">&lt;b&gt; 1</a>',
+                "2",
+                '<a href="bc" class="c">home 0</a>',
+                '<a href="bc" class="c">home 1</a>',
+                "2",
+                '<a href="bc/" class="c">&lt;b&gt; 0</a>',
+                '<a href="bc/" class="c">&lt;b&gt; 1</a>',
+                "3",
+            ],
+        )
+
+    def test_arguments_are_renamed(self):
+        # "x" is both an argument of the def and a name used by the
+        # template; "y" is assigned by the def
+        eq_(
+            self._assert_inline(
+                """
+            <%def name="d(x)" inline="True"><% y = x * 2 %>${y}</%def>
+            % for x in range(2):
+                ${d(x + 10)} ${x} ${y}
+            % endfor
+        """,
+                "d",
+                y="y",
+            ),
+            ["20 0 y", "22 1 y"],
+        )
+
+    def test_nested_and_recursive(self):
+        eq_(
+            self._assert_inline(
+                """
+            <%def name="a(n)" inline="True">[${b(n)}]</%def>
+            <%def name="b(n)" inline="True">\\
+% if n:
+${n} ${b(n - 1)}\\
+% endif
+</%def>
+            ${a(2)}
+        """,
+                "a",
+            ),
+            ["[2 1 ]"],
+        )
+
+    def test_within_defs(self):
+        t = Template("""
+            <%def name="d(x)" inline="True">${x}${sep}</%def>
+            <%def name="row(items)">
+                % for i in items:
+                    ${d(i)}
+                % endfor
+            </%def>
+            ${row([1, 2])}
+        """)
+        assert "__M_inline_d_x" in t.code.split("def render_d(")[1]
+        eq_(flatten_result(t.render(sep=";")), "1; 2;")
+
+    @pytest.mark.parametrize(
+        "source",
+        [
+            # the caller declares a name which the def takes from
+            # the context
+            """
+            <%def name="d(y)" inline="True">${x}${y}</%def>
+            % for x in range(2):
+                ${d(1)}
+            % endfor
+        """,
+            # the name of the def is assigned by the caller
+            """
+            <%def name="d(x)" inline="True">def</%def>
+            <% d = lambda x: "lambda" %>
+            ${d(1)}
+        """,
+            # filtered or non-literal arguments
+            """
+            <%def name="d(x, y=[])" inline="True">${x}${y}</%def>
+            ${d(1)} ${d(*[1, 2])} ${d(1) | h}
+        """,
+        ],
+    )
+    def test_not_expanded(self, source):
+        self._assert_inline(source, "d", expanded=False, x="x")
+
+    def test_locals_not_propagated(self):
+        # inline expansions in the template body don't require other
+        # def calls to receive the body's local variables
+        t = Template("""
+            <%def name="a(x)" inline="True"><% y = x %>${y}</%def>
+            <%def name="b()">${x}</%def>
+            ${a(1)}${b()}
+        """)
+        assert "__M_locals_builtin()" not in t.code
+        eq_(t.render(x=2).strip(), "12")
+
+    @pytest.mark.parametrize(
+        "source, message",
+        [
+            (
+                """<%def name="d()" inline="True" buffered="True"></%def>""",
+                "can't be buffered, cached, filtered or decorated",
+            ),
+            (
+                """<%def name="d(*args)" inline="True"></%def>""",
+                "may only declare positional arguments",
+            ),
+            (
+                """<%def name="d()" inline="True">${caller.body()}</%def>""",
+                "can't refer to 'caller'",
+            ),
+            (
+                """<%def name="d()" inline="True"><% return %></%def>""",
+                "can't use 'return'",
+            ),
+            (
+                """<%def name="d(x)" inline="True">${f"{x}"}</%def>""",
+                "can't refer to its arguments or local variables "
+                "within an f-string",
+            ),
+            (
+                """<%def name="d()" inline="True"><%def name="e()"/></%def>""",
+                "may only contain text, expressions, control lines "
+                "and Python blocks",
+            ),
+        ],
+    )
+    def test_unsupported(self, source, message):
+        assert_raises_message(
+            exceptions.CompileException,
+            "Inline def 'd' %s" % message,
+            Template,
+            source,
+        )
+
+
 class ExceptionTest(TemplateTest):
     def test_raise(self):
         template = Template(
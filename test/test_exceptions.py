@@ -2,11 +2,13 @@ import os
 import sys
 import tempfile
 import traceback
+from unittest import mock
 import warnings
 
 import pytest
 
 from mako import exceptions
+from mako import util
 from mako.lookup import TemplateLookup
 from mako.template import Template
 from mako.testing.assertions import assert_raises_message
@@ -72,6 +74,21 @@ class ExceptionsTest(TemplateTest):
                 "control statement"
             ) in text_error
 
+    def test_error_templates_compiled_once(self):
+        text = exceptions.text_error_template()
+        html = exceptions.html_error_template()
+        assert exceptions.text_error_template() is text
+        assert exceptions.html_error_template() is html
+
+        # the HTML template is compiled against the highlighting
+        # functions, so it's rebuilt when they're replaced
+        try:
+            exceptions._install_fallback()
+            assert exceptions.html_error_template() is not html
+        finally:
+            exceptions._install_highlighting()
+        assert exceptions.html_error_template() is not html
+
     @requires_pygments_14
     def test_utf8_html_error_template_pygments(self):
         """test the html_error_template with a Template containing UTF-8
@@ -298,6 +315,30 @@ ${foobar}
 
         assert self.indicates_unbound_local_error(html_error, "y")
 
+    def test_tback_source_read_once(self):
+        t = self._file_template("runtimeerr.html")
+        try:
+            t.render()
+            assert False
+        except:
+            t, v, tback = sys.exc_info()
+
+        records = exceptions.RichTraceback(v, tback).records
+
+        # the module's line map and the template source are kept on its
+        # ModuleInfo, rather than read from the files again
+        with (
+            mock.patch.object(
+                util, "read_file", side_effect=util.read_file
+            ) as read_file,
+            mock.patch.object(
+                util, "read_python_file", side_effect=util.read_python_file
+            ) as read_python_file,
+        ):
+            eq_(exceptions.RichTraceback(v, tback).records, records)
+        eq_(read_file.call_count, 0)
+        eq_(read_python_file.call_count, 0)
+
     def test_code_block_line_number(self):
         l = TemplateLookup()
         l.put_string(
@@ -1,3 +1,9 @@
+from unittest import mock
+
+from markupsafe import Markup
+import pytest
+
+from mako import codegen
 from mako.template import Template
 from mako.testing.assertions import eq_
 from mako.testing.fixtures import TemplateTest
@@ -44,6 +50,34 @@ class FilterTest(TemplateTest):
         """)
         assert flatten_result(t.render(x=5)) == "5"
 
+    @pytest.mark.parametrize(
+        "expr, converted",
+        [
+            ('f"{x}!"', False),
+            ('"-".join(y)', False),
+            ('"%s/%s" % (x, x)', False),
+            ('("a" if x else "b") | h', False),
+            ('"<" + "{}".format(x).upper() | h', False),
+            ('"%s" % x', True),
+            ('"a" + x', True),
+            ("x.upper()", True),
+            ("y", True),
+        ],
+    )
+    def test_convert_str_known_type(self, expr, converted):
+        """test that string conversion is skipped for expressions that
+        always produce a str"""
+        t = Template("${%s}" % expr)
+        eq_("str(" in t.code, converted)
+        with mock.patch.object(
+            codegen, "_is_str_expression", return_value=False
+        ):
+            reference = Template("${%s}" % expr)
+        assert "str(" in reference.code
+
+        data = {"x": Markup("<b>"), "y": ["a", "b"]}
+        eq_(t.render(**data), reference.render(**data))
+
     def test_quoting(self):
         t = Template("""
             foo ${bar | h}
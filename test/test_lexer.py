@@ -650,6 +650,17 @@ more text
             ),
         )
 
+    def test_code_resembling_tag(self):
+        template = """<%x=1%>${x}"""
+        nodes = Lexer(template).parse()
+        self._compare(
+            nodes,
+            TemplateNode(
+                {},
+                [Code("x=1\n", False, (1, 1)), Expression("x", [], (1, 8))],
+            ),
+        )
+
     def test_code_and_tags(self):
         template = """
 <%namespace name="foo">
@@ -1722,3 +1733,37 @@ hi
                 ],
             ),
         )
+
+    def test_position(self):
+        lexer = Lexer("ab\ncd\n\nef")
+        eq_(
+            [lexer.position(i) for i in range(10)],
+            [
+                (1, 1),
+                (1, 2),
+                (1, 3),
+                (2, 1),
+                (2, 2),
+                (2, 3),
+                (3, 1),
+                (4, 1),
+                (4, 2),
+                (4, 3),
+            ],
+        )
+
+    def test_position_large_template(self):
+        template = "line\n" * 20000 + "${x}\n  <%doc>doc</%doc>"
+        nodes = Lexer(template).parse()
+        self._compare(
+            nodes,
+            TemplateNode(
+                {},
+                [
+                    Text("line\n" * 20000, (1, 1)),
+                    Expression("x", [], (20001, 1)),
+                    Text("\n  ", (20001, 5)),
+                    Comment("doc", (20002, 3)),
+                ],
+            ),
+        )
@@ -1,5 +1,11 @@
 import os
+import pickle
 import tempfile
+import threading
+import time
+from unittest import mock
+
+import pytest
 
 from mako import exceptions
 from mako import lookup
@@ -7,6 +13,7 @@ from mako import runtime
 from mako.template import Template
 from mako.testing.assertions import assert_raises_message
 from mako.testing.assertions import assert_raises_with_given_cause
+from mako.testing.assertions import eq_
 from mako.testing.config import config
 from mako.testing.helpers import file_with_template_code
 from mako.testing.helpers import replace_file_with_dir
@@ -79,6 +86,195 @@ class LookupTest:
         tl._uri_cache[("foo", "bar")] = "/some/path"
         assert tl._uri_cache[("foo", "bar")] == "/some/path"
 
+    def test_find_uris(self):
+        with tempfile.TemporaryDirectory() as base:
+            one = os.path.join(base, "one")
+            two = os.path.join(base, "two")
+            for path in (
+                os.path.join(one, "index.html"),
+                os.path.join(one, "sub", "page.html"),
+                os.path.join(one, "modules", "index.html.py"),
+                os.path.join(two, "index.html"),
+                os.path.join(two, "style.css"),
+            ):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                file_with_template_code(path)
+
+            tl = lookup.TemplateLookup(
+                directories=[one, two],
+                module_directory=os.path.join(one, "modules"),
+            )
+            eq_(
+                tl._find_uris(),
+                ["/index.html", "/sub/page.html", "/style.css"],
+            )
+            eq_(tl._find_uris(["*.css"]), ["/style.css"])
+            eq_(
+                tl._find_uris(["/sub/*", "*.css"]),
+                ["/sub/page.html", "/style.css"],
+            )
+
+    def _preload_fixture(self, base):
+        for name, text in [
+            ("index.html", "index ${x}"),
+            ("sub/page.html", "<%include file='/index.html' args='x=1'/>"),
+            ("bad.html", "${"),
+            ("style.css", "body {}"),
+        ]:
+            path = os.path.join(base, "templates", name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(text)
+        return os.path.join(base, "templates")
+
+    @pytest.mark.parametrize("workers", [1, 3])
+    def test_preload(self, workers):
+        with tempfile.TemporaryDirectory() as base:
+            tl = lookup.TemplateLookup([self._preload_fixture(base)])
+            result = tl.preload(["*.html"], workers=workers)
+
+            eq_(sorted(result.times), ["/index.html", "/sub/page.html"])
+            eq_(list(result.errors), ["/bad.html"])
+            assert result.errors["/bad.html"].startswith("SyntaxException")
+            assert result.elapsed >= max(result.times.values())
+            eq_(sorted(tl._collection), ["/index.html", "/sub/page.html"])
+
+    def test_preload_processes(self):
+        with tempfile.TemporaryDirectory() as base:
+            tl = lookup.TemplateLookup(
+                [self._preload_fixture(base)],
+                module_directory=os.path.join(base, "modules"),
+            )
+            result = tl.preload(["*.html"], workers=2, processes=True)
+
+            eq_(sorted(result.times), ["/index.html", "/sub/page.html"])
+            eq_(list(result.errors), ["/bad.html"])
+            eq_(
+                tl.get_template("/sub/page.html").module.__file__,
+                os.path.join(base, "modules", "sub", "page.html.py"),
+            )
+
+    def test_preload_processes_requires_module_files(self):
+        assert_raises_message(
+            exceptions.RuntimeException,
+            "requires a module_directory",
+            lookup.TemplateLookup([config.template_base]).preload,
+            processes=True,
+        )
+
+    def test_preload_processes_unpicklable(self):
+        with tempfile.TemporaryDirectory() as base:
+            tl = lookup.TemplateLookup(
+                [self._preload_fixture(base)],
+                modulename_callable=lambda filename, uri: os.path.join(
+                    base, "modules", uri.strip("/") + ".py"
+                ),
+            )
+            with mock.patch(
+                "multiprocessing.get_all_start_methods",
+                return_value=["spawn"],
+            ):
+                assert_raises_message(
+                    exceptions.RuntimeException,
+                    "the TemplateLookup can't be sent to worker processes",
+                    tl.preload,
+                    processes=True,
+                )
+            assert not os.path.exists(os.path.join(base, "modules"))
+
+    def test_pickle(self):
+        tl = lookup.TemplateLookup(
+            directories=[config.template_base], collection_size=10
+        )
+        tl.get_template("index.html")
+
+        tl2 = pickle.loads(pickle.dumps(tl))
+        eq_(tl2.directories, tl.directories)
+        eq_(tl2.template_args, tl.template_args)
+        eq_(len(tl2._collection), 0)
+        assert result_lines(tl2.get_template("index.html").render()) == [
+            "this is index"
+        ]
+
+    def test_load_locks_per_uri(self):
+        slow_started = threading.Event()
+        release_slow = threading.Event()
+
+        def preprocessor(text):
+            if "slow" in text:
+                slow_started.set()
+                assert release_slow.wait(10)
+            return text
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            for name in ("slow.html", "fast.html"):
+                with open(os.path.join(tempdir, name), "w") as f:
+                    f.write("this is %s" % name[:-5])
+
+            tl = lookup.TemplateLookup(
+                directories=[tempdir], preprocessor=preprocessor
+            )
+
+            results = {}
+
+            def load(key):
+                results[key] = tl.get_template("slow.html")
+
+            first = threading.Thread(target=load, args=("first",))
+            first.start()
+            assert slow_started.wait(10)
+
+            # a different uri loads while "slow.html" is compiling
+            eq_(tl.get_template("fast.html").render(), "this is fast")
+
+            second = threading.Thread(target=load, args=("second",))
+            second.start()
+            while tl._uri_locks["slow.html"][1] < 2:
+                second.join(0.01)
+
+            release_slow.set()
+            first.join(10)
+            second.join(10)
+
+            # the waiting thread received the template compiled by the
+            # first, rather than compiling it again
+            assert results["first"] is results["second"]
+            assert tl.lock_wait_time > 0
+            eq_(tl._uri_locks, {})
+
+    def test_check_interval(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            index_file = os.path.join(tempdir, "index.html")
+            with open(index_file, "w") as f:
+                f.write("version one")
+
+            tl = lookup.TemplateLookup(
+                directories=[tempdir], check_interval=10
+            )
+            with mock.patch("mako.lookup.time.monotonic", return_value=100):
+                t1 = tl.get_template("index.html")
+
+                with mock.patch(
+                    "mako.lookup.os.stat", side_effect=os.stat
+                ) as stat_:
+                    assert tl.get_template("index.html") is t1
+                    assert tl.get_template("index.html") is t1
+                eq_(stat_.call_count, 1)
+
+                with open(index_file, "w") as f:
+                    f.write("version two")
+                modified = time.time() + 3600
+                os.utime(index_file, (modified, modified))
+
+            # within the interval, the file is not checked again
+            with mock.patch("mako.lookup.time.monotonic", return_value=109):
+                assert tl.get_template("index.html") is t1
+
+            with mock.patch("mako.lookup.time.monotonic", return_value=111):
+                t2 = tl.get_template("index.html")
+            assert t2 is not t1
+            eq_(t2.render(), "version two")
+
     def test_check_not_found(self):
         tl = lookup.TemplateLookup()
         tl.put_string("foo", "this is a template")
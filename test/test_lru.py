@@ -1,3 +1,7 @@
+import pickle
+import threading
+
+from mako.testing.assertions import eq_
 from mako.util import LRUCache
 
 
@@ -37,3 +41,57 @@ class LRUTest:
 
         for id_ in (25, 24, 23, 14, 12, 19, 18, 17, 16, 15):
             assert id_ in l
+
+    def test_exact(self):
+        l = LRUCache(3, threshold=0)
+
+        for id_ in range(1, 4):
+            l[id_] = item(id_)
+        l[1]
+        l[4] = item(4)
+
+        eq_(list(l), [3, 1, 4])
+        eq_(l.evictions, 1)
+
+    def test_counters(self):
+        l = LRUCache(2, threshold=0)
+        l["a"] = 1
+
+        eq_(l["a"], 1)
+        eq_(l.get("b"), None)
+        eq_(l.setdefault("a", 2), 1)
+        eq_(l.setdefault("b", 2), 2)
+        l["c"] = 3
+
+        eq_((l.hits, l.misses, l.evictions), (2, 2, 1))
+        assert "a" not in l
+
+    def test_threads(self):
+        l = LRUCache(50, threshold=0)
+
+        def worker(offset):
+            for id_ in range(500):
+                key = (id_ + offset) % 80
+                l.get(key)
+                l[key] = id_
+                l.pop(key - 1, None)
+
+        threads = [
+            threading.Thread(target=worker, args=(i * 7,)) for i in range(8)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert len(l) <= 50
+
+    def test_pickle(self):
+        l = LRUCache(10, threshold=0.2)
+        l["a"] = 1
+        l["b"] = 2
+        l["a"]
+
+        l2 = pickle.loads(pickle.dumps(l))
+        eq_(list(l2.items()), [("b", 2), ("a", 1)])
+        eq_((l2.capacity, l2.threshold), (10, 0.2))
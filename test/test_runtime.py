@@ -1,6 +1,10 @@
 """Assorted runtime unit tests"""
 
+from unittest import mock
+
+from mako import compat
 from mako import runtime
+from mako.template import Template
 from mako.testing.assertions import eq_
 
 
@@ -17,3 +21,65 @@ class ContextTest:
         eq_(d.kwargs, {"foo": "bar"})
 
         eq_(d._data["zig"], "zag")
+
+    def test_copies_are_independent(self):
+        c = runtime.Context(None, foo="bar")
+        c._data["self"] = c._data["next"] = "ns"
+
+        d = c._clean_inheritance_tokens()
+        d._data["foo"] = "bat"
+        assert "self" not in d._data
+        assert "next" not in d._data
+        eq_(c._data["foo"], "bar")
+        eq_(c._data["self"], "ns")
+
+        # state other than the namespace is shared with the copy
+        assert d.caller_stack is c.caller_stack
+        assert d._buffer_stack is c._buffer_stack
+        assert d.namespaces is c.namespaces
+
+    def test_arbitrary_attributes(self):
+        c = runtime.Context(None)
+        c.request = "request"
+        eq_(c.request, "request")
+
+
+class KwargsForCallableTest:
+    def test_kwargs_for_callable(self):
+        def render_body(context, a, b=5, *args, **pageargs):
+            pass
+
+        def render_def(context, a, b, *args):
+            pass
+
+        data = {"a": 1, "b": 2, "c": 3, "context": 4, "args": 5}
+        eq_(runtime._kwargs_for_callable(render_body, data), data)
+        eq_(
+            runtime._kwargs_for_callable(render_def, data),
+            {"a": 1, "b": 2, "args": 5},
+        )
+
+    def test_kwargs_for_include(self):
+        def render_body(context, a, **pageargs):
+            pass
+
+        eq_(
+            runtime._kwargs_for_include(
+                render_body, {"a": 1, "b": 2, "pageargs": 3}, a=5
+            ),
+            {"a": 5, "pageargs": 3},
+        )
+
+    def test_signature_inspected_once(self):
+        t = Template(
+            """<%def name="d(x)">${x}</%def>${x}""", strict_undefined=True
+        )
+        with mock.patch.object(
+            compat,
+            "inspect_getargspec",
+            side_effect=compat.inspect_getargspec,
+        ) as getargspec:
+            for i in range(3):
+                eq_(t.render(x=i), str(i))
+                eq_(t.get_def("d").render(x=i), str(i))
+        eq_(getargspec.call_count, 2)
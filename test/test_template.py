@@ -1,4 +1,12 @@
+import contextvars
+import io
 import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
 
 import pytest
 
@@ -912,6 +920,58 @@ ${ foo(([1,2],[3,4]))}
         eq_(result_lines(t.render()), ["10"])
 
 
+class DirectContextLookupsTest(TemplateTest):
+    def _lookup(self, **kw):
+        l = TemplateLookup(direct_context_lookups=True, **kw)
+        l.put_string(
+            "ns",
+            """
+            <%def name="greet(n)">hi ${n}</%def>
+        """,
+        )
+        l.put_string(
+            "t",
+            """
+            <%namespace file="ns" import="greet"/>
+            <%def name="row(i)">${i}:${label}:${len(items)}:${greet(i)}</%def>
+            % if missing is UNDEFINED:
+                missing
+            % endif
+            % for i in items:
+                ${row(i)}
+            % endfor
+        """,
+        )
+        return l
+
+    @pytest.mark.parametrize("strict_undefined", [False, True])
+    def test_render(self, strict_undefined):
+        t = self._lookup(strict_undefined=strict_undefined).get_template("t")
+        assert "context.get(" not in t.code
+
+        data = {"items": [1, 2], "label": "x"}
+        if strict_undefined:
+            data["missing"] = runtime.UNDEFINED
+        eq_(
+            result_lines(t.render(**data)),
+            ["missing", "1:x:2:hi 1", "2:x:2:hi 2"],
+        )
+
+    def test_strict_name_error(self):
+        t = self._lookup(strict_undefined=True).get_template("t")
+        assert_raises_message(
+            NameError,
+            "'label' is not defined",
+            t.render,
+            items=[1],
+            missing=None,
+        )
+
+    def test_context_values_override_builtins(self):
+        t = Template("${len}", direct_context_lookups=True)
+        eq_(t.render(len="local"), "local")
+
+
 class StopRenderingTest(TemplateTest):
     def test_return_in_template(self):
         t = Template(
@@ -1390,6 +1450,186 @@ class ModuleDirTest(TemplateTest):
         )
 
 
+class CompileCacheTest:
+    @pytest.fixture
+    def dirs(self):
+        with tempfile.TemporaryDirectory() as dir_:
+            tmpl_dir = os.path.join(dir_, "templates")
+            os.mkdir(tmpl_dir)
+            with open(os.path.join(tmpl_dir, "index.html"), "w") as f:
+                f.write("hello ${x}")
+            yield tmpl_dir, os.path.join(dir_, "cache")
+
+    def _writer(self, canary):
+        def write_module(source, outputpath):
+            canary.append(outputpath)
+            with open(outputpath, "wb") as f:
+                f.write(source)
+
+        return write_module
+
+    def test_compiled_once(self, dirs):
+        tmpl_dir, cache_dir = dirs
+        canary = []
+
+        for i in range(2):
+            lookup = TemplateLookup(
+                [tmpl_dir],
+                compile_cache_dir=cache_dir,
+                module_writer=self._writer(canary),
+            )
+            t = lookup.get_template("/index.html")
+            eq_(t.render(x=5), "hello 5")
+            eq_(os.path.dirname(os.path.dirname(t.module.__file__)), cache_dir)
+
+        eq_(len(canary), 1)
+
+    def test_shared_across_paths(self, dirs):
+        tmpl_dir, cache_dir = dirs
+        other_dir = os.path.join(os.path.dirname(tmpl_dir), "checkout")
+        shutil.copytree(tmpl_dir, other_dir)
+        canary = []
+
+        for dir_ in (tmpl_dir, other_dir):
+            lookup = TemplateLookup(
+                [dir_],
+                compile_cache_dir=cache_dir,
+                module_writer=self._writer(canary),
+            )
+            t = lookup.get_template("/index.html")
+            eq_(t.render(x=5), "hello 5")
+            eq_(t.filename, os.path.join(dir_, "index.html"))
+            eq_(t._mmarker.template_filename, os.path.join(dir_, "index.html"))
+
+        eq_(len(canary), 1)
+
+    def test_options_in_key(self, dirs):
+        tmpl_dir, cache_dir = dirs
+        canary = []
+
+        for default_filters in (["str"], ["h"], ["h"]):
+            t = Template(
+                filename=os.path.join(tmpl_dir, "index.html"),
+                compile_cache_dir=cache_dir,
+                module_writer=self._writer(canary),
+                default_filters=default_filters,
+            )
+        eq_(t.render(x="<>"), "hello &lt;&gt;")
+        eq_(len(canary), 2)
+
+    def test_content_change_same_mtime(self, dirs):
+        tmpl_dir, cache_dir = dirs
+        filename = os.path.join(tmpl_dir, "index.html")
+
+        t = Template(filename=filename, compile_cache_dir=cache_dir)
+        eq_(t.render(x=5), "hello 5")
+
+        mtime = os.stat(filename).st_mtime
+        with open(filename, "w") as f:
+            f.write("goodbye ${x}")
+        os.utime(filename, (mtime, mtime))
+
+        t = Template(filename=filename, compile_cache_dir=cache_dir)
+        eq_(t.render(x=5), "goodbye 5")
+
+    def test_filesystem_checks_newer_file(self, dirs):
+        tmpl_dir, cache_dir = dirs
+        filename = os.path.join(tmpl_dir, "index.html")
+
+        TemplateLookup([tmpl_dir], compile_cache_dir=cache_dir).get_template(
+            "/index.html"
+        )
+
+        # an identical file, modified after the module was generated
+        future = time.time() + 100
+        os.utime(filename, (future, future))
+
+        lookup = TemplateLookup([tmpl_dir], compile_cache_dir=cache_dir)
+        t = lookup.get_template("/index.html")
+        assert lookup.get_template("/index.html") is t
+
+
+class ModuleBytecodeTest:
+    @pytest.fixture
+    def dirs(self):
+        with tempfile.TemporaryDirectory() as dir_:
+            filename = os.path.join(dir_, "index.html")
+            with open(filename, "w") as f:
+                f.write("hello ${x}\n${1 / x}")
+            yield filename, os.path.join(dir_, "modules")
+
+    def _template(self, dirs, **kw):
+        filename, module_dir = dirs
+        return Template(
+            filename=filename,
+            module_directory=module_dir,
+            module_bytecode=True,
+            **kw,
+        )
+
+    def _bytecode_path(self, template):
+        return "%s.%s.mkc" % (
+            template.module.__file__,
+            sys.implementation.cache_tag,
+        )
+
+    def test_loaded_without_compiling(self, dirs):
+        t = self._template(dirs)
+        assert os.path.exists(self._bytecode_path(t))
+
+        with mock.patch(
+            "mako.template.compile", side_effect=AssertionError, create=True
+        ):
+            t = self._template(dirs)
+        eq_(t.render(x=5), "hello 5\n0.2")
+
+    def test_traceback(self, dirs):
+        self._template(dirs)
+        t = self._template(dirs)
+        try:
+            t.render(x=0)
+        except ZeroDivisionError:
+            tback = exceptions.RichTraceback()
+        filename, module_dir = dirs
+        eq_(tback.records[-1][4:7], (filename, 2, "${1 / x}"))
+
+    def test_module_changed(self, dirs):
+        filename, module_dir = dirs
+        t = self._template(dirs)
+        with open(self._bytecode_path(t), "rb") as f:
+            bytecode = f.read()
+
+        future = time.time() + 100
+        with open(filename, "w") as f:
+            f.write("goodbye ${x}")
+        os.utime(filename, (future, future))
+
+        t = self._template(dirs)
+        eq_(t.render(x=5), "goodbye 5")
+        with open(self._bytecode_path(t), "rb") as f:
+            assert f.read() != bytecode
+
+    def test_invalid_bytecode(self, dirs):
+        t = self._template(dirs)
+        with open(self._bytecode_path(t), "r+b") as f:
+            f.seek(-10, 2)
+            f.truncate()
+
+        t = self._template(dirs)
+        eq_(t.render(x=5), "hello 5\n0.2")
+
+    def test_not_writable(self, dirs):
+        t = self._template(dirs)
+        os.remove(self._bytecode_path(t))
+
+        with mock.patch(
+            "mako.template.tempfile.mkstemp", side_effect=PermissionError
+        ):
+            t = self._template(dirs)
+        eq_(t.render(x=5), "hello 5\n0.2")
+        assert not os.path.exists(self._bytecode_path(t))
+
+
 class FilenameToURITest(TemplateTest):
     def test_windows_paths(self):
         """test that windows filenames are handled appropriately by
@@ -1869,3 +2109,223 @@ ${ square()[3] }
             strict_undefined=True,
         )
         assert result_raw_lines(t.render()) == ["9"]
+
+
+class GenerateTest(TemplateTest):
+    def test_chunk_size(self):
+        t = Template(
+            "% for i in range(10):\n${'x' * 10}\n% endfor\n",
+            stream_chunk_size=25,
+        )
+        chunks = list(t.generate())
+        eq_("".join(chunks), t.render())
+        eq_([len(c) for c in chunks], [32, 33, 33, 12])
+
+    def test_flush_tag(self):
+        t = Template("one <%flush/>two <%flush/>three")
+        eq_(list(t.generate()), ["one ", "two ", "three"])
+        eq_(t.render(), "one two three")
+
+    def test_buffered_and_captured(self):
+        t = Template(
+            """
+<%def name="buffered()" buffered="True">buf<%flush/>fered</%def>
+<%def name="filtered()" filter="trim">  fil<%flush/>tered  </%def>
+<%def name="plain()">plain</%def>
+a ${buffered()} <%flush/>b ${filtered()} c ${capture(plain).upper()}
+""",
+        )
+        eq_(
+            flatten_result("".join(t.generate())),
+            flatten_result(t.render()),
+        )
+        eq_(flatten_result(t.render()), "a buffered b filtered c PLAIN")
+
+    def test_output_encoding(self):
+        t = Template(
+            "héllo <%flush/>wörld <%flush/>", output_encoding="utf-16"
+        )
+        chunks = list(t.generate())
+        assert all(isinstance(c, bytes) for c in chunks)
+        eq_(b"".join(chunks), t.render())
+        eq_(b"".join(chunks).decode("utf-16"), "héllo wörld ")
+
+        eq_(list(t.generate_unicode()), ["héllo ", "wörld "])
+
+    def test_def_template(self):
+        t = Template(
+            """<%def name="foo(x)">x: <%flush/>${x}</%def>""",
+        )
+        eq_(list(t.get_def("foo").generate(x=5)), ["x: ", "5"])
+
+    def test_error_raised(self):
+        t = Template("one <%flush/>${1 / 0}")
+        gen = t.generate()
+        eq_(next(gen), "one ")
+        assert_raises(ZeroDivisionError, next, gen)
+
+    def test_format_exceptions(self):
+        t = Template("one <%flush/>${1 / 0}", format_exceptions=True)
+        chunks = list(t.generate_unicode())
+        eq_(chunks[0], "one ")
+        assert "ZeroDivisionError" in "".join(chunks[1:])
+
+        chunks = list(t.generate())
+        assert all(isinstance(c, str) for c in chunks)
+        eq_(chunks[0], "one ")
+        assert "ZeroDivisionError" in "".join(chunks[1:])
+
+    def test_format_exceptions_output_encoding(self):
+        t = Template(
+            "héllo <%flush/>${1 / 0}",
+            format_exceptions=True,
+            output_encoding="utf-16",
+        )
+        chunks = list(t.generate())
+        assert all(isinstance(c, bytes) for c in chunks)
+        output = b"".join(chunks).decode("utf-16")
+        assert output.startswith("héllo ")
+        assert "ZeroDivisionError" in output
+        assert "\ufeff" not in output
+
+    def test_close_stops_rendering(self):
+        written = []
+
+        def write(x):
+            written.append(x)
+            return x
+
+        t = Template(
+            "% for i in range(100):\n${write(i)}<%flush/>\n% endfor\n",
+        )
+        gen = t.generate(write=write)
+        eq_(next(gen), "0")
+        gen.close()
+
+        # the render thread is stopped at its next write; it may only
+        # have run a few iterations ahead of the consumer
+        assert len(written) < 10
+
+    def test_context_vars_copied(self):
+        var = contextvars.ContextVar("var")
+        var.set("outer")
+        t = Template("${var.get()}")
+        eq_(list(t.generate(var=var)), ["outer"])
+
+    def test_thread_local_not_shared(self):
+        state = threading.local()
+        state.value = "outer"
+        t = Template("${getattr(state, 'value', 'none')}")
+        eq_(list(t.generate(state=state)), ["none"])
+
+        written = []
+        t.render_to(written.append, state=state)
+        eq_(written, ["outer"])
+
+
+class RenderToTest(TemplateTest):
+    def test_fileobj(self):
+        t = Template(
+            "% for i in range(10):\n${'x' * 10}\n% endfor\n",
+            stream_chunk_size=25,
+        )
+        buf = io.StringIO()
+        eq_(t.render_to(buf), None)
+        eq_(buf.getvalue(), t.render())
+
+    def test_callable(self):
+        t = Template("one <%flush/>${x} <%flush/>three", stream_chunk_size=100)
+        written = []
+        t.render_to(written.append, x="two")
+        eq_(written, ["one ", "two ", "three"])
+
+    def test_output_encoding(self):
+        t = Template(
+            "héllo <%flush/>wörld",
+            output_encoding="utf-16",
+        )
+        buf = io.BytesIO()
+        t.render_to(buf)
+        eq_(buf.getvalue(), t.render())
+        eq_(buf.getvalue().decode("utf-16"), "héllo wörld")
+
+    def test_format_exceptions(self):
+        t = Template("one <%flush/>${1 / 0}", format_exceptions=True)
+        buf = io.StringIO()
+        t.render_to(buf)
+        assert buf.getvalue().startswith("one ")
+        assert "ZeroDivisionError" in buf.getvalue()
+
+    def test_format_exceptions_output_encoding(self):
+        t = Template(
+            "one <%flush/>${1 / 0}",
+            format_exceptions=True,
+            output_encoding="latin-1",
+        )
+        buf = io.BytesIO()
+        t.render_to(buf)
+        output = buf.getvalue().decode("latin-1")
+        assert output.startswith("one ")
+        assert "ZeroDivisionError" in output
+
+    def test_data_named_fileobj(self):
+        t = Template("${fileobj}")
+        buf = io.StringIO()
+        t.render_to(buf, fileobj="data")
+        eq_(buf.getvalue(), "data")
+
+
+class LiteralWriteTest(TemplateTest):
+    def _writes(self, t):
+        return [
+            line.strip()
+            for line in t.code.split("\n")
+            if line.strip().startswith("__M_writer(")
+        ]
+
+    def test_text_merged_across_comments(self):
+        t = Template("""one
+## a comment
+two
+<%doc>
+    more comments
+</%doc>
+three ${x} four
+""")
+        eq_(
+            self._writes(t),
+            [
+                "__M_writer('one\\ntwo\\n\\nthree ')",
+                "__M_writer(str(x))",
+                "__M_writer(' four\\n')",
+            ],
+        )
+        eq_(t.render(x=5), "one\ntwo\n\nthree 5 four\n")
+
+    def test_constant_expressions(self):
+        t = Template("""a ${"b"} c ${'d' | n} e ${"<f>" | h} ${5}""")
+        eq_(
+            self._writes(t),
+            [
+                "__M_writer('a b c d e ')",
+                '__M_writer(filters.html_escape("<f>" ))',
+                "__M_writer(' ')",
+                "__M_writer(str(5))",
+            ],
+        )
+        eq_(t.render(), "a b c d e &lt;f&gt; 5")
+
+    def test_constant_expression_page_filter(self):
+        t = Template("""<%page expression_filter="h"/>a ${"<b>"}""")
+        eq_(t.render(), "a &lt;b&gt;")
+
+    def test_control_lines_not_merged(self):
+        t = Template("""a
+% if x:
+b
+% endif
+c
+""")
+        eq_(len(self._writes(t)), 3)
+        eq_(t.render(x=True), "a\nb\nc\n")
+        eq_(t.render(x=False), "a\nc\n")